@@ -1,7 +1,10 @@
 
 # Database configurations
 DATABASE_CONFIGS = {
-    'sqlite': 'sqlite:///data/timetracker.db'
+    'sqlite': 'sqlite:///data/timetracker.db',
+    'read_pool_size': 4,              # read-only SQLite connections kept for readers
+    'write_group_size': 100,          # queued write jobs committed together by the writer thread
+    'busy_timeout': 30,               # seconds a SQLite connection waits for a lock before "database is locked"
 }
 
 # Device configurations
@@ -9,16 +12,117 @@ DEVICE_CONFIGS = {
     'scan_interval': 5,              # seconds
     'connection_timeout': 30,         # seconds
     'max_retry_attempts': 3,
+    'retry_base_delay': 2,            # seconds, doubled per consecutive failure
+    'retry_max_delay': 300,           # seconds, cap for backoff
+    'circuit_reset_timeout': 600,     # seconds an open circuit waits before a probe
+    'probe_timeout': 2,               # seconds, TCP probe before a full connect
+    'user_push_batch_size': 200,      # users written per disable window
+    'log_rotation_min_records': 5000, # clear a device log once it holds this many archived punches
+    'raw_dump_enabled': True,         # keep raw device buffers for offline replay
+    'raw_dump_location': 'data/dumps/',
+    'raw_dump_retention_months': 3,   # months of raw buffers kept besides the current one
+    'clock_drift_tolerance': 2,       # seconds; smaller offsets are measurement noise and ignored
+    'clock_sync_threshold': 30,       # seconds; sync_clocks() resets terminals drifting further
+    'daemon_stats_file': 'data/sync_daemon.json', # runtime stats of services.sync_daemon, rewritten every cycle
+    'spool_enabled': True,            # journal downloaded punches to disk before storing them
+    'spool_location': 'data/spool/',
+    'spool_segment_bytes': 4 * 1024 * 1024, # spool segment size before a new one is started
+    'spool_replay_batch': 20000,      # spooled punches stored per replay transaction
+    'spool_retry_seconds': 30,        # seconds between replays (and database retries) during an outage
+    'spool_store_wait': 10,           # seconds a sync cycle waits for its punches to be stored
+    'device_cache_file': 'data/device_cache.json', # devices and employee numbers synced during an outage
     'supported_protocols': ['tcp', 'udp', 'serial']
 }
 
+# Attendance processing
+ATTENDANCE_CONFIGS = {
+    'standard_work_minutes': 480,     # scheduled minutes per day when no shift applies
+    'max_shift_hours': 16,            # longer in/out spans are treated as missing punches
+    'max_break_minutes': 120,         # out/in gaps up to this long count as a break
+    'default_shift_start': '09:00',   # lateness reference for employees without a shift
+    'default_shift_end': '17:00',
+    'duplicate_window_seconds': 60,   # repeat punches closer than this are duplicates
+    'device_travel_seconds': 120,     # punches on two devices closer than this are suspicious
+    'shift_window_minutes': 180,      # punches further than this outside the shift are suspicious
+    'recompute_interval_seconds': 30, # how often the recompute worker drains dirty days
+    'recompute_batch_size': 500,      # employee-days refreshed per batch
+    'roll_forward_days': 7,           # days back the daily roll-forward fills in rows missed while it did not run
+    'weekend_days': (5, 6),           # default rest days (0=Monday) for organizations without their own
+    'hot_months': 12,                 # full months kept in attendance_records; older ones are archived
+    'archive_batch_size': 2000,       # punches moved per archive transaction
+    'archive_batch_pause': 0.05,      # seconds between archive batches
+    'archive_file_location': 'data/archive/', # columnar punch files of archived months
+    'archive_file_level': 6,          # zlib level of the punch file columns; 0 stores them uncompressed
+}
+
+# Leave management
+LEAVE_CONFIGS = {
+    # Leave types created for each organization, keyed by Leave.leave_type code:
+    # (display name, days credited per year or None, carried forward into the next year)
+    'default_types': {
+        'vacation': ('Vacation', 20, True),
+        'sick': ('Sick Leave', 10, False),
+        'personal': ('Personal Leave', 5, False),
+        'other': ('Other', None, False),
+    },
+}
+
+# Payroll aggregation
+PAYROLL_CONFIGS = {
+    'workers': None,                  # processes for month-end runs; None uses every core
+    'partition_size': 250,            # employees per partition handed to a worker
+    'parallel_min_employees': 500,    # smaller runs are computed in-process
+}
+
+# Report generation
+REPORT_CONFIGS = {
+    'output_location': 'data/reports/',
+    'fetch_size': 1000,               # rows pulled per round trip from the streaming cursor
+    'rows_per_table': 40,             # rows per PDF table block; one block is rendered at a time
+    'sync_log_days': 30,              # history covered by the Device Sync Logs report
+    'export_page_size': 5000,         # punches fetched per keyset page by the Excel export
+    'excel_max_rows': 1048576,        # Excel's sheet limit; exports continue on a new sheet
+    'cache_location': 'data/report_cache/',
+    'cache_max_bytes': 256 * 1024 * 1024, # least recently used entries are evicted beyond this
+}
+
 # Backup configurations
 BACKUP_CONFIGS = {
     'auto_backup': True,
     'backup_interval': 'daily',       # daily, weekly, monthly
     'backup_time': '02:00',          # HH:MM format
     'retention_days': 30,
-    'backup_location': 'data/backups/'
+    'backup_location': 'data/backups/',
+    'full_every_days': 7,             # other runs store only the pages changed since the previous backup
+    'compress': True,                 # gzip backup files
+    'step_pages': 1024,               # SQLite pages copied per online backup step
+    'step_sleep': 0.005,              # seconds yielded between steps
+    'verify': True,                   # PRAGMA quick_check on the copy before it is kept
+}
+
+# Scheduled jobs
+SCHEDULER_CONFIGS = {
+    'enabled': True,
+    'idle_minutes': 15,               # off-peak jobs wait until the UI has been idle this long
+    'defer_minutes': 10,              # retry delay for an off-peak job that found the UI in use
+    'activity_marker': 'data/.ui_activity',
+    'history_days': 90,               # job_runs rows kept
+    # Job class -> concurrent runs, seconds a run may start late (missed or deferred),
+    # and whether it is off-peak work that must not overlap interactive use
+    'classes': {
+        'device': {'workers': 1, 'misfire_grace': 300, 'off_peak': False},
+        'maintenance': {'workers': 1, 'misfire_grace': 3 * 3600, 'off_peak': True},
+        'report': {'workers': 1, 'misfire_grace': 3 * 3600, 'off_peak': True},
+    },
+    # Job id -> callable, class and schedule ('every_minutes' or daily 'at' HH:MM, off-peak
+    # classes at night). The database backup is scheduled from BACKUP_CONFIGS.
+    'jobs': {
+        'device_sync': {'func': 'tasks.jobs:sync_devices', 'class': 'device', 'every_minutes': 15},
+        'attendance_roll_forward': {'func': 'tasks.jobs:roll_attendance_forward', 'class': 'maintenance', 'at': '00:05'},
+        'device_maintenance': {'func': 'tasks.jobs:device_maintenance', 'class': 'maintenance', 'at': '01:30'},
+        'attendance_archive': {'func': 'tasks.jobs:archive_attendance', 'class': 'maintenance', 'at': '03:00'},
+        'report_prewarm': {'func': 'tasks.jobs:prewarm_reports', 'class': 'report', 'at': '04:00'},
+    },
 }
 
 # Application settings
@@ -0,0 +1,212 @@
+"""
+Work-hours engine.
+
+Punches are handled as parallel NumPy arrays sorted by employee and time
+(employee_id, punch time in epoch seconds, punch kind code). Pairing works
+on "this punch vs. the next one" masks, and per employee-day totals are
+reduced over contiguous groups, so a month for thousands of employees is a
+handful of array operations rather than a Python loop per punch.
+
+Rules:
+- in/break_end followed by out/break_start is worked time
+- break_start followed by break_end, or out followed by in within
+  max_break_minutes, is break time
+- a span longer than max_shift_hours is not paired (missing punch)
+- all segments of a session count towards the day of the session's first
+  in punch, so overnight shifts land on the day they started
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from config import ATTENDANCE_CONFIGS
+
+PUNCH_IN = 0
+PUNCH_OUT = 1
+BREAK_START = 2
+BREAK_END = 3
+
+PUNCH_CODES = {'in': PUNCH_IN, 'out': PUNCH_OUT, 'break_start': BREAK_START, 'break_end': BREAK_END}
+
+# Punches with these statuses never count towards hours
+EXCLUDED_STATUSES = ('invalid', 'duplicate')
+
+RESULT_COLUMNS = ['employee_id', 'work_date', 'worked_minutes', 'break_minutes',
+                  'overtime_minutes', 'missing_punches', 'first_in', 'last_out']
+
+
+def to_arrays(employee_ids, punch_times, punch_types):
+    """Build sorted (emp, ts, kind) arrays from sequences of ids, datetimes and type names."""
+    emp = np.asarray(employee_ids, dtype=np.int64)
+    ts = np.asarray(pd.to_datetime(pd.Series(punch_times)).values.astype('datetime64[s]').astype(np.int64))
+    kind = pd.Series(punch_types, dtype=object).map(PUNCH_CODES).fillna(PUNCH_OUT).to_numpy(np.int8)
+    order = np.lexsort((ts, emp))
+    return emp[order], ts[order], kind[order]
+
+
+def load_punches(session, start_date, end_date, employee_ids=None):
+    """
+    Load punches from start_date through end_date (inclusive) as sorted arrays.
+    One extra day is read so overnight sessions starting on end_date close.
+    """
+    from database.archive import file_months, punch_file_path, punch_source
+    from database.columnar import ENUM_LABELS, PunchFile
+
+    start = datetime.combine(start_date, datetime.min.time())
+    end = datetime.combine(end_date + timedelta(days=2), datetime.min.time())
+    # Archived months with a current punch file are read from it; the rest comes from SQL
+    months = file_months(session, start, end)
+    punches = punch_source(session, start, end, skip=months)
+    query = session.query(
+        punches.c.employee_id, punches.c.punch_time, punches.c.punch_type
+    ).filter(
+        punches.c.punch_time >= start,
+        punches.c.punch_time < end,
+        punches.c.status.notin_(EXCLUDED_STATUSES)
+    )
+    if employee_ids is not None:
+        employee_ids = list(employee_ids)
+        query = query.filter(punches.c.employee_id.in_(employee_ids))
+    rows = query.all()
+    parts = [to_arrays(*zip(*rows))] if rows else []
+
+    excluded = [ENUM_LABELS['status'].index(status) for status in EXCLUDED_STATUSES]
+    bounds = np.array([start, end], dtype='datetime64[s]').astype(np.int64)
+    for month in months:
+        with PunchFile(punch_file_path(month)) as punch_file:
+            emp = punch_file.column('employee_id')
+            ts = punch_file.column('punch_time').astype(np.int64)
+            keep = (ts >= bounds[0]) & (ts < bounds[1]) & ~np.isin(punch_file.column('status'), excluded)
+            if employee_ids is not None:
+                keep &= np.isin(emp, np.asarray(employee_ids, dtype=np.int64))
+            # File punch_type codes are PUNCH_CODES
+            parts.append((emp[keep], ts[keep], punch_file.column('punch_type')[keep]))
+    if not parts:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.int8)
+    if len(parts) == 1:
+        return parts[0]
+    emp, ts, kind = (np.concatenate(arrays) for arrays in zip(*parts))
+    order = np.lexsort((ts, emp))
+    return emp[order], ts[order], kind[order]
+
+
+def _next(values, fill):
+    out = np.empty_like(values)
+    out[:-1] = values[1:]
+    out[-1:] = fill
+    return out
+
+
+def compute_work_hours(emp, ts, kind, scheduled_minutes=None, max_shift_hours=None, max_break_minutes=None):
+    """
+    Pair sorted punch arrays into per employee-day totals.
+
+    scheduled_minutes is the expected working time per day (scalar); use
+    apply_overtime() for per-day schedules. Returns a DataFrame with
+    RESULT_COLUMNS, one row per employee and session day.
+    """
+    n = len(emp)
+    if n == 0:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    if scheduled_minutes is None:
+        scheduled_minutes = ATTENDANCE_CONFIGS['standard_work_minutes']
+    max_span = (max_shift_hours or ATTENDANCE_CONFIGS['max_shift_hours']) * 3600
+    max_break = (max_break_minutes or ATTENDANCE_CONFIGS['max_break_minutes']) * 60
+
+    same_next = _next(emp, -1) == emp
+    gap = _next(ts, 0) - ts
+    next_kind = _next(kind, -1)
+
+    opens_work = (kind == PUNCH_IN) | (kind == BREAK_END)
+    work = opens_work & same_next & ((next_kind == PUNCH_OUT) | (next_kind == BREAK_START)) & (gap <= max_span)
+    explicit_break = (kind == BREAK_START) & same_next & (next_kind == BREAK_END) & (gap <= max_span)
+    implicit_break = (kind == PUNCH_OUT) & same_next & (next_kind == PUNCH_IN) & (gap <= max_break)
+    breaks = explicit_break | implicit_break
+
+    # An in punch starts a new session unless it ends a short out/in break
+    prev_implicit = np.zeros(n, dtype=bool)
+    prev_implicit[1:] = implicit_break[:-1]
+    new_emp = np.ones(n, dtype=bool)
+    new_emp[1:] = emp[1:] != emp[:-1]
+    session_start = new_emp | ((kind == PUNCH_IN) & ~prev_implicit)
+    start_idx = np.maximum.accumulate(np.where(session_start, np.arange(n), 0))
+    day = ts[start_idx] // 86400
+
+    prev_work = np.zeros(n, dtype=bool)
+    prev_work[1:] = work[:-1]
+    missing = (opens_work & ~work) | ((kind == PUNCH_OUT) & ~prev_work)
+
+    # Sessions are contiguous in sorted order, so each employee-day is a run of rows
+    group_key = emp * 1_000_000 + day
+    starts = np.flatnonzero(np.r_[True, group_key[1:] != group_key[:-1]])
+
+    worked = np.add.reduceat(np.where(work, gap, 0), starts) / 60.0
+    break_time = np.add.reduceat(np.where(breaks, gap, 0), starts) / 60.0
+    missing_count = np.add.reduceat(missing.astype(np.int64), starts)
+    big = np.iinfo(np.int64).max
+    first_in = np.minimum.reduceat(np.where(kind == PUNCH_IN, ts, big), starts)
+    last_out = np.maximum.reduceat(np.where(kind == PUNCH_OUT, ts, -1), starts)
+    first_in_at = first_in.astype('datetime64[s]')
+    first_in_at[first_in == big] = np.datetime64('NaT')
+    last_out_at = last_out.astype('datetime64[s]')
+    last_out_at[last_out < 0] = np.datetime64('NaT')
+
+    result = pd.DataFrame({
+        'employee_id': emp[starts],
+        'work_date': day[starts].astype('datetime64[D]'),
+        'worked_minutes': worked,
+        'break_minutes': break_time,
+        'overtime_minutes': np.maximum(worked - scheduled_minutes, 0.0),
+        'missing_punches': missing_count,
+        'first_in': first_in_at,
+        'last_out': last_out_at,
+    })
+    return result
+
+
+def apply_overtime(result, scheduled_minutes):
+    """Recompute overtime with a per-row scheduled_minutes array (e.g. from shifts)."""
+    scheduled = np.asarray(scheduled_minutes, dtype=np.float64)
+    result['overtime_minutes'] = np.maximum(result['worked_minutes'].to_numpy() - scheduled, 0.0)
+    return result
+
+
+def work_hours_report(session, start_date, end_date, employee_ids=None, scheduled_minutes=None):
+    """Per employee-day worked, break and overtime minutes for a date range."""
+    emp, ts, kind = load_punches(session, start_date, end_date, employee_ids)
+    result = compute_work_hours(emp, ts, kind, scheduled_minutes)
+    if result.empty:
+        return result
+    in_range = (result['work_date'] >= np.datetime64(start_date)) & (result['work_date'] <= np.datetime64(end_date))
+    return result[in_range].reset_index(drop=True)
+
+
+def calculate_work_hours(punches, shift=None):
+    """
+    Calculate work hours for one employee-day (internal API signature).
+    punches: AttendanceRecord-like objects; shift: object with duration_minutes
+    and break_minutes, or None for the standard day.
+    """
+    punches = [p for p in punches if getattr(p, 'status', 'valid') not in EXCLUDED_STATUSES]
+    scheduled = ATTENDANCE_CONFIGS['standard_work_minutes']
+    if shift is not None:
+        scheduled = (shift.duration_minutes or scheduled) - (shift.break_minutes or 0)
+
+    if not punches:
+        return {'total_hours': 0.0, 'regular_hours': 0.0, 'overtime_hours': 0.0,
+                'break_hours': 0.0, 'missing_punches': 0, 'status': 'absent'}
+
+    emp, ts, kind = to_arrays([0] * len(punches), [p.punch_time for p in punches],
+                              [p.punch_type for p in punches])
+    totals = compute_work_hours(emp, ts, kind, scheduled).sum(numeric_only=True)
+    worked = float(totals['worked_minutes'])
+    overtime = float(totals['overtime_minutes'])
+    return {
+        'total_hours': round(worked / 60, 2),
+        'regular_hours': round((worked - overtime) / 60, 2),
+        'overtime_hours': round(overtime / 60, 2),
+        'break_hours': round(float(totals['break_minutes']) / 60, 2),
+        'missing_punches': int(totals['missing_punches']),
+        'status': 'present' if worked >= scheduled / 2 else 'half_day',
+    }
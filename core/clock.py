@@ -0,0 +1,65 @@
+"""
+Device clock and time zone normalization.
+
+Terminals keep their own wall clock, which drifts and may be set to another
+zone than the organization's. Every connection measures the device clock
+against the host clock; incoming punch batches are then shifted by that
+offset and converted to the organization's zone in one vectorized pass
+before they are deduplicated and stored.
+"""
+import logging
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+
+from config import DEVICE_CONFIGS
+
+logger = logging.getLogger(__name__)
+
+
+def host_now(tz_name=None):
+    """Naive wall-clock time on the host, in tz_name if given."""
+    if tz_name:
+        return datetime.now(ZoneInfo(tz_name)).replace(tzinfo=None)
+    return datetime.now()
+
+
+def measure_offset(adapter, device_tz=None):
+    """
+    Device clock minus host clock in whole seconds, or None if the device
+    cannot report its time. The host time is taken on both sides of the read
+    and the midpoint is used, so round-trip latency cancels out. Offsets below
+    clock_drift_tolerance are reported as 0.
+    """
+    before = host_now(device_tz)
+    device_time = adapter.get_time()
+    after = host_now(device_tz)
+    if device_time is None:
+        return None
+    reference = before + (after - before) / 2
+    offset = round((device_time - reference).total_seconds())
+    if abs(offset) < DEVICE_CONFIGS.get('clock_drift_tolerance', 0):
+        return 0
+    return offset
+
+
+def normalize_times(times, offset_seconds=None, source_tz=None, target_tz=None):
+    """
+    Correct device timestamps: subtract the device clock offset, then convert
+    from the device's zone to the organization's. Both zones must be known
+    for a conversion; otherwise times stay in device local time. Returns a
+    list of naive datetimes in the same order.
+    """
+    if len(times) == 0:
+        return []
+    values = pd.DatetimeIndex(pd.to_datetime(list(times)))
+    if offset_seconds:
+        values = values - pd.Timedelta(seconds=offset_seconds)
+    if source_tz and target_tz and source_tz != target_tz:
+        # Ambiguous fall-back hours are read as standard time, spring-forward gaps moved forward
+        values = values.tz_localize(source_tz, ambiguous=np.zeros(len(values), dtype=bool),
+                                    nonexistent='shift_forward')
+        values = values.tz_convert(target_tz).tz_localize(None)
+    return list(values.to_pydatetime())
@@ -0,0 +1,457 @@
+"""
+Incremental daily attendance.
+
+Every write that can change an employee-day (punches, leaves, shift
+assignments and definitions, holidays) marks its (employee_id, date) keys
+dirty by flagging the daily_attendance row as unprocessed. The recompute
+worker then refreshes only unprocessed rows, in batches, so keeping daily
+and monthly figures current costs in proportion to what changed.
+
+A holiday marks every employee of its organization for that day. ORM
+writes are tracked automatically through mapper events. Bulk Core inserts
+(device ingestion) call mark_dirty() directly. Writes only mark days up to
+today, so a daily job (roll_forward()) gives every active employee a row
+for each new day, which covers future-dated leaves, holidays and shifts and
+employees who never punch.
+
+A batch is computed per run of consecutive dirty days of an employee,
+employees sharing a run together, so scattered dirty days (an old edit
+and today) never load the span between them.
+"""
+import logging
+import threading
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, bindparam, case, event, func, insert, update
+from sqlalchemy.orm import Session
+
+from config import ATTENDANCE_CONFIGS
+
+logger = logging.getLogger(__name__)
+
+# Keep IN (...) lists under SQLite's bound parameter limit
+CHUNK_SIZE = 500
+
+# data_versions scopes of the indexes a recompute reads
+INDEX_SCOPES = ('leaves', 'shifts', 'calendar')
+
+
+def day_range(start_date, end_date):
+    day = start_date
+    while day <= end_date:
+        yield day
+        day += timedelta(days=1)
+
+
+def punch_keys(rows):
+    """
+    Keys touched by new punches: the punch's own day and the day before, since
+    a punch after midnight can close a session that started the previous day.
+    rows: (employee_id, punch_time) pairs.
+    """
+    keys = set()
+    for emp_id, punch_time in rows:
+        day = punch_time.date()
+        keys.add((emp_id, day))
+        keys.add((emp_id, day - timedelta(days=1)))
+    return keys
+
+
+def range_keys(employee_id, start_date, end_date, until=None):
+    """Keys for a date range, clipped at `until` (today) since future days hold nothing yet."""
+    until = until or date.today()
+    if start_date is None:
+        return set()
+    end_date = min(end_date or until, until)
+    return {(employee_id, day) for day in day_range(start_date, end_date)}
+
+
+def dirty_runs(keys):
+    """Group (employee_id, date) keys into {(start, end): [employee_id, ...]} runs of consecutive days."""
+    by_employee = {}
+    for emp_id, day in keys:
+        by_employee.setdefault(emp_id, set()).add(day)
+    runs = {}
+    for emp_id, days in by_employee.items():
+        days = sorted(days)
+        start = previous = days[0]
+        for day in days[1:]:
+            if day - previous > timedelta(days=1):
+                runs.setdefault((start, previous), []).append(emp_id)
+                start = day
+            previous = day
+        runs.setdefault((start, previous), []).append(emp_id)
+    return runs
+
+
+def mark_dirty(session, keys):
+    """Flag employee-days for recomputation, creating their rows when missing."""
+    from database.models import DailyAttendance
+
+    keys = sorted(set(keys))
+    if not keys:
+        return 0
+    now = datetime.utcnow()
+    for pos in range(0, len(keys), CHUNK_SIZE):
+        chunk = keys[pos:pos + CHUNK_SIZE]
+        employees = {k[0] for k in chunk}
+        days = [k[1] for k in chunk]
+        existing = {}
+        for row_id, emp_id, day in session.query(
+            DailyAttendance.id, DailyAttendance.employee_id, DailyAttendance.attendance_date
+        ).filter(
+            DailyAttendance.employee_id.in_(employees),
+            DailyAttendance.attendance_date >= min(days),
+            DailyAttendance.attendance_date <= max(days)
+        ):
+            existing[(emp_id, day)] = row_id
+
+        ids = [existing[k] for k in chunk if k in existing]
+        if ids:
+            session.execute(
+                update(DailyAttendance).where(DailyAttendance.id.in_(ids)).values(is_processed=False, updated_at=now)
+            )
+        missing = [{'employee_id': emp_id, 'attendance_date': day, 'status': 'absent',
+                    'is_processed': False, 'created_at': now, 'updated_at': now}
+                   for emp_id, day in chunk if (emp_id, day) not in existing]
+        if missing:
+            session.execute(insert(DailyAttendance), missing)
+    logger.debug(f"Marked {len(keys)} employee-days dirty")
+    return len(keys)
+
+
+def roll_forward(session, today=None, days=None):
+    """
+    Mark the employee-days of active employees that have no row yet, from
+    roll_forward_days back (runs of the daily job that were missed) through
+    today. Does not commit. Returns the number of keys marked.
+    """
+    from database.models import DailyAttendance, Employee
+
+    today = today or date.today()
+    start = today - timedelta(days=(days or ATTENDANCE_CONFIGS['roll_forward_days']) - 1)
+    existing = set(session.query(DailyAttendance.employee_id, DailyAttendance.attendance_date).filter(
+        DailyAttendance.attendance_date >= start,
+        DailyAttendance.attendance_date <= today
+    ))
+    keys = set()
+    for emp_id, hired in session.query(Employee.id, Employee.hire_date).filter(Employee.status == 'active'):
+        for day in day_range(max(start, hired or start), today):
+            if (emp_id, day) not in existing:
+                keys.add((emp_id, day))
+    return mark_dirty(session, keys)
+
+
+def day_status(row, on_leave, scheduled_minutes, day_type):
+    """daily_attendance status for one attendance_exceptions() row (None when there were no punches)."""
+    if row is None or (not row['worked_minutes'] and row['first_in'] is None):
+        if day_type != 'working':
+            return day_type
+        if on_leave:
+            return 'leave'
+        if row is not None and row['absent']:
+            return 'absent'
+        return 'off'
+    if row['late_minutes'] > 0:
+        return 'late'
+    if row['worked_minutes'] < scheduled_minutes / 2:
+        return 'half_day'
+    return 'present'
+
+
+def recompute_batch(session, batch_size=None, resolver=None):
+    """
+    Recompute one batch of dirty employee-days, read through session and
+    stored by the database writer. Returns the number refreshed.
+    """
+    from database.writer import db_writer
+    from core.leave_index import leave_index
+    from core.shifts import attendance_exceptions, shift_resolver
+    from core.work_calendar import work_calendar
+    from database.models import DailyAttendance, Employee
+
+    resolver = resolver or shift_resolver
+    batch_size = batch_size or ATTENDANCE_CONFIGS['recompute_batch_size']
+    dirty = session.query(
+        DailyAttendance.id, DailyAttendance.employee_id, DailyAttendance.attendance_date, DailyAttendance.updated_at
+    ).filter(DailyAttendance.is_processed == False).order_by(
+        DailyAttendance.attendance_date, DailyAttendance.employee_id
+    ).limit(batch_size).all()
+    if not dirty:
+        return 0
+
+    employees = sorted({r.employee_id for r in dirty})
+    days = {}
+    for (start, end), run_employees in dirty_runs((r.employee_id, r.attendance_date) for r in dirty).items():
+        frame = attendance_exceptions(session, start, end, run_employees, resolver)
+        for rec in frame.to_dict('records'):
+            rec['first_in'] = None if rec['first_in'] is None or rec['first_in'] != rec['first_in'] else rec['first_in'].to_pydatetime()
+            rec['last_out'] = None if rec['last_out'] is None or rec['last_out'] != rec['last_out'] else rec['last_out'].to_pydatetime()
+            days[(int(rec['employee_id']), rec['work_date'].date())] = rec
+
+    on_leave = leave_index.on_leave_many([r.employee_id for r in dirty], [r.attendance_date for r in dirty])
+
+    orgs = dict(session.query(Employee.id, Employee.organization_id).filter(Employee.id.in_(employees)))
+    scheduled = resolver.tables()['scheduled']
+    now = datetime.utcnow()
+    params = []
+    for (row_id, emp_id, day, marked_at), leave in zip(dirty, on_leave):
+        rec = days.get((emp_id, day))
+        shift_id = int(rec['shift_id']) if rec is not None else 0
+        worked = float(rec['worked_minutes']) if rec is not None else 0.0
+        overtime = float(rec['overtime_minutes']) if rec is not None else 0.0
+        params.append({
+            'b_id': row_id,
+            'b_marked': marked_at,
+            'shift_id': shift_id or None,
+            'first_in': rec['first_in'] if rec is not None else None,
+            'last_out': rec['last_out'] if rec is not None else None,
+            'total_hours': round(worked / 60, 2),
+            'regular_hours': round((worked - overtime) / 60, 2),
+            'overtime_hours': round(overtime / 60, 2),
+            'break_hours': round(float(rec['break_minutes']) / 60, 2) if rec is not None else 0.0,
+            'late_minutes': int(round(rec['late_minutes'])) if rec is not None else 0,
+            'early_departure_minutes': int(round(rec['early_minutes'])) if rec is not None else 0,
+            'status': day_status(rec, bool(leave), float(scheduled[shift_id]),
+                                  work_calendar.day_type(orgs.get(emp_id), day)),
+            'is_processed': True,
+            'processed_at': now,
+        })
+
+    # Rows marked again while we were computing keep their dirty flag
+    stmt = update(DailyAttendance).where(and_(
+        DailyAttendance.id == bindparam('b_id'),
+        DailyAttendance.updated_at == bindparam('b_marked')
+    )).values({k: bindparam(k) for k in params[0] if not k.startswith('b_')})
+
+    def store_batch(write_session):
+        write_session.connection().execute(stmt, params)
+
+    db_writer.call(store_batch)
+    # End the read transaction so the next batch sees this one stored
+    session.rollback()
+    return len(params)
+
+
+def refresh_indexes(session, seen):
+    """
+    Invalidate the leave, shift and calendar indexes whose data_versions
+    counter moved since the last call (seen: {scope: version}, updated in
+    place). Their own listeners only see commits made in this process; this
+    covers edits made by another one (the desktop app, for the sync daemon).
+    """
+    from core.leave_index import leave_index
+    from core.shifts import shift_resolver
+    from core.work_calendar import work_calendar
+    from database.models import DataVersion
+
+    current = dict(session.query(DataVersion.scope, DataVersion.version).filter(
+        DataVersion.scope.in_(INDEX_SCOPES)))
+    changed = {scope for scope in INDEX_SCOPES if scope in seen and seen[scope] != current.get(scope)}
+    seen.update({scope: current.get(scope) for scope in INDEX_SCOPES})
+    if 'leaves' in changed:
+        leave_index.invalidate()
+    if 'shifts' in changed:
+        shift_resolver.invalidate()
+    if 'calendar' in changed:
+        work_calendar.invalidate()
+    if changed:
+        logger.info(f"Reloading indexes changed elsewhere: {', '.join(sorted(changed))}")
+    return changed
+
+
+def recompute_dirty(session_factory=None, batch_size=None, max_batches=None, versions=None):
+    """
+    Drain dirty employee-days batch by batch. Returns the total refreshed.
+    With versions (see refresh_indexes), indexes edited by other processes
+    are reloaded first.
+    """
+    if session_factory is None:
+        from database.connection import db_manager
+        session_factory = db_manager.get_read_session()
+    total = 0
+    batches = 0
+    session = session_factory()
+    try:
+        if versions is not None:
+            refresh_indexes(session, versions)
+        while max_batches is None or batches < max_batches:
+            count = recompute_batch(session, batch_size)
+            if not count:
+                break
+            total += count
+            batches += 1
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error recomputing daily attendance: {e}")
+    finally:
+        session.close()
+    if total:
+        logger.info(f"Recomputed {total} employee-days")
+    return total
+
+
+def monthly_summary(session, year, month, employee_ids=None):
+    """Per-employee totals for a month in one grouped query over daily_attendance."""
+    from database.models import DailyAttendance
+
+    start = date(year, month, 1)
+    end = date(year + month // 12, month % 12 + 1, 1)
+
+    def count(status):
+        return func.sum(case((DailyAttendance.status == status, 1), else_=0)).label(f"{status}_days")
+
+    query = session.query(
+        DailyAttendance.employee_id,
+        func.sum(DailyAttendance.total_hours).label('total_hours'),
+        func.sum(DailyAttendance.overtime_hours).label('overtime_hours'),
+        func.sum(DailyAttendance.late_minutes).label('late_minutes'),
+        count('present'), count('late'), count('half_day'), count('absent'), count('leave'),
+        func.sum(case((DailyAttendance.is_processed == False, 1), else_=0)).label('pending_days'),
+    ).filter(
+        DailyAttendance.attendance_date >= start,
+        DailyAttendance.attendance_date < end
+    )
+    if employee_ids is not None:
+        query = query.filter(DailyAttendance.employee_id.in_(list(employee_ids)))
+    return [row._asdict() for row in query.group_by(DailyAttendance.employee_id).all()]
+
+
+class RecomputeWorker(threading.Thread):
+    """
+    Background thread that drains dirty employee-days every few seconds. With
+    watch_versions, leaves, shifts and holidays edited by another process are
+    picked up from data_versions before each pass.
+    """
+
+    def __init__(self, session_factory=None, interval=None, batch_size=None, watch_versions=False):
+        super().__init__(name='recompute-worker', daemon=True)
+        self.session_factory = session_factory
+        self.interval = interval or ATTENDANCE_CONFIGS['recompute_interval_seconds']
+        self.batch_size = batch_size
+        self.versions = {} if watch_versions else None
+        self._stop_event = threading.Event()
+        self._wake = threading.Event()
+
+    def wake(self):
+        """Run the next pass now instead of waiting for the interval."""
+        self._wake.set()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake.set()
+
+    def run(self):
+        logger.info("Recompute worker started")
+        while not self._stop_event.is_set():
+            recompute_dirty(self.session_factory, self.batch_size, versions=self.versions)
+            self._wake.wait(self.interval)
+            self._wake.clear()
+        logger.info("Recompute worker stopped")
+
+
+# --- change tracking -------------------------------------------------------
+
+def _pending(session):
+    return session.info.setdefault('dirty_days', set())
+
+
+def _old_value(target, name):
+    from sqlalchemy import inspect
+    history = inspect(target).attrs[name].history
+    return history.deleted[0] if history.deleted else None
+
+
+def _track_leave(mapper, connection, target):
+    from sqlalchemy.orm import object_session
+    session = object_session(target)
+    if session is None:
+        return
+    keys = _pending(session)
+    keys.update(range_keys(target.employee_id, target.start_date, target.end_date))
+    old_start = _old_value(target, 'start_date')
+    old_end = _old_value(target, 'end_date')
+    if old_start or old_end:
+        keys.update(range_keys(target.employee_id, old_start or target.start_date, old_end or target.end_date))
+
+
+def _track_assignment(mapper, connection, target):
+    from sqlalchemy.orm import object_session
+    session = object_session(target)
+    if session is None:
+        return
+    keys = _pending(session)
+    keys.update(range_keys(target.employee_id, target.effective_date, target.end_date))
+    old_start = _old_value(target, 'effective_date')
+    old_end = _old_value(target, 'end_date')
+    if old_start or old_end:
+        keys.update(range_keys(target.employee_id, old_start or target.effective_date, old_end or target.end_date))
+
+
+def _track_shift(mapper, connection, target):
+    from sqlalchemy.orm import object_session
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('dirty_shifts', set()).add(target.id)
+
+
+def _track_holiday(mapper, connection, target):
+    from sqlalchemy.orm import object_session
+    session = object_session(target)
+    if session is None:
+        return
+    days = session.info.setdefault('dirty_holidays', set())
+    for day in (target.holiday_date, _old_value(target, 'holiday_date')):
+        if day is not None:
+            days.add((target.organization_id, day))
+            if target.is_recurring:
+                try:
+                    days.add((target.organization_id, day.replace(year=date.today().year)))
+                except ValueError:
+                    pass
+
+
+def _after_flush_postexec(session, flush_context):
+    keys = session.info.pop('dirty_days', None)
+    shift_ids = session.info.pop('dirty_shifts', None)
+    holidays = session.info.pop('dirty_holidays', None)
+    if holidays:
+        from database.models import Employee
+        keys = keys or set()
+        today = date.today()
+        for org_id in {org for org, _ in holidays}:
+            days = [day for org, day in holidays if org == org_id and day <= today]
+            if not days:
+                continue
+            for (emp_id,) in session.query(Employee.id).filter(Employee.organization_id == org_id):
+                keys.update((emp_id, day) for day in days)
+    if shift_ids:
+        from database.models import EmployeeShift
+        keys = keys or set()
+        for emp_id, start, end in session.query(
+            EmployeeShift.employee_id, EmployeeShift.effective_date, EmployeeShift.end_date
+        ).filter(EmployeeShift.shift_id.in_(list(shift_ids))):
+            keys.update(range_keys(emp_id, start, end))
+    if keys:
+        mark_dirty(session, keys)
+
+
+def _after_rollback(session):
+    session.info.pop('dirty_days', None)
+    session.info.pop('dirty_shifts', None)
+    session.info.pop('dirty_holidays', None)
+
+
+def _register_listeners():
+    from database.models import EmployeeShift, Holiday, Leave, Shift
+
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(Leave, name, _track_leave)
+        event.listen(EmployeeShift, name, _track_assignment)
+        event.listen(Holiday, name, _track_holiday)
+    event.listen(Shift, 'after_update', _track_shift)
+    event.listen(Session, 'after_flush_postexec', _after_flush_postexec)
+    event.listen(Session, 'after_rollback', _after_rollback)
+
+
+_register_listeners()
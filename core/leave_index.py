@@ -0,0 +1,224 @@
+"""
+In-memory index of approved leaves.
+
+Each employee's approved leaves are merged into disjoint, sorted day ranges
+so "is E on leave on D" is one bisect, and every employee is also listed
+under the months its leaves touch so "who is on leave on D" only checks the
+employees with leave in that month. Leave changes mark their employees
+stale on commit and only those employees are reloaded.
+"""
+import logging
+import threading
+from bisect import bisect_right
+from datetime import date
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# date(1970, 1, 1).toordinal(), to convert between ordinals and datetime64[D]
+EPOCH_ORDINAL = 719163
+
+
+def merge_ranges(ranges):
+    """Merge (start_ordinal, end_ordinal) pairs into disjoint sorted arrays."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    starts = np.array([m[0] for m in merged], np.int64)
+    ends = np.array([m[1] for m in merged], np.int64)
+    return starts, ends
+
+
+def month_keys(start_ordinal, end_ordinal):
+    first = date.fromordinal(start_ordinal)
+    last = date.fromordinal(end_ordinal)
+    return range(first.year * 12 + first.month - 1, last.year * 12 + last.month)
+
+
+class LeaveIndex:
+    def __init__(self, session_factory=None, employee_ids=None):
+        self._session_factory = session_factory
+        # With employee_ids, only those employees' leaves are ever loaded
+        self._scope = None if employee_ids is None else list(employee_ids)
+        self._lock = threading.RLock()
+        self._by_emp = {}       # employee_id -> (starts, ends)
+        self._months = {}       # year * 12 + month - 1 -> set of employee ids
+        self._emp_months = {}   # employee_id -> month keys it is listed under
+        self._loaded = False
+        self._stale = set()
+
+    def _session(self):
+        if self._session_factory is None:
+            from database.connection import db_manager
+            self._session_factory = db_manager.get_read_session()
+        return self._session_factory()
+
+    def invalidate(self, employee_ids=None):
+        with self._lock:
+            if employee_ids is None:
+                self._loaded = False
+                self._stale.clear()
+            else:
+                self._stale.update(employee_ids)
+
+    def _drop(self, emp_id):
+        self._by_emp.pop(emp_id, None)
+        for key in self._emp_months.pop(emp_id, ()):
+            members = self._months.get(key)
+            if members is not None:
+                members.discard(emp_id)
+                if not members:
+                    del self._months[key]
+
+    def _load(self, employee_ids=None):
+        from database.models import Leave
+
+        session = self._session()
+        try:
+            query = session.query(Leave.employee_id, Leave.start_date, Leave.end_date).filter(Leave.status == 'approved')
+            scope = employee_ids if employee_ids is not None else self._scope
+            if scope is not None:
+                query = query.filter(Leave.employee_id.in_(list(scope)))
+            grouped = {}
+            for emp_id, start, end in query.all():
+                if start and end and start <= end:
+                    grouped.setdefault(emp_id, []).append((start.toordinal(), end.toordinal()))
+        finally:
+            session.close()
+
+        if employee_ids is None:
+            self._by_emp, self._months, self._emp_months = {}, {}, {}
+        else:
+            for emp_id in employee_ids:
+                self._drop(emp_id)
+        for emp_id, ranges in grouped.items():
+            starts, ends = merge_ranges(ranges)
+            self._by_emp[emp_id] = (starts, ends)
+            keys = set()
+            for start, end in zip(starts, ends):
+                keys.update(month_keys(int(start), int(end)))
+            self._emp_months[emp_id] = keys
+            for key in keys:
+                self._months.setdefault(key, set()).add(emp_id)
+        if employee_ids is None:
+            self._loaded = True
+        logger.debug(f"Loaded approved leaves for {len(grouped)} employees")
+
+    def _ensure(self):
+        with self._lock:
+            if not self._loaded:
+                self._load()
+                self._stale.clear()
+            elif self._stale:
+                stale = list(self._stale)
+                self._stale.clear()
+                self._load(stale)
+
+    def _covers(self, emp_id, ordinal):
+        ranges = self._by_emp.get(emp_id)
+        if ranges is None:
+            return False
+        starts, ends = ranges
+        i = bisect_right(starts, ordinal) - 1
+        return i >= 0 and ends[i] >= ordinal
+
+    def is_on_leave(self, employee_id, day):
+        self._ensure()
+        return self._covers(employee_id, day.toordinal())
+
+    def on_leave(self, day):
+        """Ids of employees on approved leave on a date."""
+        self._ensure()
+        ordinal = day.toordinal()
+        with self._lock:
+            candidates = list(self._months.get(day.year * 12 + day.month - 1, ()))
+        return [emp_id for emp_id in candidates if self._covers(emp_id, ordinal)]
+
+    def leave_days(self, employee_id, start_date, end_date):
+        """Dates in [start_date, end_date] on which an employee is on leave."""
+        self._ensure()
+        ranges = self._by_emp.get(employee_id)
+        if ranges is None:
+            return []
+        starts, ends = ranges
+        first, last = start_date.toordinal(), end_date.toordinal()
+        days = []
+        for i in range(max(bisect_right(starts, first) - 1, 0), len(starts)):
+            if starts[i] > last:
+                break
+            for ordinal in range(max(int(starts[i]), first), min(int(ends[i]), last) + 1):
+                days.append(date.fromordinal(ordinal))
+        return days
+
+    def on_leave_many(self, employee_ids, dates):
+        """Vectorized is_on_leave() for parallel arrays of employee ids and dates."""
+        self._ensure()
+        emp = np.asarray(employee_ids, dtype=np.int64)
+        ordinals = np.asarray(dates, dtype='datetime64[D]').astype(np.int64) + EPOCH_ORDINAL
+        out = np.zeros(len(emp), dtype=bool)
+        for emp_id in np.unique(emp):
+            ranges = self._by_emp.get(int(emp_id))
+            if ranges is None:
+                continue
+            starts, ends = ranges
+            rows = np.flatnonzero(emp == emp_id)
+            i = np.searchsorted(starts, ordinals[rows], side='right') - 1
+            safe = np.maximum(i, 0)
+            out[rows] = (i >= 0) & (ends[safe] >= ordinals[rows])
+        return out
+
+    def leave_mask(self, employee_ids, start_date, end_date):
+        """Boolean matrix [employee, day] over a date range, for month-long reports."""
+        self._ensure()
+        employee_ids = list(employee_ids)
+        first, last = start_date.toordinal(), end_date.toordinal()
+        mask = np.zeros((len(employee_ids), max(last - first + 1, 0)), dtype=bool)
+        for row, emp_id in enumerate(employee_ids):
+            ranges = self._by_emp.get(emp_id)
+            if ranges is None:
+                continue
+            starts, ends = ranges
+            lo = np.clip(starts, first, last + 1) - first
+            hi = np.clip(ends + 1, first, last + 1) - first
+            for a, b in zip(lo, hi):
+                if b > a:
+                    mask[row, a:b] = True
+        return mask
+
+
+leave_index = LeaveIndex()
+
+
+def _track_leave(mapper, connection, target):
+    from sqlalchemy.orm import object_session
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('leave_index_employees', set()).add(target.employee_id)
+
+
+def _after_commit(session):
+    employees = session.info.pop('leave_index_employees', None)
+    if employees:
+        leave_index.invalidate(employees)
+
+
+def _after_rollback(session):
+    session.info.pop('leave_index_employees', None)
+
+
+def _register_listeners():
+    from database.models import Leave
+
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(Leave, name, _track_leave)
+    event.listen(Session, 'after_commit', _after_commit)
+    event.listen(Session, 'after_rollback', _after_rollback)
+
+
+_register_listeners()
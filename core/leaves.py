@@ -0,0 +1,329 @@
+"""
+Leave management logic.
+
+Balances are kept as an append-only ledger (leave_ledger) plus one running
+snapshot row per employee, leave type and year (leave_balances). Every
+ledger entry updates its snapshot in the same transaction, so a balance is a
+single-row lookup. Approved leaves are posted automatically when they are
+saved through the ORM: the days each leave should account for (split by
+month, counted with the working-day calendar) are compared with what is
+already posted for it and only the difference is appended. Deleting a leave
+appends the reversal of its days; its entries stay, with leave_id cleared.
+"""
+import logging
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import and_, event, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from config import LEAVE_CONFIGS
+from core.work_calendar import work_calendar
+
+logger = logging.getLogger(__name__)
+
+# Snapshot column moved by each entry type, and its sign in closing_balance
+ENTRY_COLUMNS = {
+    'opening': ('opening_balance', 1),
+    'earned': ('earned', 1),
+    'used': ('used', -1),
+    'adjusted': ('adjusted', 1),
+}
+
+
+def calculate_leave_days(start_date, end_date, include_weekends=False, org_id=None):
+    """
+    Calculate leave days between two dates (inclusive), excluding holidays and,
+    unless include_weekends, the organization's rest days.
+    """
+    return float(work_calendar.working_days(org_id, start_date, end_date, include_weekends))
+
+
+def calculate_leave_days_many(start_dates, end_dates, include_weekends=False, org_id=None):
+    """Vectorized calculate_leave_days() for parallel arrays of leave ranges."""
+    return work_calendar.working_days_many(org_id, start_dates, end_dates, include_weekends).astype(float)
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def days_by_month(start_date, end_date, include_weekends=False, org_id=None):
+    """{first day of month: leave days} for a date range."""
+    result = {}
+    current = month_start(start_date)
+    while current <= end_date:
+        following = date(current.year + current.month // 12, current.month % 12 + 1, 1)
+        days = work_calendar.working_days(org_id, max(start_date, current),
+                                          min(end_date, following - timedelta(days=1)), include_weekends)
+        if days:
+            result[current] = float(days)
+        current = following
+    return result
+
+
+def ensure_leave_types(session, org_id):
+    """Create the configured default leave types for an organization. Returns {code: LeaveType}."""
+    from database.models import LeaveType
+
+    def load():
+        return {t.leave_code: t for t in session.query(LeaveType).filter(LeaveType.organization_id == org_id)}
+
+    types = load()
+    # Core insert so this also works while the session is flushing
+    missing = [{'organization_id': org_id, 'leave_name': name, 'leave_code': code, 'max_days_per_year': max_days,
+                'carry_forward': carry, 'is_paid': True, 'include_weekends': False, 'active': True,
+                'created_at': datetime.utcnow()}
+               for code, (name, max_days, carry) in LEAVE_CONFIGS['default_types'].items() if code not in types]
+    if missing:
+        session.execute(insert(LeaveType), missing)
+        types = load()
+    return types
+
+
+def _balance_id(session, employee_id, leave_type, year):
+    """Snapshot row id for (employee, type, year), opening it with carry forward and entitlement."""
+    from database.models import LeaveBalance, LeaveLedgerEntry
+
+    key = and_(LeaveBalance.employee_id == employee_id,
+               LeaveBalance.leave_type_id == leave_type.id,
+               LeaveBalance.year == year)
+    row = session.query(LeaveBalance.id).filter(key).first()
+    if row is not None:
+        return row[0]
+
+    opening = Decimal(0)
+    if leave_type.carry_forward:
+        previous = session.query(LeaveBalance.closing_balance).filter(
+            LeaveBalance.employee_id == employee_id,
+            LeaveBalance.leave_type_id == leave_type.id,
+            LeaveBalance.year == year - 1
+        ).first()
+        if previous is not None and previous[0] and previous[0] > 0:
+            opening = Decimal(previous[0])
+    earned = Decimal(leave_type.max_days_per_year or 0)
+
+    now = datetime.utcnow()
+    session.execute(insert(LeaveBalance), [{
+        'employee_id': employee_id, 'leave_type_id': leave_type.id, 'year': year,
+        'opening_balance': opening, 'earned': earned, 'used': 0, 'adjusted': 0,
+        'closing_balance': opening + earned, 'updated_at': now,
+    }])
+    entries = [(entry_type, days) for entry_type, days in (('opening', opening), ('earned', earned)) if days]
+    if entries:
+        session.execute(insert(LeaveLedgerEntry), [{
+            'employee_id': employee_id, 'leave_type_id': leave_type.id, 'period': date(year, 1, 1),
+            'entry_type': entry_type, 'days': days, 'reason': 'Year opening', 'created_at': now,
+        } for entry_type, days in entries])
+    return session.query(LeaveBalance.id).filter(key).scalar()
+
+
+def post_entry(session, employee_id, leave_type, period, entry_type, days, leave_id=None, reason=None):
+    """Append one ledger entry and move its snapshot. Does not commit."""
+    from database.models import LeaveBalance, LeaveLedgerEntry
+
+    days = Decimal(str(round(days, 2)))
+    balance_id = _balance_id(session, employee_id, leave_type, period.year)
+    column, sign = ENTRY_COLUMNS[entry_type]
+    session.execute(insert(LeaveLedgerEntry), [{
+        'employee_id': employee_id, 'leave_type_id': leave_type.id, 'period': period,
+        'entry_type': entry_type, 'days': days, 'leave_id': leave_id, 'reason': reason,
+        'created_at': datetime.utcnow(),
+    }])
+    session.execute(update(LeaveBalance).where(LeaveBalance.id == balance_id).values({
+        column: getattr(LeaveBalance, column) + days,
+        'closing_balance': LeaveBalance.closing_balance + sign * days,
+        'updated_at': datetime.utcnow(),
+    }))
+    return balance_id
+
+
+def post_leave(session, leave_id, employee_id, leave_code, start_date, end_date, approved):
+    """Bring the 'used' entries of one leave in line with its current state."""
+    from database.models import Employee, LeaveLedgerEntry
+
+    org_id = session.query(Employee.organization_id).filter(Employee.id == employee_id).scalar()
+    types = ensure_leave_types(session, org_id)
+    by_id = {t.id: t for t in types.values()}
+
+    desired = {}
+    if approved and leave_code in types:
+        leave_type = types[leave_code]
+        for period, days in days_by_month(start_date, end_date, leave_type.include_weekends, org_id).items():
+            desired[(leave_type.id, period)] = days
+
+    posted = {}
+    for type_id, period, days in session.query(
+        LeaveLedgerEntry.leave_type_id, LeaveLedgerEntry.period, func.sum(LeaveLedgerEntry.days)
+    ).filter(LeaveLedgerEntry.leave_id == leave_id).group_by(LeaveLedgerEntry.leave_type_id, LeaveLedgerEntry.period):
+        posted[(type_id, period)] = float(days or 0)
+
+    changes = 0
+    for key in set(desired) | set(posted):
+        delta = round(desired.get(key, 0.0) - posted.get(key, 0.0), 2)
+        if delta and key[0] in by_id:
+            post_entry(session, employee_id, by_id[key[0]], key[1], 'used', delta, leave_id,
+                       'Leave approved' if delta > 0 else 'Leave revoked')
+            changes += 1
+    return changes
+
+
+def reverse_leave(session, employee_id, posted, reason):
+    """Append the reversal of a deleted leave's (leave_type_id, period, days) totals, without a leave_id."""
+    from database.models import Employee
+
+    org_id = session.query(Employee.organization_id).filter(Employee.id == employee_id).scalar()
+    by_id = {t.id: t for t in ensure_leave_types(session, org_id).values()}
+    changes = 0
+    for type_id, period, days in posted:
+        days = round(float(days or 0), 2)
+        if days and type_id in by_id:
+            post_entry(session, employee_id, by_id[type_id], period, 'used', -days, None, reason)
+            changes += 1
+    return changes
+
+
+def _read_balance(balance_id):
+    """Detached LeaveBalance snapshot, read after the writer committed it."""
+    from database.connection import db_manager
+    from database.models import LeaveBalance
+
+    session = db_manager.get_read_session()()
+    try:
+        balance = session.get(LeaveBalance, balance_id)
+        if balance is not None:
+            session.expunge(balance)
+        return balance
+    finally:
+        session.close()
+
+
+def get_leave_balance(employee_id, leave_type_id, year):
+    """Get the leave balance snapshot for an employee (internal API)."""
+    from database.models import LeaveType
+    from database.writer import db_writer
+
+    def open_balance(session):
+        leave_type = session.get(LeaveType, leave_type_id)
+        if leave_type is None:
+            return None
+        return _balance_id(session, employee_id, leave_type, year)
+
+    try:
+        balance_id = db_writer.call(open_balance)
+        return _read_balance(balance_id) if balance_id is not None else None
+    except Exception as e:
+        logger.error(f"Error getting leave balance: {e}")
+        return None
+
+
+def update_leave_balance(employee_id, leave_type_id, year, adjustment, reason):
+    """Adjust a leave balance through an 'adjusted' ledger entry (internal API)."""
+    from database.models import LeaveType
+    from database.writer import db_writer
+
+    def adjust(session):
+        leave_type = session.get(LeaveType, leave_type_id)
+        if leave_type is None:
+            return None
+        return post_entry(session, employee_id, leave_type, date(year, 1, 1), 'adjusted', adjustment,
+                          reason=reason)
+
+    try:
+        balance_id = db_writer.call(adjust)
+        return _read_balance(balance_id) if balance_id is not None else None
+    except Exception as e:
+        logger.error(f"Error updating leave balance: {e}")
+        return None
+
+
+def monthly_leave_summary(session, year, month, org_id=None):
+    """
+    Leave taken per employee and type in a month, with the year's closing
+    balance, for a whole organization in one grouped query.
+    """
+    return [row._asdict() for row in leave_summary_query(session, year, month, org_id)]
+
+
+def leave_summary_query(session, year, month, org_id=None):
+    """The monthly_leave_summary() query, for callers that stream its rows."""
+    from database.models import Department, Employee, LeaveBalance, LeaveLedgerEntry, LeaveType
+
+    query = session.query(
+        Employee.id.label('employee_id'),
+        Employee.employee_number,
+        Employee.first_name,
+        Employee.last_name,
+        Department.name.label('department'),
+        LeaveType.leave_name,
+        func.sum(LeaveLedgerEntry.days).label('days_taken'),
+        LeaveBalance.closing_balance.label('balance'),
+    ).join(Employee, Employee.id == LeaveLedgerEntry.employee_id
+    ).join(Department, Department.id == Employee.department_id
+    ).join(LeaveType, LeaveType.id == LeaveLedgerEntry.leave_type_id
+    ).outerjoin(LeaveBalance, and_(
+        LeaveBalance.employee_id == LeaveLedgerEntry.employee_id,
+        LeaveBalance.leave_type_id == LeaveLedgerEntry.leave_type_id,
+        LeaveBalance.year == year
+    )).filter(
+        LeaveLedgerEntry.period == date(year, month, 1),
+        LeaveLedgerEntry.entry_type == 'used'
+    )
+    if org_id is not None:
+        query = query.filter(Employee.organization_id == org_id)
+    return query.group_by(
+        Employee.id, Employee.employee_number, Employee.first_name, Employee.last_name,
+        Department.name, LeaveType.id, LeaveType.leave_name, LeaveBalance.closing_balance
+    ).having(func.sum(LeaveLedgerEntry.days) != 0).order_by(Department.name, Employee.employee_number)
+
+
+# --- automatic posting ------------------------------------------------------
+
+def _track_leave(mapper, connection, target):
+    from sqlalchemy.orm import object_session
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('ledger_leaves', {})[target.id] = (
+            target.employee_id, target.leave_type, target.start_date, target.end_date, target.status == 'approved')
+
+
+def _untrack_leave(mapper, connection, target):
+    from sqlalchemy.orm import object_session
+    from database.models import LeaveLedgerEntry
+
+    ledger = LeaveLedgerEntry.__table__
+    posted = connection.execute(select(ledger.c.leave_type_id, ledger.c.period, func.sum(ledger.c.days)).where(
+        ledger.c.leave_id == target.id).group_by(ledger.c.leave_type_id, ledger.c.period)).all()
+    # Done here as well as by ON DELETE SET NULL, for SQLite connections without foreign key enforcement
+    connection.execute(update(ledger).where(ledger.c.leave_id == target.id).values(leave_id=None))
+    session = object_session(target)
+    if session is not None and posted:
+        reason = f"Leave {target.id} deleted ({target.start_date} to {target.end_date})"
+        session.info.setdefault('ledger_deleted', {})[target.id] = (target.employee_id, posted, reason)
+
+
+def _after_flush_postexec(session, flush_context):
+    leaves = session.info.pop('ledger_leaves', None)
+    for leave_id, (employee_id, code, start, end, approved) in (leaves or {}).items():
+        post_leave(session, leave_id, employee_id, code, start, end, approved)
+    deleted = session.info.pop('ledger_deleted', None)
+    for employee_id, posted, reason in (deleted or {}).values():
+        reverse_leave(session, employee_id, posted, reason)
+
+
+def _after_rollback(session):
+    session.info.pop('ledger_leaves', None)
+    session.info.pop('ledger_deleted', None)
+
+
+def _register_listeners():
+    from database.models import Leave
+
+    event.listen(Leave, 'after_insert', _track_leave)
+    event.listen(Leave, 'after_update', _track_leave)
+    event.listen(Leave, 'before_delete', _untrack_leave)
+    event.listen(Session, 'after_flush_postexec', _after_flush_postexec)
+    event.listen(Session, 'after_rollback', _after_rollback)
+
+
+_register_listeners()
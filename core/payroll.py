@@ -0,0 +1,194 @@
+"""
+Payroll hours aggregation.
+
+Employees are split into partitions (whole departments, large ones cut
+into partition_size slices) and each partition is computed by a worker
+process that opens its own database connection and reads only its own
+employees' punches, shifts and leaves (through a shift resolver and leave
+index scoped to the partition, not the process-wide ones). The parent
+merges the per-employee totals and adds names and departments with a
+single query.
+
+Workers are spawned, so they import the launching script as __mp_main__:
+main.py keeps its Qt imports inside main().
+"""
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+from config import PAYROLL_CONFIGS
+
+logger = logging.getLogger(__name__)
+
+TOTAL_COLUMNS = ['employee_id', 'days_worked', 'worked_hours', 'regular_hours', 'overtime_hours',
+                 'break_hours', 'late_minutes', 'early_minutes', 'missing_punches',
+                 'absent_days', 'leave_days']
+
+PAYROLL_COLUMNS = ['employee_id', 'employee_number', 'name', 'department'] + TOTAL_COLUMNS[1:]
+
+
+def partition_employees(session, department_id=None, partition_size=None, ordered=False):
+    """
+    Active employee ids grouped by department, large departments split into
+    slices. With ordered, partitions follow department name and employee
+    number (for reports) instead of largest first.
+    """
+    from database.models import Department, Employee
+
+    partition_size = partition_size or PAYROLL_CONFIGS['partition_size']
+    query = session.query(Employee.department_id, Employee.id).filter(Employee.status == 'active')
+    if department_id is not None:
+        query = query.filter(Employee.department_id == department_id)
+    if ordered:
+        query = query.join(Department, Department.id == Employee.department_id).order_by(
+            Department.name, Department.id, Employee.employee_number)
+    else:
+        query = query.order_by(Employee.department_id, Employee.id)
+    by_department = {}
+    for dept_id, emp_id in query:
+        by_department.setdefault(dept_id, []).append(emp_id)
+
+    partitions = []
+    for employee_ids in by_department.values():
+        for start in range(0, len(employee_ids), partition_size):
+            partitions.append(employee_ids[start:start + partition_size])
+    if not ordered:
+        # Largest first so the pool doesn't end on one long partition
+        partitions.sort(key=len, reverse=True)
+    return partitions
+
+
+def aggregate_employees(session, employee_ids, start_date, end_date, resolver=None, leaves=None):
+    """Per-employee payroll totals for one partition (shared shift resolver and leave index by default)."""
+    from core.leave_index import leave_index
+    from core.shifts import attendance_exceptions
+    from core.work_calendar import work_calendar
+    from database.models import Employee
+
+    employee_ids = list(employee_ids)
+    leaves = leaves or leave_index
+    days = attendance_exceptions(session, start_date, end_date, employee_ids, resolver=resolver)
+    totals = pd.DataFrame({'employee_id': np.asarray(employee_ids, dtype=np.int64)})
+    if not days.empty:
+        days['worked_day'] = days['worked_minutes'] > 0
+        grouped = days.groupby('employee_id').agg(
+            days_worked=('worked_day', 'sum'),
+            worked_minutes=('worked_minutes', 'sum'),
+            overtime_minutes=('overtime_minutes', 'sum'),
+            break_minutes=('break_minutes', 'sum'),
+            late_minutes=('late_minutes', 'sum'),
+            early_minutes=('early_minutes', 'sum'),
+            missing_punches=('missing_punches', 'sum'),
+            absent_days=('absent', 'sum'),
+        ).reset_index()
+        totals = totals.merge(grouped, on='employee_id', how='left')
+    for column in ('days_worked', 'worked_minutes', 'overtime_minutes', 'break_minutes', 'late_minutes',
+                   'early_minutes', 'missing_punches', 'absent_days'):
+        if column not in totals:
+            totals[column] = 0
+        totals[column] = totals[column].fillna(0)
+
+    # Leave counts only on the organization's working days
+    orgs = dict(session.query(Employee.id, Employee.organization_id).filter(Employee.id.in_(employee_ids)))
+    leave = leaves.leave_mask(employee_ids, start_date, end_date)
+    dates = np.arange(np.datetime64(start_date, 'D'), np.datetime64(end_date, 'D') + 1)
+    working = work_calendar.working_mask(np.repeat([orgs.get(e) for e in employee_ids], len(dates)),
+                                         np.tile(dates, len(employee_ids))).reshape(leave.shape)
+    totals['leave_days'] = (leave & working).sum(axis=1)
+
+    totals['worked_hours'] = (totals.pop('worked_minutes') / 60).round(2)
+    totals['overtime_hours'] = (totals.pop('overtime_minutes') / 60).round(2)
+    totals['regular_hours'] = (totals['worked_hours'] - totals['overtime_hours']).round(2)
+    totals['break_hours'] = (totals.pop('break_minutes') / 60).round(2)
+    totals['late_minutes'] = totals['late_minutes'].round().astype(np.int64)
+    totals['early_minutes'] = totals['early_minutes'].round().astype(np.int64)
+    for column in ('days_worked', 'missing_punches', 'absent_days', 'leave_days'):
+        totals[column] = totals[column].astype(np.int64)
+    return totals[TOTAL_COLUMNS]
+
+
+def _init_worker(connection_string):
+    from database.connection import db_manager
+    db_manager.connect(connection_string)
+
+
+def _run_partition(employee_ids, start_date, end_date):
+    from core.leave_index import LeaveIndex
+    from core.shifts import ShiftResolver
+    from database.connection import db_manager
+
+    session = db_manager.get_session()()
+    try:
+        # Fresh per partition: the process-wide indexes would load every employee's rows
+        return aggregate_employees(session, employee_ids, start_date, end_date,
+                                   ShiftResolver(employee_ids=employee_ids), LeaveIndex(employee_ids=employee_ids))
+    finally:
+        session.close()
+
+
+def _with_people(session, totals):
+    """Add employee number, name and department to per-employee totals."""
+    from database.models import Department, Employee
+
+    people = pd.DataFrame(session.query(
+        Employee.id, Employee.employee_number, Employee.first_name, Employee.last_name, Department.name
+    ).join(Department, Department.id == Employee.department_id).filter(
+        Employee.id.in_(totals['employee_id'].tolist())
+    ).all(), columns=['employee_id', 'employee_number', 'first_name', 'last_name', 'department'])
+    people['name'] = people.pop('first_name') + ' ' + people.pop('last_name')
+    merged = people.merge(totals, on='employee_id', how='right')
+    return merged[PAYROLL_COLUMNS].sort_values(['department', 'employee_number']).reset_index(drop=True)
+
+
+def iter_payroll_hours(start_date, end_date, department_id=None, workers=None, session_factory=None,
+                       ordered=False):
+    """
+    Payroll hours one partition at a time, each a DataFrame with
+    PAYROLL_COLUMNS. Large runs are fanned out over a process pool. With
+    ordered, partitions arrive by department and employee number so the
+    caller can write them out as they come; otherwise in completion order.
+    """
+    from database.connection import db_manager
+
+    session_factory = session_factory or db_manager.get_session()
+    session = session_factory()
+    try:
+        partitions = partition_employees(session, department_id, ordered=ordered)
+        employee_count = sum(len(p) for p in partitions)
+        workers = workers or PAYROLL_CONFIGS['workers'] or os.cpu_count() or 1
+        workers = min(workers, len(partitions))
+
+        if workers <= 1 or employee_count < PAYROLL_CONFIGS['parallel_min_employees']:
+            for employee_ids in partitions:
+                yield _with_people(session, aggregate_employees(session, employee_ids, start_date, end_date))
+            return
+
+        url = session.get_bind().url.render_as_string(hide_password=False)
+        logger.info(f"Aggregating payroll for {employee_count} employees in {len(partitions)} partitions "
+                    f"on {workers} processes")
+        # spawn: workers must not inherit the parent's connections or Qt state
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'),
+                                 initializer=_init_worker, initargs=(url,)) as pool:
+            futures = [pool.submit(_run_partition, employee_ids, start_date, end_date)
+                       for employee_ids in partitions]
+            for future in (futures if ordered else as_completed(futures)):
+                yield _with_people(session, future.result())
+    finally:
+        session.close()
+
+
+def payroll_hours(start_date, end_date, department_id=None, workers=None, session_factory=None):
+    """
+    Payroll hours for every active employee (optionally one department) over a
+    date range, as a DataFrame with PAYROLL_COLUMNS. Large runs are fanned out
+    over a process pool.
+    """
+    results = list(iter_payroll_hours(start_date, end_date, department_id, workers, session_factory))
+    if not results:
+        return pd.DataFrame(columns=PAYROLL_COLUMNS)
+    totals = pd.concat(results, ignore_index=True)
+    return totals.sort_values(['department', 'employee_number']).reset_index(drop=True)
@@ -0,0 +1,134 @@
+"""
+Punch classification during ingestion.
+
+A batch of new punches is sorted by employee and time and walked once. Each
+employee keeps a small window with its last accepted punch (seeded from the
+database for the batch's employees), and every punch is checked against it:
+
+- duplicate: same employee punched again within duplicate_window_seconds
+- suspicious: the same in/out type twice in a row within a shift length,
+  or a punch on a different device sooner than device_travel_seconds
+- suspicious: more than shift_window_minutes outside the assigned shift
+
+Duplicates do not move the window, so a burst of repeated punches is
+measured against its first punch.
+"""
+import logging
+from datetime import timedelta
+
+import numpy as np
+
+from config import ATTENDANCE_CONFIGS
+
+logger = logging.getLogger(__name__)
+
+VALID = 'valid'
+DUPLICATE = 'duplicate'
+SUSPICIOUS = 'suspicious'
+
+# Two of these in a row is an impossible sequence
+SEQUENCE_TYPES = ('in', 'out')
+
+# Keep IN (...) lists under SQLite's bound parameter limit
+CHUNK_SIZE = 500
+
+
+class PunchClassifier:
+    def __init__(self, resolver=None, duplicate_seconds=None, travel_seconds=None,
+                 shift_window_minutes=None, max_shift_hours=None):
+        self.resolver = resolver
+        self.duplicate_seconds = duplicate_seconds or ATTENDANCE_CONFIGS['duplicate_window_seconds']
+        self.travel_seconds = travel_seconds or ATTENDANCE_CONFIGS['device_travel_seconds']
+        self.shift_window = (shift_window_minutes or ATTENDANCE_CONFIGS['shift_window_minutes']) * 60
+        self.max_span = (max_shift_hours or ATTENDANCE_CONFIGS['max_shift_hours']) * 3600
+
+    def load_context(self, session, employee_ids, start):
+        """Last accepted punch per employee before `start`: {emp_id: (time, type, device_id)}."""
+        from database.archive import punch_source
+
+        context = {}
+        since = start - timedelta(seconds=self.max_span)
+        punches = punch_source(session, since, start)
+        employee_ids = list(employee_ids)
+        for pos in range(0, len(employee_ids), CHUNK_SIZE):
+            chunk = employee_ids[pos:pos + CHUNK_SIZE]
+            rows = session.query(
+                punches.c.employee_id, punches.c.punch_time,
+                punches.c.punch_type, punches.c.device_id
+            ).filter(
+                punches.c.employee_id.in_(chunk),
+                punches.c.punch_time >= since,
+                punches.c.punch_time < start,
+                punches.c.status.in_((VALID, SUSPICIOUS))
+            ).order_by(punches.c.punch_time)
+            for emp_id, punch_time, punch_type, device_id in rows:
+                context[emp_id] = (punch_time, punch_type, device_id)
+        return context
+
+    def outside_shift(self, employee_ids, punch_times):
+        """
+        Boolean array: punch is more than shift_window outside both the shift of
+        its own day and (for overnight shifts) the shift of the previous day.
+        Employees without an assigned shift are never flagged.
+        """
+        resolver = self.resolver
+        if resolver is None:
+            from core.shifts import shift_resolver
+            resolver = self.resolver = shift_resolver
+        from core.shifts import NO_SHIFT
+
+        emp = np.asarray(employee_ids, dtype=np.int64)
+        ts = np.asarray(punch_times, dtype='datetime64[s]').astype(np.int64)
+        days = (ts // 86400).astype('datetime64[D]')
+        tables = resolver.tables()
+        outside = np.ones(len(emp), dtype=bool)
+        assigned = np.zeros(len(emp), dtype=bool)
+        for offset in (0, 1):
+            shift = resolver.shift_ids(emp, days - offset)
+            shift = np.where(shift < len(tables['start']), shift, NO_SHIFT)
+            has = shift != NO_SHIFT
+            day_start = (days - offset).astype('datetime64[s]').astype(np.int64)
+            opens = day_start + tables['start'][shift] - self.shift_window
+            closes = day_start + tables['end'][shift] + self.shift_window
+            outside &= ~(has & (ts >= opens) & (ts <= closes))
+            assigned |= has
+        return outside & assigned
+
+    def classify(self, session, rows):
+        """
+        rows: (employee_id, punch_time, punch_type, device_id) tuples.
+        Returns statuses aligned with rows.
+        """
+        if not rows:
+            return []
+        order = sorted(range(len(rows)), key=lambda i: (rows[i][0], rows[i][1]))
+        context = self.load_context(session, {r[0] for r in rows}, min(r[1] for r in rows))
+        try:
+            off_shift = self.outside_shift([r[0] for r in rows], [r[1] for r in rows])
+        except Exception as e:
+            logger.error(f"Error checking punches against shifts: {e}")
+            off_shift = np.zeros(len(rows), dtype=bool)
+
+        statuses = [VALID] * len(rows)
+        for i in order:
+            emp_id, punch_time, punch_type, device_id = rows[i]
+            last = context.get(emp_id)
+            status = VALID
+            if last is not None:
+                last_time, last_type, last_device = last
+                gap = (punch_time - last_time).total_seconds()
+                if gap < self.duplicate_seconds:
+                    statuses[i] = DUPLICATE
+                    continue
+                if punch_type == last_type and punch_type in SEQUENCE_TYPES and gap <= self.max_span:
+                    status = SUSPICIOUS
+                elif device_id != last_device and gap < self.travel_seconds:
+                    status = SUSPICIOUS
+            if off_shift[i]:
+                status = SUSPICIOUS
+            statuses[i] = status
+            context[emp_id] = (punch_time, punch_type, device_id)
+        return statuses
+
+
+punch_classifier = PunchClassifier()
@@ -0,0 +1,394 @@
+"""
+Shift resolution.
+
+All employee_shifts rows are loaded once into a per-employee interval index:
+overlapping assignments are flattened into disjoint [start, end] day ranges
+(the assignment with the later effective_date wins where they overlap), so a
+lookup is a single bisect. Weekday-specific assignments (day_of_week set)
+get their own index per weekday and take precedence over the general one.
+
+Assignment changes are picked up after commit: the affected employees are
+marked stale and only their rows are reloaded on the next lookup.
+"""
+import logging
+import threading
+from bisect import bisect_right
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from config import ATTENDANCE_CONFIGS
+from core.attendance import apply_overtime, work_hours_report, RESULT_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+NO_SHIFT = 0
+OPEN_END = date.max.toordinal()
+
+# Any weekday (general assignments) in the per-employee index
+ALL_DAYS = None
+
+EXCEPTION_COLUMNS = RESULT_COLUMNS + ['shift_id', 'late_minutes', 'early_minutes', 'absent']
+
+
+def build_segments(assignments):
+    """
+    Flatten (effective_ordinal, end_ordinal, shift_id) tuples into disjoint,
+    sorted segments. Later assignments override earlier ones where they overlap.
+    Returns (starts, ends, shift_ids) as int64 arrays.
+    """
+    segments = []
+    for start, end, shift_id in sorted(assignments, key=lambda a: a[0]):
+        kept = []
+        for s, e, sid in segments:
+            if e < start or s > end:
+                kept.append((s, e, sid))
+                continue
+            if s < start:
+                kept.append((s, start - 1, sid))
+            if e > end:
+                kept.append((end + 1, e, sid))
+        kept.append((start, end, shift_id))
+        kept.sort()
+        segments = kept
+    if not segments:
+        empty = np.empty(0, np.int64)
+        return empty, empty, empty
+    starts, ends, ids = zip(*segments)
+    return np.array(starts, np.int64), np.array(ends, np.int64), np.array(ids, np.int64)
+
+
+def _find(segments, ordinal):
+    starts, ends, ids = segments
+    i = bisect_right(starts, ordinal) - 1
+    if i >= 0 and ends[i] >= ordinal:
+        return int(ids[i])
+    return NO_SHIFT
+
+
+def _find_many(segments, ordinals):
+    starts, ends, ids = segments
+    if len(starts) == 0:
+        return np.zeros(len(ordinals), np.int64)
+    i = np.searchsorted(starts, ordinals, side='right') - 1
+    safe = np.maximum(i, 0)
+    hit = (i >= 0) & (ends[safe] >= ordinals)
+    return np.where(hit, ids[safe], NO_SHIFT)
+
+
+def _seconds(value, fallback):
+    if value is None:
+        value = datetime.strptime(fallback, '%H:%M').time()
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+class ShiftResolver:
+    """In-memory shift index shared by reports, the dashboard and the API helpers."""
+
+    def __init__(self, session_factory=None, employee_ids=None):
+        self._session_factory = session_factory
+        # With employee_ids, only those employees' assignments are ever loaded
+        self._scope = None if employee_ids is None else list(employee_ids)
+        self._lock = threading.RLock()
+        self._index = {}    # employee_id -> {day_of_week or ALL_DAYS: segments}
+        self._shifts = {}   # shift_id -> detached Shift
+        self._tables = None
+        self._loaded = False
+        self._stale = set()
+
+    def _session(self):
+        if self._session_factory is None:
+            from database.connection import db_manager
+            self._session_factory = db_manager.get_read_session()
+        return self._session_factory()
+
+    def invalidate(self, employee_ids=None, shifts=False):
+        """Mark employees (or everything, when None) for reload on the next lookup."""
+        with self._lock:
+            if employee_ids is None and not shifts:
+                self._loaded = False
+                self._index = {}
+                self._stale.clear()
+            elif employee_ids is not None:
+                self._stale.update(employee_ids)
+            if shifts or employee_ids is None:
+                self._shifts = {}
+                self._tables = None
+
+    def _load(self, employee_ids=None):
+        from database.models import EmployeeShift, Shift
+
+        session = self._session()
+        try:
+            if not self._shifts:
+                shifts = session.query(Shift).all()
+                session.expunge_all()
+                self._shifts = {s.id: s for s in shifts}
+                self._tables = None
+
+            query = session.query(
+                EmployeeShift.employee_id, EmployeeShift.shift_id, EmployeeShift.effective_date,
+                EmployeeShift.end_date, EmployeeShift.day_of_week
+            )
+            scope = employee_ids if employee_ids is not None else self._scope
+            if scope is not None:
+                query = query.filter(EmployeeShift.employee_id.in_(list(scope)))
+            grouped = {}
+            for emp_id, shift_id, effective, end, dow in query.all():
+                end_ordinal = end.toordinal() if end else OPEN_END
+                grouped.setdefault(emp_id, {}).setdefault(dow, []).append(
+                    (effective.toordinal(), end_ordinal, shift_id))
+        finally:
+            session.close()
+
+        index = {emp_id: {dow: build_segments(rows) for dow, rows in by_dow.items()}
+                 for emp_id, by_dow in grouped.items()}
+        if employee_ids is None:
+            self._index = index
+            self._loaded = True
+        else:
+            for emp_id in employee_ids:
+                self._index.pop(emp_id, None)
+            self._index.update(index)
+        logger.debug(f"Loaded shift assignments for {len(index)} employees")
+
+    def _ensure(self):
+        with self._lock:
+            if not self._loaded:
+                self._load()
+                self._stale.clear()
+            elif self._stale:
+                stale = list(self._stale)
+                self._stale.clear()
+                self._load(stale)
+            elif not self._shifts:
+                self._load([])
+
+    def shift_id(self, employee_id, target_date):
+        """Shift id in effect for one employee-day, or NO_SHIFT."""
+        self._ensure()
+        by_dow = self._index.get(employee_id)
+        if not by_dow:
+            return NO_SHIFT
+        ordinal = target_date.toordinal()
+        weekday = by_dow.get(target_date.weekday())
+        if weekday is not None:
+            shift_id = _find(weekday, ordinal)
+            if shift_id != NO_SHIFT:
+                return shift_id
+        general = by_dow.get(ALL_DAYS)
+        return _find(general, ordinal) if general is not None else NO_SHIFT
+
+    def get_shift(self, shift_id):
+        self._ensure()
+        return self._shifts.get(shift_id)
+
+    def shift_ids(self, employee_ids, dates):
+        """
+        Vectorized lookup for parallel arrays of employee ids and dates
+        (datetime64[D] or date objects). Returns an int64 array of shift ids.
+        """
+        self._ensure()
+        emp = np.asarray(employee_ids, dtype=np.int64)
+        days = np.asarray(dates, dtype='datetime64[D]')
+        out = np.zeros(len(emp), np.int64)
+        if len(emp) == 0:
+            return out
+        # date.toordinal() of 1970-01-01 is 719163
+        ordinals = days.astype(np.int64) + 719163
+        weekdays = (days.astype(np.int64) + 3) % 7
+        order = np.argsort(emp, kind='stable')
+        uniq, starts = np.unique(emp[order], return_index=True)
+        bounds = np.r_[starts, len(order)]
+        for k, emp_id in enumerate(uniq):
+            by_dow = self._index.get(int(emp_id))
+            if not by_dow:
+                continue
+            rows = order[bounds[k]:bounds[k + 1]]
+            general = by_dow.get(ALL_DAYS)
+            if general is not None:
+                out[rows] = _find_many(general, ordinals[rows])
+            for dow, segments in by_dow.items():
+                if dow is ALL_DAYS:
+                    continue
+                sel = rows[weekdays[rows] == dow]
+                if len(sel):
+                    found = _find_many(segments, ordinals[sel])
+                    out[sel] = np.where(found != NO_SHIFT, found, out[sel])
+        return out
+
+    def resolve_range(self, employee_ids, start_date, end_date):
+        """Long DataFrame (employee_id, work_date, shift_id) for every employee-day in the range."""
+        days = np.arange(np.datetime64(start_date, 'D'), np.datetime64(end_date, 'D') + 1)
+        employees = np.asarray(list(employee_ids), dtype=np.int64)
+        emp = np.repeat(employees, len(days))
+        work_dates = np.tile(days, len(employees))
+        return pd.DataFrame({
+            'employee_id': emp,
+            'work_date': work_dates,
+            'shift_id': self.shift_ids(emp, work_dates),
+        })
+
+    def resolve_department(self, session, department_id, start_date, end_date):
+        """Shift grid for all active employees of a department over a date range."""
+        from database.models import Employee
+
+        rows = session.query(Employee.id).filter(
+            Employee.department_id == department_id,
+            Employee.status == 'active'
+        ).all()
+        return self.resolve_range([r[0] for r in rows], start_date, end_date)
+
+    def tables(self):
+        """
+        Per-shift lookup arrays indexed by shift id; index NO_SHIFT holds the
+        configured default day. Keys: start, end (seconds after midnight, end
+        shifted by a day for overnight shifts), grace_in, grace_out, scheduled
+        (minutes of work excluding breaks).
+        """
+        self._ensure()
+        with self._lock:
+            if self._tables is not None:
+                return self._tables
+            size = max(self._shifts, default=0) + 1
+            start = np.full(size, _seconds(None, ATTENDANCE_CONFIGS['default_shift_start']), np.int64)
+            end = np.full(size, _seconds(None, ATTENDANCE_CONFIGS['default_shift_end']), np.int64)
+            grace_in = np.zeros(size, np.int64)
+            grace_out = np.zeros(size, np.int64)
+            scheduled = np.full(size, float(ATTENDANCE_CONFIGS['standard_work_minutes']))
+            for shift_id, shift in self._shifts.items():
+                start[shift_id] = _seconds(shift.start_time, ATTENDANCE_CONFIGS['default_shift_start'])
+                end[shift_id] = _seconds(shift.end_time, ATTENDANCE_CONFIGS['default_shift_end'])
+                if shift.is_overnight or end[shift_id] <= start[shift_id]:
+                    end[shift_id] += 86400
+                grace_in[shift_id] = (shift.grace_period_in or 0) * 60
+                grace_out[shift_id] = (shift.grace_period_out or 0) * 60
+                scheduled[shift_id] = (shift.duration_minutes or 0) - (shift.break_minutes or 0)
+            self._tables = {'start': start, 'end': end, 'grace_in': grace_in,
+                            'grace_out': grace_out, 'scheduled': scheduled}
+            return self._tables
+
+
+def evaluate_days(work, schedule, resolver=None):
+    """
+    Combine per employee-day work hours (core.attendance) with the shift grid
+    from resolve_range(). Adds shift_id, late_minutes, early_minutes and absent
+    (scheduled day without punches) and recomputes overtime against the shift.
+    Days worked without an assigned shift are checked against the default day.
+    """
+    resolver = resolver or shift_resolver
+    tables = resolver.tables()
+    merged = schedule.merge(work, on=['employee_id', 'work_date'], how='outer')
+    if merged.empty:
+        return pd.DataFrame(columns=EXCEPTION_COLUMNS)
+    shift = merged['shift_id'].fillna(NO_SHIFT).to_numpy(np.int64)
+    shift = np.where(shift < len(tables['start']), shift, NO_SHIFT)
+    merged['shift_id'] = shift
+
+    day_start = merged['work_date'].to_numpy('datetime64[s]').astype(np.int64)
+    first_in = merged['first_in'].to_numpy('datetime64[s]')
+    last_out = merged['last_out'].to_numpy('datetime64[s]')
+    has_in = ~np.isnat(first_in)
+    has_out = ~np.isnat(last_out)
+
+    late = first_in.astype(np.int64) - (day_start + tables['start'][shift] + tables['grace_in'][shift])
+    early = (day_start + tables['end'][shift] - tables['grace_out'][shift]) - last_out.astype(np.int64)
+    merged['late_minutes'] = np.where(has_in, np.maximum(late, 0), 0) / 60.0
+    merged['early_minutes'] = np.where(has_out, np.maximum(early, 0), 0) / 60.0
+
+    worked = merged['worked_minutes'].isna()
+    merged['absent'] = worked.to_numpy() & (shift != NO_SHIFT)
+    for column in ('worked_minutes', 'break_minutes', 'overtime_minutes'):
+        merged[column] = merged[column].fillna(0.0)
+    merged['missing_punches'] = merged['missing_punches'].fillna(0).astype(np.int64)
+    apply_overtime(merged, tables['scheduled'][shift])
+    return merged[EXCEPTION_COLUMNS].sort_values(['employee_id', 'work_date']).reset_index(drop=True)
+
+
+def attendance_exceptions(session, start_date, end_date, employee_ids=None, resolver=None, calendar=None):
+    """
+    Late, early-leave and absence figures for every employee-day in a range.
+    Weekends and holidays of the employee's organization are never absences.
+    """
+    from core.work_calendar import work_calendar
+    from database.models import Employee
+
+    resolver = resolver or shift_resolver
+    calendar = calendar or work_calendar
+    query = session.query(Employee.id, Employee.organization_id)
+    if employee_ids is None:
+        query = query.filter(Employee.status == 'active')
+    else:
+        employee_ids = list(employee_ids)
+        query = query.filter(Employee.id.in_(employee_ids))
+    orgs = dict(query.all())
+    if employee_ids is None:
+        employee_ids = list(orgs)
+    work = work_hours_report(session, start_date, end_date, employee_ids)
+    if work.empty:
+        work = pd.DataFrame({c: pd.Series(dtype='float64') for c in RESULT_COLUMNS})
+        work['employee_id'] = work['employee_id'].astype(np.int64)
+        work['work_date'] = work['work_date'].astype('datetime64[s]')
+        work['first_in'] = work['first_in'].astype('datetime64[s]')
+        work['last_out'] = work['last_out'].astype('datetime64[s]')
+    schedule = resolver.resolve_range(employee_ids, start_date, end_date)
+    schedule['work_date'] = schedule['work_date'].astype(work['work_date'].dtype)
+    result = evaluate_days(work, schedule, resolver)
+    if not result.empty:
+        working = calendar.working_mask([orgs.get(e) for e in result['employee_id']], result['work_date'].to_numpy())
+        result['absent'] = result['absent'].to_numpy(bool) & working
+    return result
+
+
+def get_employee_shift(employee_id, target_date):
+    """Get the Shift assigned to an employee on a date (internal API), or None."""
+    try:
+        return shift_resolver.get_shift(shift_resolver.shift_id(employee_id, target_date))
+    except Exception as e:
+        logger.error(f"Error resolving shift for employee {employee_id}: {e}")
+        return None
+
+
+shift_resolver = ShiftResolver()
+
+
+def _track_assignment(mapper, connection, target):
+    from sqlalchemy.orm import object_session
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('shift_employees', set()).add(target.employee_id)
+
+
+def _track_shift(mapper, connection, target):
+    from sqlalchemy.orm import object_session
+    session = object_session(target)
+    if session is not None:
+        session.info['shift_definitions'] = True
+
+
+def _after_commit(session):
+    employees = session.info.pop('shift_employees', None)
+    shifts = session.info.pop('shift_definitions', False)
+    if employees or shifts:
+        shift_resolver.invalidate(employees or [], shifts=shifts)
+
+
+def _after_rollback(session):
+    session.info.pop('shift_employees', None)
+    session.info.pop('shift_definitions', None)
+
+
+def _register_listeners():
+    from database.models import EmployeeShift, Shift
+
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(EmployeeShift, name, _track_assignment)
+        event.listen(Shift, name, _track_shift)
+    event.listen(Session, 'after_commit', _after_commit)
+    event.listen(Session, 'after_rollback', _after_rollback)
+
+
+_register_listeners()
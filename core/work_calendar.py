@@ -0,0 +1,225 @@
+"""
+Working-day calendar.
+
+For each organization and year a day-indexed bitmap is built once from the
+organization's rest days and its holidays, together with prefix sums over
+it, so counting working days between any two dates is two array lookups.
+Only 'public' holidays close a day; optional and restricted holidays are
+taken through leave. Recurring holidays repeat on the same month and day.
+
+Organization and holiday changes invalidate the cached years on commit.
+"""
+import logging
+import threading
+from datetime import date
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from config import ATTENDANCE_CONFIGS
+
+logger = logging.getLogger(__name__)
+
+# date(1970, 1, 1).toordinal(), to convert between ordinals and datetime64[D]
+EPOCH_ORDINAL = 719163
+
+WORKING = 'working'
+WEEKEND = 'weekend'
+HOLIDAY = 'holiday'
+
+
+def parse_weekend_days(value):
+    """'5,6' -> (5, 6); empty or NULL falls back to the configured default."""
+    if not value:
+        return tuple(ATTENDANCE_CONFIGS['weekend_days'])
+    return tuple(int(part) for part in str(value).split(',') if part.strip() != '')
+
+
+class YearCalendar:
+    """Bitmaps and prefix sums for one organization-year."""
+    __slots__ = ('year', 'first_ordinal', 'weekend', 'holiday', 'working', 'working_prefix', 'open_prefix')
+
+    def __init__(self, year, weekend_days, holiday_dates):
+        self.year = year
+        self.first_ordinal = date(year, 1, 1).toordinal()
+        size = date(year, 12, 31).toordinal() - self.first_ordinal + 1
+        weekdays = (np.arange(size) + date(year, 1, 1).weekday()) % 7
+        self.weekend = np.isin(weekdays, weekend_days)
+        self.holiday = np.zeros(size, dtype=bool)
+        for day in holiday_dates:
+            self.holiday[day.toordinal() - self.first_ordinal] = True
+        self.working = ~self.weekend & ~self.holiday
+        # prefix[i] = number of days before day index i
+        self.working_prefix = np.r_[0, np.cumsum(self.working, dtype=np.int32)]
+        self.open_prefix = np.r_[0, np.cumsum(~self.holiday, dtype=np.int32)]
+
+    def count(self, start_ordinal, end_ordinal, include_weekends=False):
+        prefix = self.open_prefix if include_weekends else self.working_prefix
+        return int(prefix[end_ordinal - self.first_ordinal + 1] - prefix[start_ordinal - self.first_ordinal])
+
+
+class WorkCalendar:
+    def __init__(self, session_factory=None):
+        self._session_factory = session_factory
+        self._lock = threading.RLock()
+        self._orgs = {}     # org_id -> (weekend_days, fixed holiday dates, recurring (month, day))
+        self._years = {}    # (org_id, year) -> YearCalendar
+
+    def _session(self):
+        if self._session_factory is None:
+            from database.connection import db_manager
+            self._session_factory = db_manager.get_read_session()
+        return self._session_factory()
+
+    def invalidate(self, org_ids=None):
+        with self._lock:
+            if org_ids is None:
+                self._orgs = {}
+                self._years = {}
+                return
+            for org_id in org_ids:
+                self._orgs.pop(org_id, None)
+                for key in [k for k in self._years if k[0] == org_id]:
+                    del self._years[key]
+
+    def _org(self, org_id):
+        info = self._orgs.get(org_id)
+        if info is not None:
+            return info
+        weekend_days = parse_weekend_days(None)
+        fixed, recurring = set(), set()
+        if org_id is not None:
+            from database.models import Holiday, Organization
+
+            session = self._session()
+            try:
+                org = session.query(Organization.weekend_days).filter(Organization.id == org_id).first()
+                if org is not None:
+                    weekend_days = parse_weekend_days(org[0])
+                for day, is_recurring in session.query(Holiday.holiday_date, Holiday.is_recurring).filter(
+                    Holiday.organization_id == org_id,
+                    Holiday.holiday_type == 'public'
+                ):
+                    if is_recurring:
+                        recurring.add((day.month, day.day))
+                    else:
+                        fixed.add(day)
+            finally:
+                session.close()
+        info = self._orgs[org_id] = (weekend_days, fixed, recurring)
+        return info
+
+    def year(self, org_id, year):
+        """Cached YearCalendar for an organization (None: default rest days, no holidays)."""
+        key = (org_id, year)
+        cal = self._years.get(key)
+        if cal is None:
+            with self._lock:
+                cal = self._years.get(key)
+                if cal is None:
+                    weekend_days, fixed, recurring = self._org(org_id)
+                    days = {d for d in fixed if d.year == year}
+                    for month, day in recurring:
+                        try:
+                            days.add(date(year, month, day))
+                        except ValueError:
+                            # 29 February in a non-leap year
+                            pass
+                    cal = self._years[key] = YearCalendar(year, weekend_days, days)
+        return cal
+
+    def working_days(self, org_id, start_date, end_date, include_weekends=False):
+        """Working days from start_date through end_date (inclusive)."""
+        if start_date > end_date:
+            return 0
+        total = 0
+        for year in range(start_date.year, end_date.year + 1):
+            first = max(start_date, date(year, 1, 1)).toordinal()
+            last = min(end_date, date(year, 12, 31)).toordinal()
+            total += self.year(org_id, year).count(first, last, include_weekends)
+        return total
+
+    def day_type(self, org_id, day):
+        cal = self.year(org_id, day.year)
+        index = day.toordinal() - cal.first_ordinal
+        if cal.holiday[index]:
+            return HOLIDAY
+        if cal.weekend[index]:
+            return WEEKEND
+        return WORKING
+
+    def is_working_day(self, org_id, day):
+        return self.day_type(org_id, day) == WORKING
+
+    def _span(self, org_id, first_year, last_year, include_weekends=False):
+        """(first_ordinal, mask, prefix) covering whole years first_year..last_year."""
+        cals = [self.year(org_id, y) for y in range(first_year, last_year + 1)]
+        if include_weekends:
+            mask = np.concatenate([~c.holiday for c in cals])
+        else:
+            mask = np.concatenate([c.working for c in cals])
+        return cals[0].first_ordinal, mask, np.r_[0, np.cumsum(mask, dtype=np.int64)]
+
+    def working_days_many(self, org_id, start_dates, end_dates, include_weekends=False):
+        """Vectorized working_days() for parallel arrays of range bounds."""
+        starts = np.asarray(start_dates, dtype='datetime64[D]').astype(np.int64) + EPOCH_ORDINAL
+        ends = np.asarray(end_dates, dtype='datetime64[D]').astype(np.int64) + EPOCH_ORDINAL
+        if len(starts) == 0:
+            return np.zeros(0, np.int64)
+        first_year = date.fromordinal(int(starts.min())).year
+        last_year = date.fromordinal(int(max(ends.max(), starts.min()))).year
+        first, _, prefix = self._span(org_id, first_year, last_year, include_weekends)
+        lo = np.clip(starts - first, 0, len(prefix) - 1)
+        hi = np.clip(ends - first + 1, 0, len(prefix) - 1)
+        return np.where(ends >= starts, prefix[hi] - prefix[lo], 0)
+
+    def working_mask(self, org_ids, dates):
+        """Boolean array: is each (organization, date) pair a working day."""
+        orgs = np.asarray([-1 if o is None else o for o in org_ids], dtype=np.int64)
+        ordinals = np.asarray(dates, dtype='datetime64[D]').astype(np.int64) + EPOCH_ORDINAL
+        out = np.zeros(len(orgs), dtype=bool)
+        if len(orgs) == 0:
+            return out
+        for org in np.unique(orgs):
+            rows = np.flatnonzero(orgs == org)
+            sel = ordinals[rows]
+            first_year = date.fromordinal(int(sel.min())).year
+            last_year = date.fromordinal(int(sel.max())).year
+            first, mask, _ = self._span(None if org == -1 else int(org), first_year, last_year)
+            out[rows] = mask[sel - first]
+        return out
+
+
+work_calendar = WorkCalendar()
+
+
+def _track_calendar(mapper, connection, target):
+    from sqlalchemy.orm import object_session
+    session = object_session(target)
+    if session is not None:
+        org_id = getattr(target, 'organization_id', None) or target.id
+        session.info.setdefault('calendar_orgs', set()).add(org_id)
+
+
+def _after_commit(session):
+    org_ids = session.info.pop('calendar_orgs', None)
+    if org_ids:
+        work_calendar.invalidate(org_ids)
+
+
+def _after_rollback(session):
+    session.info.pop('calendar_orgs', None)
+
+
+def _register_listeners():
+    from database.models import Holiday, Organization
+
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(Holiday, name, _track_calendar)
+    event.listen(Organization, 'after_update', _track_calendar)
+    event.listen(Session, 'after_commit', _after_commit)
+    event.listen(Session, 'after_rollback', _after_rollback)
+
+
+_register_listeners()
@@ -0,0 +1,244 @@
+"""
+Monthly archive partitions of attendance_records.
+
+Punches of months older than hot_months are moved out of the hot table into
+one table per month (attendance_archive_YYYY_MM, same columns and ids), in
+batches that are each their own database writer job, so archiving never
+holds the write lock for longer than one batch. attendance_partitions lists the archived months.
+
+punch_source() is the query router: for a punch_time range it returns the
+hot table itself, or, when the range reaches archived months, a UNION ALL
+of the hot table and just those partitions, each branch already limited
+to the range. Callers select from its columns (.c.punch_time, ...) as
+they would from attendance_records. punch_tables() lists the same tables
+for callers that read them one at a time.
+
+Each archived month is also written to a columnar punch file
+(database/columnar.py) for bulk scans; file_months() lists the months
+whose file is current, so array readers can skip those partitions.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime
+
+import numpy as np
+from sqlalchemy import Column, Index, MetaData, Table, delete, func, insert, select, union_all
+
+from config import ATTENDANCE_CONFIGS
+from database.columnar import COLUMNS, ENUM_LABELS, read_header, write_punch_file
+
+logger = logging.getLogger(__name__)
+
+_metadata = MetaData()
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def hot_cutoff(today=None):
+    """First day of the oldest month kept in the hot table."""
+    month = month_start(today or date.today())
+    for _ in range(ATTENDANCE_CONFIGS['hot_months']):
+        month = date(month.year - (month.month == 1), (month.month - 2) % 12 + 1, 1)
+    return month
+
+
+def partition_table(month):
+    """Table object of one month's archive partition (same columns as attendance_records)."""
+    from database.models import AttendanceRecord
+
+    name = f"attendance_archive_{month.year:04d}_{month.month:02d}"
+    with _tables_lock:
+        table = _tables.get(name)
+        if table is None:
+            columns = [Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable, autoincrement=False)
+                       for c in AttendanceRecord.__table__.columns]
+            table = Table(name, _metadata, *columns,
+                          Index(f'idx_{name}_time', 'punch_time'),
+                          Index(f'idx_{name}_emp_device_time', 'employee_id', 'device_time'))
+            _tables[name] = table
+        return table
+
+
+def archived_months(session, start=None, end=None):
+    """Archived months overlapping the punch_time range [start, end), oldest first."""
+    from database.models import AttendancePartition
+
+    months = []
+    for (month,) in session.query(AttendancePartition.month).order_by(AttendancePartition.month):
+        if start is not None and datetime.combine(next_month(month), datetime.min.time()) <= start:
+            continue
+        if end is not None and datetime.combine(month, datetime.min.time()) >= end:
+            continue
+        months.append(month)
+    return months
+
+
+def punch_tables(session, start=None, end=None, skip=()):
+    """
+    attendance_records followed by the partition tables the punch_time range
+    [start, end) reaches, leaving out the months in skip.
+    """
+    from database.models import AttendanceRecord
+
+    months = [month for month in archived_months(session, start, end) if month not in skip]
+    return [AttendanceRecord.__table__] + [partition_table(month) for month in months]
+
+
+def punch_source(session, start=None, end=None, skip=()):
+    """
+    attendance_records, plus the archive partitions the punch_time range
+    [start, end) reaches (except the months in skip), as one selectable.
+    Without archived months in the range this is the hot table itself, so
+    the query is unchanged.
+    """
+    tables = punch_tables(session, start, end, skip)
+    if len(tables) == 1:
+        return tables[0]
+    branches = []
+    for table in tables:
+        branch = select(*table.c)
+        if start is not None:
+            branch = branch.where(table.c.punch_time >= start)
+        if end is not None:
+            branch = branch.where(table.c.punch_time < end)
+        branches.append(branch)
+    return union_all(*branches).subquery('attendance_records')
+
+
+def punch_file_path(month):
+    return os.path.join(ATTENDANCE_CONFIGS['archive_file_location'], f"punches_{month.year:04d}_{month.month:02d}.ttp")
+
+
+def file_months(session, start=None, end=None):
+    """Archived months in [start, end) whose columnar punch file matches their partition."""
+    from database.models import AttendancePartition
+
+    months = []
+    for month, row_count in session.query(AttendancePartition.month, AttendancePartition.row_count).filter(
+            AttendancePartition.status == 'archived').order_by(AttendancePartition.month):
+        if start is not None and datetime.combine(next_month(month), datetime.min.time()) <= start:
+            continue
+        if end is not None and datetime.combine(month, datetime.min.time()) >= end:
+            continue
+        try:
+            if read_header(punch_file_path(month))['row_count'] == row_count:
+                months.append(month)
+        except (OSError, ValueError):
+            continue
+    return months
+
+
+def write_month_file(session, month):
+    """Write a month's partition to its columnar punch file (times to the second). Returns the path."""
+    table = partition_table(month)
+    rows = session.execute(select(*[table.c[name] for name in COLUMNS])).all()
+    columns = dict(zip(COLUMNS, zip(*rows))) if rows else {name: () for name in COLUMNS}
+    for name, labels in ENUM_LABELS.items():
+        codes = {label: code for code, label in enumerate(labels)}
+        columns[name] = [codes[value] for value in columns[name]]
+    for name in ('punch_time', 'device_time'):
+        columns[name] = np.array(columns[name], dtype='datetime64[s]')
+    return write_punch_file(punch_file_path(month), month, columns, ATTENDANCE_CONFIGS['archive_file_level'])
+
+
+def archive_month(month, session_factory=None, batch_size=None, pause=None):
+    """
+    Move one month's punches from the hot table into its partition. Returns
+    the number moved. Each step is a database writer job; session_factory
+    is used for reads.
+    """
+    from database.connection import db_manager
+    from database.models import AttendancePartition, AttendanceRecord
+    from database.writer import db_writer
+    from reports.cache import bump_versions
+
+    batch_size = batch_size or ATTENDANCE_CONFIGS['archive_batch_size']
+    pause = ATTENDANCE_CONFIGS['archive_batch_pause'] if pause is None else pause
+    hot = AttendanceRecord.__table__
+    table = partition_table(month)
+    start = datetime.combine(month, datetime.min.time())
+    end = datetime.combine(next_month(month), datetime.min.time())
+
+    def begin(session):
+        pending = session.execute(select(hot.c.id).where(
+            hot.c.punch_time >= start, hot.c.punch_time < end).limit(1)).first()
+        partition = session.get(AttendancePartition, month)
+        if pending is None and partition is None:
+            return False
+        table.create(session.connection(), checkfirst=True)
+        if partition is None:
+            # Listed before the first batch moves, so the router reads the partition from then on
+            session.add(AttendancePartition(month=month, table_name=table.name, status='archiving', row_count=0))
+        else:
+            partition.status = 'archiving'
+        return True
+
+    def move_batch(session):
+        ids = session.execute(select(hot.c.id).where(
+            hot.c.punch_time >= start, hot.c.punch_time < end
+        ).order_by(hot.c.punch_time).limit(batch_size)).scalars().all()
+        if ids:
+            # Copy and delete commit together: a punch is always in exactly one of the two tables
+            session.execute(insert(table).from_select([c.name for c in hot.c], select(*hot.c).where(hot.c.id.in_(ids))))
+            session.execute(delete(hot).where(hot.c.id.in_(ids)))
+            bump_versions(session, {'punches'})
+        return len(ids)
+
+    def finish(session):
+        partition = session.get(AttendancePartition, month)
+        partition.status = 'archived'
+        partition.row_count = session.execute(select(func.count()).select_from(table)).scalar()
+        partition.archived_at = datetime.utcnow()
+
+    if not db_writer.call(begin):
+        return 0
+    moved = 0
+    while True:
+        count = db_writer.call(move_batch)
+        if not count:
+            break
+        moved += count
+        if pause:
+            time.sleep(pause)
+    db_writer.call(finish)
+
+    session = (session_factory or db_manager.get_read_session())()
+    try:
+        if moved or month not in file_months(session, start, end):
+            write_month_file(session, month)
+    finally:
+        session.close()
+    if moved:
+        logger.info(f"Archived {moved} punches of {month:%Y-%m} into {table.name}")
+    return moved
+
+
+def archive_attendance(today=None, session_factory=None):
+    """Archive every month before hot_cutoff() still holding punches in the hot table. Returns {month: moved}."""
+    from database.connection import db_manager
+    from database.models import AttendanceRecord
+
+    cutoff = hot_cutoff(today)
+    session_factory = session_factory or db_manager.get_read_session()
+    session = session_factory()
+    try:
+        oldest = session.query(func.min(AttendanceRecord.punch_time)).filter(
+            AttendanceRecord.punch_time < datetime.combine(cutoff, datetime.min.time())).scalar()
+    finally:
+        session.close()
+    results = {}
+    month = month_start(oldest) if oldest is not None else cutoff
+    while month < cutoff:
+        results[month] = archive_month(month, session_factory)
+        month = next_month(month)
+    return results
@@ -0,0 +1,206 @@
+"""
+Columnar punch files for archived months.
+
+A file holds one month of punches sorted by (punch_time, id), one encoded
+and compressed block per column:
+
+- punch_time, id: delta-encoded from the first value, deltas in the
+  smallest integer type that fits (seconds between sorted punches are
+  usually a uint8 or uint16)
+- device_time: signed seconds from punch_time (the clock correction), NULL
+  stored as the type's minimum
+- employee_id, device_id: dictionary-encoded, codes index a sorted value
+  list kept in the header
+- punch_type, status: enum codes bit-packed, four per byte
+
+Layout: MAGIC, a uint32 header length, the JSON header (row count, month,
+compression level and each column's encoding, offset and length), then the
+column blocks. PunchFile memory-maps the file and decodes only the columns
+asked for, returning NumPy arrays: times as datetime64[s] (NaT for NULL),
+ids as int64, enums as int8 codes into ENUM_LABELS.
+"""
+import json
+import mmap
+import os
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b'TTPUNCH1'
+HEADER_LENGTH = struct.Struct('<I')
+
+COLUMNS = ('id', 'employee_id', 'device_id', 'punch_time', 'device_time', 'punch_type', 'status')
+
+# Same order as the attendance_records Enum columns
+ENUM_LABELS = {
+    'punch_type': ('in', 'out', 'break_start', 'break_end'),
+    'status': ('valid', 'invalid', 'duplicate', 'suspicious'),
+}
+
+NAT = np.datetime64('NaT', 's')
+
+
+def _int_dtype(low, high):
+    """Smallest NumPy integer type holding every value in [low, high]."""
+    for dtype in ((np.uint8, np.uint16, np.uint32, np.uint64) if low >= 0 else (np.int8, np.int16, np.int32, np.int64)):
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return np.dtype(dtype)
+    raise ValueError(f"Values {low}..{high} do not fit a 64-bit integer")
+
+
+def _pack_bits(codes, bits):
+    per_byte = 8 // bits
+    padded = np.zeros(-(-len(codes) // per_byte) * per_byte, dtype=np.uint8)
+    padded[:len(codes)] = codes
+    padded = padded.reshape(-1, per_byte)
+    packed = np.zeros(len(padded), dtype=np.uint8)
+    for slot in range(per_byte):
+        packed |= padded[:, slot] << np.uint8(slot * bits)
+    return packed
+
+
+def _unpack_bits(packed, bits, count):
+    per_byte = 8 // bits
+    shifts = np.arange(per_byte, dtype=np.uint8) * np.uint8(bits)
+    codes = (packed[:, None] >> shifts) & np.uint8((1 << bits) - 1)
+    return codes.reshape(-1)[:count].astype(np.int8)
+
+
+def _encode(name, values, punch_seconds):
+    """(encoding dict, raw bytes) of one column."""
+    if name in ENUM_LABELS:
+        return {'encoding': 'bitpack', 'bits': 2}, _pack_bits(values.astype(np.uint8), 2).tobytes()
+    if name in ('employee_id', 'device_id'):
+        dictionary, codes = np.unique(values, return_inverse=True)
+        dtype = _int_dtype(0, max(len(dictionary) - 1, 0))
+        return {'encoding': 'dictionary', 'dtype': dtype.str, 'values': dictionary.tolist()}, \
+            codes.astype(dtype).tobytes()
+    if name == 'device_time':
+        missing = np.isnat(values)
+        offsets = np.where(missing, 0, values.astype('datetime64[s]').astype(np.int64) - punch_seconds)
+        if not len(offsets):
+            return {'encoding': 'offset', 'dtype': '|i1', 'null': -128}, b''
+        # Signed, with the type's minimum reserved for NULL
+        dtype = _int_dtype(min(int(offsets.min()) - 1, -1), int(offsets.max()))
+        null = int(np.iinfo(dtype).min)
+        return {'encoding': 'offset', 'dtype': dtype.str, 'null': null}, \
+            np.where(missing, null, offsets).astype(dtype).tobytes()
+    seconds = values.astype('datetime64[s]').astype(np.int64) if name == 'punch_time' else values.astype(np.int64)
+    if not len(seconds):
+        return {'encoding': 'delta', 'dtype': '|u1', 'base': 0}, b''
+    deltas = np.diff(seconds, prepend=seconds[0])
+    dtype = _int_dtype(int(deltas.min()), int(deltas.max()))
+    return {'encoding': 'delta', 'dtype': dtype.str, 'base': int(seconds[0])}, deltas.astype(dtype).tobytes()
+
+
+def write_punch_file(path, month, columns, level=6):
+    """
+    Write one month of punches. columns maps every name in COLUMNS to an
+    array: ids as integers, times as datetime64 (NaT for a NULL
+    device_time), punch_type/status as codes into ENUM_LABELS. Rows are
+    sorted by (punch_time, id) first. The file is replaced atomically.
+    """
+    punch_time = np.asarray(columns['punch_time'], dtype='datetime64[s]')
+    ids = np.asarray(columns['id'], dtype=np.int64)
+    order = np.lexsort((ids, punch_time))
+    arrays = {
+        'id': ids[order],
+        'employee_id': np.asarray(columns['employee_id'], dtype=np.int64)[order],
+        'device_id': np.asarray(columns['device_id'], dtype=np.int64)[order],
+        'punch_time': punch_time[order],
+        'device_time': np.asarray(columns['device_time'], dtype='datetime64[s]')[order],
+        'punch_type': np.asarray(columns['punch_type'], dtype=np.int8)[order],
+        'status': np.asarray(columns['status'], dtype=np.int8)[order],
+    }
+    punch_seconds = arrays['punch_time'].astype(np.int64)
+
+    header = {'row_count': len(ids), 'month': month.isoformat(), 'level': level, 'columns': {}}
+    blocks = []
+    offset = 0
+    for name in COLUMNS:
+        encoding, raw = _encode(name, arrays[name], punch_seconds)
+        block = zlib.compress(raw, level) if level else raw
+        header['columns'][name] = dict(encoding, offset=offset, length=len(block))
+        blocks.append(block)
+        offset += len(block)
+
+    encoded = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp = path + '.tmp'
+    with open(temp, 'wb') as fileobj:
+        fileobj.write(MAGIC)
+        fileobj.write(HEADER_LENGTH.pack(len(encoded)))
+        fileobj.write(encoded)
+        for block in blocks:
+            fileobj.write(block)
+        fileobj.flush()
+        os.fsync(fileobj.fileno())
+    os.replace(temp, path)
+    return path
+
+
+def read_header(path):
+    """The JSON header of a punch file, without mapping the columns."""
+    with open(path, 'rb') as fileobj:
+        if fileobj.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a punch file")
+        (length,) = HEADER_LENGTH.unpack(fileobj.read(HEADER_LENGTH.size))
+        return json.loads(fileobj.read(length))
+
+
+class PunchFile:
+    """Memory-mapped reader of a punch file; column() decodes one column into a NumPy array."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a punch file")
+        (length,) = HEADER_LENGTH.unpack_from(self._map, len(MAGIC))
+        start = len(MAGIC) + HEADER_LENGTH.size
+        self.header = json.loads(self._map[start:start + length])
+        self._data_start = start + length
+        self.row_count = self.header['row_count']
+
+    def _raw(self, name):
+        spec = self.header['columns'][name]
+        start = self._data_start + spec['offset']
+        block = memoryview(self._map)[start:start + spec['length']]
+        if self.header['level']:
+            return zlib.decompress(block)
+        # Stored blocks are decoded straight from the mapping; every decoded column is a new array
+        return block
+
+    def column(self, name):
+        spec = self.header['columns'][name]
+        raw = self._raw(name)
+        encoding = spec['encoding']
+        if encoding == 'bitpack':
+            return _unpack_bits(np.frombuffer(raw, dtype=np.uint8), spec['bits'], self.row_count)
+        stored = np.frombuffer(raw, dtype=np.dtype(spec['dtype']))
+        if encoding == 'dictionary':
+            return np.asarray(spec['values'], dtype=np.int64)[stored]
+        if encoding == 'offset':
+            seconds = self.column('punch_time').astype(np.int64) + stored.astype(np.int64)
+            return np.where(stored == spec['null'], NAT, seconds.astype('datetime64[s]'))
+        values = np.cumsum(stored.astype(np.int64)) + spec['base']
+        return values.astype('datetime64[s]') if name == 'punch_time' else values
+
+    def arrays(self, names=COLUMNS):
+        return {name: self.column(name) for name in names}
+
+    def close(self):
+        if getattr(self, '_map', None) is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Enum, Text, BIGINT, Float, Date, Time, DECIMAL
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Enum, Text, BIGINT, Float, Date, Time, DECIMAL, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database.connection import Base
@@ -15,6 +15,8 @@ class Organization(Base):
     address = Column(Text)
     phone = Column(String(20))
     email = Column(String(100))
+    weekend_days = Column(String(20)) # Comma separated weekdays (0=Monday); NULL uses the configured default
+    timezone = Column(String(50)) # Zone punch times are stored in; NULL keeps device local time
     active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
@@ -67,12 +69,26 @@ class AttendanceRecord(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     employee_id = Column(Integer, ForeignKey('employees.id'), nullable=False)
     device_id = Column(Integer, nullable=False) # Simplified for now
-    punch_time = Column(DateTime, nullable=False)
+    punch_time = Column(DateTime, nullable=False) # Corrected for device clock offset and time zone
+    device_time = Column(DateTime) # Raw timestamp as the terminal reported it
     punch_type = Column(Enum('in', 'out', 'break_start', 'break_end'), nullable=False)
     status = Column(Enum('valid', 'invalid', 'duplicate', 'suspicious'), default='valid')
     
     employee = relationship("Employee", back_populates="attendance_records")
 
+    __table_args__ = (
+        Index('idx_attendance_emp_device_time', 'employee_id', 'device_time'),
+        Index('idx_att_time', 'punch_time'),
+    )
+
+class AttendancePartition(Base):
+    __tablename__ = 'attendance_partitions'
+    month = Column(Date, primary_key=True) # First day of the month moved out of attendance_records
+    table_name = Column(String(64), nullable=False)
+    status = Column(Enum('archiving', 'archived'), nullable=False)
+    row_count = Column(Integer, default=0)
+    archived_at = Column(DateTime)
+
 class Device(Base):
     __tablename__ = 'devices'
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -82,7 +98,189 @@ class Device(Base):
     ip_address = Column(String(45))
     port = Column(Integer, default=4370)
     status = Column(Enum('online', 'offline', 'error', 'maintenance'), default='offline')
+    last_sync_at = Column(DateTime)
+    last_heartbeat_at = Column(DateTime)
+    sync_snapshot = Column(Text) # JSON of device counters at the last user reconciliation
+    clock_offset_seconds = Column(Float) # Device clock minus host clock at the last check
+    clock_checked_at = Column(DateTime)
+    timezone = Column(String(50)) # Zone the terminal clock is set to; NULL means the organization's
+    active = Column(Boolean, default=True)
+
+class Shift(Base):
+    __tablename__ = 'shifts'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    organization_id = Column(Integer, ForeignKey('organizations.id'), nullable=False)
+    shift_name = Column(String(100), nullable=False)
+    shift_code = Column(String(50), nullable=False)
+    start_time = Column(Time, nullable=False)
+    end_time = Column(Time, nullable=False)
+    duration_minutes = Column(Integer, nullable=False)
+    break_minutes = Column(Integer, default=0)
+    grace_period_in = Column(Integer, default=0)
+    grace_period_out = Column(Integer, default=0)
+    is_overnight = Column(Boolean, default=False)
+    active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (UniqueConstraint('organization_id', 'shift_code'),)
+
+class EmployeeShift(Base):
+    __tablename__ = 'employee_shifts'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    employee_id = Column(Integer, ForeignKey('employees.id'), nullable=False)
+    shift_id = Column(Integer, ForeignKey('shifts.id'), nullable=False)
+    effective_date = Column(Date, nullable=False)
+    end_date = Column(Date) # Open-ended when NULL
+    day_of_week = Column(Integer) # 0=Monday..6=Sunday; NULL applies to every day
+    notes = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    shift = relationship("Shift")
+
+    __table_args__ = (Index('idx_empshift_emp_date', 'employee_id', 'effective_date'),)
+
+class LeaveType(Base):
+    __tablename__ = 'leave_types'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    organization_id = Column(Integer, ForeignKey('organizations.id'), nullable=False)
+    leave_name = Column(String(100), nullable=False)
+    leave_code = Column(String(50), nullable=False) # Matches Leave.leave_type
+    description = Column(Text)
+    is_paid = Column(Boolean, default=True)
+    max_days_per_year = Column(Integer) # Credited at the start of each year; NULL means no entitlement
+    carry_forward = Column(Boolean, default=False)
+    include_weekends = Column(Boolean, default=False)
     active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (UniqueConstraint('organization_id', 'leave_code'),)
+
+class LeaveBalance(Base):
+    __tablename__ = 'leave_balances'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    employee_id = Column(Integer, ForeignKey('employees.id'), nullable=False)
+    leave_type_id = Column(Integer, ForeignKey('leave_types.id'), nullable=False)
+    year = Column(Integer, nullable=False)
+    opening_balance = Column(DECIMAL(5, 2), default=0)
+    earned = Column(DECIMAL(5, 2), default=0)
+    used = Column(DECIMAL(5, 2), default=0)
+    adjusted = Column(DECIMAL(5, 2), default=0)
+    closing_balance = Column(DECIMAL(5, 2), default=0) # Running total of the ledger entries below
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    leave_type = relationship("LeaveType")
+
+    __table_args__ = (UniqueConstraint('employee_id', 'leave_type_id', 'year'),)
+
+class LeaveLedgerEntry(Base):
+    __tablename__ = 'leave_ledger'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    employee_id = Column(Integer, ForeignKey('employees.id'), nullable=False)
+    leave_type_id = Column(Integer, ForeignKey('leave_types.id'), nullable=False)
+    period = Column(Date, nullable=False) # First day of the month the days fall in
+    entry_type = Column(Enum('opening', 'earned', 'used', 'adjusted'), nullable=False)
+    days = Column(DECIMAL(5, 2), nullable=False) # Negative entries reverse earlier ones
+    leave_id = Column(Integer, ForeignKey('leaves.id', ondelete='SET NULL')) # Cleared when the leave is deleted
+    reason = Column(String(255))
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('idx_ledger_period', 'period', 'employee_id'),
+        Index('idx_ledger_leave', 'leave_id'),
+    )
+
+class Holiday(Base):
+    __tablename__ = 'holidays'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    organization_id = Column(Integer, ForeignKey('organizations.id'), nullable=False)
+    holiday_name = Column(String(255), nullable=False)
+    holiday_date = Column(Date, nullable=False)
+    holiday_type = Column(Enum('public', 'optional', 'restricted'), default='public')
+    is_recurring = Column(Boolean, default=False) # Repeats on the same month and day every year
+    applies_to_all = Column(Boolean, default=True)
+    description = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (Index('idx_holiday_org_date', 'organization_id', 'holiday_date'),)
+
+class DailyAttendance(Base):
+    __tablename__ = 'daily_attendance'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    employee_id = Column(Integer, ForeignKey('employees.id'), nullable=False)
+    attendance_date = Column(Date, nullable=False)
+    shift_id = Column(Integer, ForeignKey('shifts.id'))
+    first_in = Column(DateTime)
+    last_out = Column(DateTime)
+    total_hours = Column(DECIMAL(5, 2), default=0)
+    regular_hours = Column(DECIMAL(5, 2), default=0)
+    overtime_hours = Column(DECIMAL(5, 2), default=0)
+    break_hours = Column(DECIMAL(5, 2), default=0)
+    late_minutes = Column(Integer, default=0)
+    early_departure_minutes = Column(Integer, default=0)
+    status = Column(Enum('present', 'absent', 'late', 'half_day', 'leave', 'holiday', 'weekend', 'off'), default='absent')
+    is_processed = Column(Boolean, default=False) # False while the day is waiting for recomputation
+    processed_at = Column(DateTime)
+    notes = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow) # Last time the day was marked dirty
+
+    __table_args__ = (
+        UniqueConstraint('employee_id', 'attendance_date'),
+        Index('idx_daily_date', 'attendance_date'),
+        Index('idx_daily_processed', 'is_processed'),
+    )
+
+class DeviceSyncLog(Base):
+    __tablename__ = 'device_sync_logs'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    device_id = Column(Integer, ForeignKey('devices.id'), nullable=False)
+    operation = Column(Enum('sync', 'rotate', 'clock', 'users'), nullable=False)
+    status = Column(Enum('success', 'failed'), nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime)
+    records = Column(Integer, default=0) # Punches downloaded or users written
+    new_records = Column(Integer, default=0)
+    message = Column(Text)
+
+    __table_args__ = (Index('idx_sync_log_started', 'started_at'),)
+
+class DataVersion(Base):
+    __tablename__ = 'data_versions'
+    scope = Column(String(30), primary_key=True) # employees, leaves, shifts, calendar, devices, punches
+    version = Column(Integer, nullable=False, default=0) # Bumped by every committed ORM edit in the scope
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class JobRun(Base):
+    __tablename__ = 'job_runs'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(String(100), nullable=False)
+    job_class = Column(String(30), nullable=False)
+    status = Column(Enum('running', 'success', 'failed', 'missed', 'deferred', 'skipped'), nullable=False)
+    scheduled_at = Column(DateTime) # Set for missed runs
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime)
+    message = Column(Text)
+
+    __table_args__ = (Index('idx_job_run_started', 'job_id', 'started_at'),)
+
+class BackupHistory(Base):
+    __tablename__ = 'backup_history'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    backup_name = Column(String(255), nullable=False)
+    backup_type = Column(Enum('full', 'incremental', 'differential'), nullable=False)
+    backup_path = Column(String(500), nullable=False)
+    file_size_bytes = Column(BIGINT)
+    status = Column(Enum('success', 'failed', 'in_progress'), nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    completed_at = Column(DateTime)
+    error_message = Column(Text)
+    created_by = Column(Integer, ForeignKey('admin_users.id'))
+    parent_id = Column(Integer, ForeignKey('backup_history.id')) # Backup an incremental's pages are relative to
+
+    __table_args__ = (
+        Index('idx_backup_status', 'status'),
+        Index('idx_backup_date', 'started_at'),
+    )
 
 class AdminUser(Base):
     __tablename__ = 'admin_users'
@@ -0,0 +1,80 @@
+"""
+Lightweight read-only rows for list views and reports.
+
+Queries here select plain columns and wrap each result row in a NamedTuple,
+so loading tens of thousands of punches does not build ORM instances,
+register them in the identity map or lazy-load their employee.
+"""
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+
+class PunchRow(NamedTuple):
+    employee_id: int
+    employee_number: str
+    first_name: str
+    last_name: str
+    device_id: int
+    punch_time: datetime
+    punch_type: str
+    status: str
+
+
+class EmployeeRow(NamedTuple):
+    id: int
+    employee_number: str
+    first_name: str
+    last_name: str
+    department: str
+    contract_type: str
+    status: str
+    hire_date: object
+
+
+def punch_rows(session, employee_id=None, day=None, limit=None):
+    """
+    Punches newest first as PunchRow, optionally for one employee and/or one
+    day. Without a day only the hot table is listed, not archived months.
+    """
+    from database.archive import punch_source
+    from database.models import AttendanceRecord, Employee
+
+    if day is not None:
+        start = datetime.combine(day, datetime.min.time())
+        punches = punch_source(session, start, start + timedelta(days=1))
+    else:
+        punches = AttendanceRecord.__table__
+    query = session.query(
+        punches.c.employee_id, Employee.employee_number, Employee.first_name, Employee.last_name,
+        punches.c.device_id, punches.c.punch_time, punches.c.punch_type,
+        punches.c.status
+    ).join(Employee, Employee.id == punches.c.employee_id)
+    if employee_id is not None:
+        query = query.filter(punches.c.employee_id == employee_id)
+    if day is not None:
+        query = query.filter(punches.c.punch_time >= start,
+                             punches.c.punch_time < start + timedelta(days=1))
+    query = query.order_by(punches.c.punch_time.desc())
+    if limit is not None:
+        query = query.limit(limit)
+    return [PunchRow._make(row) for row in query.all()]
+
+
+def employee_rows(session, search_text=None, contract_type=None):
+    """Employees with their department name as EmployeeRow, filtered like the Employees page."""
+    from database.models import Department, Employee
+
+    query = session.query(
+        Employee.id, Employee.employee_number, Employee.first_name, Employee.last_name,
+        Department.name, Employee.contract_type, Employee.status, Employee.hire_date
+    ).join(Department, Department.id == Employee.department_id)
+    if search_text:
+        query = query.filter(
+            (Employee.first_name.ilike(f"%{search_text}%")) |
+            (Employee.last_name.ilike(f"%{search_text}%")) |
+            (Employee.employee_number.ilike(f"%{search_text}%")) |
+            (Department.name.ilike(f"%{search_text}%"))
+        )
+    if contract_type is not None:
+        query = query.filter(Employee.contract_type == contract_type)
+    return [EmployeeRow._make(row) for row in query.all()]
@@ -0,0 +1,127 @@
+"""
+Single database writer.
+
+SQLite admits one writer at a time; sessions that write on their own
+contend for the lock, and a session that read first and then writes fails
+with "database is locked" as soon as another connection committed in
+between. The writer thread owns the only write connection (BEGIN
+IMMEDIATE, see database.connection) and runs write jobs from a queue.
+
+A job is a callable job(session, *args) that stages its changes in the
+session and returns a plain value; it must not commit. Each job runs in
+its own SAVEPOINT, so a failing job is rolled back alone, and every job
+queued by the time the writer gets to them (up to write_group_size) is
+committed together: one commit, and one fsync, for the whole group.
+
+Readers use db_manager.get_read_session() and never wait for the writer.
+"""
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+from config import DATABASE_CONFIGS
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseWriter:
+    """Runs queued write jobs on one thread and connection, committing them in groups."""
+
+    def __init__(self, group_size=None):
+        self.group_size = group_size or DATABASE_CONFIGS['write_group_size']
+        self._queue = queue.Queue()
+        self._thread = None
+        self._session = None
+        self._lock = threading.Lock()
+        self.stats = {'jobs': 0, 'failed_jobs': 0, 'commits': 0}
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='database-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, job, *args, **kwargs):
+        """Queue a write job; returns a Future of its result, set once its group is committed."""
+        future = Future()
+        self.start()
+        self._queue.put((future, job, args, kwargs))
+        return future
+
+    def call(self, job, *args, timeout=None, **kwargs):
+        """Run a write job and wait for it to be committed. Returns its result or raises its error."""
+        if threading.current_thread() is self._thread:
+            # Called from inside another job: part of that job's savepoint and commit
+            return job(self._session, *args, **kwargs)
+        return self.submit(job, *args, **kwargs).result(timeout)
+
+    def stop(self, timeout=None):
+        """Commit the jobs already queued, then end the writer thread."""
+        with self._lock:
+            thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            group = [item]
+            # Whatever queued up during the previous commit goes into this one
+            while len(group) < self.group_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                group.append(item)
+            self._commit_group(group)
+
+    def _commit_group(self, group):
+        from database.connection import db_manager
+
+        try:
+            session = db_manager.WriteSessionFactory()
+        except Exception as e:
+            for future, _, _, _ in group:
+                future.set_exception(e)
+            return
+        self._session = session
+        done = []
+        try:
+            for future, job, args, kwargs in group:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    with session.begin_nested():
+                        result = job(session, *args, **kwargs)
+                except Exception as e:
+                    self.stats['failed_jobs'] += 1
+                    logger.error(f"Write job {getattr(job, '__name__', job)} failed: {e}")
+                    future.set_exception(e)
+                    continue
+                done.append((future, result))
+            try:
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logger.error(f"Commit of {len(done)} write jobs failed: {e}")
+                for future, _ in done:
+                    future.set_exception(e)
+                return
+            self.stats['jobs'] += len(done)
+            self.stats['commits'] += 1
+            for future, result in done:
+                future.set_result(result)
+        finally:
+            self._session = None
+            session.close()
+
+
+db_writer = DatabaseWriter()
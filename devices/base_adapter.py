@@ -1,5 +1,21 @@
 
+import threading
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+_session_locks = {}
+_session_locks_guard = threading.Lock()
+
+
+def session_lock(ip_address, port):
+    """
+    Lock held while this process has a session open with the terminal at an
+    address. Terminals accept a single session, so a second connect (a
+    scheduled sync during maintenance, a page button) waits for the first.
+    """
+    with _session_locks_guard:
+        return _session_locks.setdefault((ip_address, port), threading.Lock())
+
 
 class BaseDeviceAdapter(ABC):
     def __init__(self, ip_address, port=4370, timeout=10, password=0):
@@ -8,6 +24,12 @@ class BaseDeviceAdapter(ABC):
         self.timeout = timeout
         self.password = password
         self.connected = False
+        # Reads raise instead of returning an empty result; set for polled
+        # tasks so a terminal that accepts connections but fails reads counts
+        # as failing (see DeviceConnectionManager.run)
+        self.raise_errors = False
+        # Set when connect() gave up because another session held the terminal
+        self.busy = False
 
     @abstractmethod
     def connect(self):
@@ -43,3 +65,46 @@ class BaseDeviceAdapter(ABC):
     def delete_user(self, uid, user_id):
         """Delete a user from the device."""
         pass
+
+    @contextmanager
+    def disabled(self):
+        """
+        Hold the device out of service for several operations so no punches
+        are taken in between. Adapters without such a mode just run the block.
+        """
+        yield self
+
+    def get_counters(self):
+        """
+        Return storage counters ({'users', 'fingers', 'records', ...}) used to
+        detect changes without downloading. An empty dict means unsupported.
+        """
+        return {}
+
+    def get_time(self):
+        """Return the device clock as a naive datetime, or None if unsupported."""
+        return None
+
+    def set_time(self, timestamp):
+        """Set the device clock. Returns False if unsupported."""
+        return False
+
+    def set_users(self, users):
+        """
+        Set/Create many users. `users` is an iterable of dicts with set_user's
+        keyword arguments. Returns the number of users written.
+        Adapters should override this to write inside a single session.
+        """
+        count = 0
+        for user in users:
+            if self.set_user(**user):
+                count += 1
+        return count
+
+    def delete_users(self, users):
+        """Delete many users given dicts with delete_user's keyword arguments."""
+        count = 0
+        for user in users:
+            if self.delete_user(**user):
+                count += 1
+        return count
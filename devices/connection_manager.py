@@ -0,0 +1,348 @@
+import logging
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from config import DEVICE_CONFIGS, APP_CONFIGS
+
+logger = logging.getLogger(__name__)
+
+try:
+    from zk.exception import ZKError
+except ImportError:
+    # pyzk is only needed by the ZK adapters
+    ZKError = OSError
+
+# What a task raises when the terminal or the network to it failed (socket timeouts are OSErrors)
+DEVICE_ERRORS = (OSError, ZKError)
+
+# Circuit breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class DeviceHealth:
+    """Connection health of a single device as seen by the monitor."""
+
+    __slots__ = ('device_id', 'status', 'circuit', 'failures', 'next_attempt_at',
+                 'opened_at', 'last_error', 'last_heartbeat_at')
+
+    def __init__(self, device_id):
+        self.device_id = device_id
+        self.status = 'offline'
+        self.circuit = CLOSED
+        self.failures = 0
+        self.next_attempt_at = 0.0
+        self.opened_at = None
+        self.last_error = None
+        self.last_heartbeat_at = None
+
+    def as_dict(self):
+        return {
+            'device_id': self.device_id,
+            'status': self.status,
+            'circuit': self.circuit,
+            'failures': self.failures,
+            'last_error': self.last_error,
+            'last_heartbeat': self.last_heartbeat_at,
+        }
+
+
+class DeviceHealthMonitor:
+    """
+    Tracks per-device connection state and decides when a device may be contacted.
+
+    Each failure pushes the next attempt out with exponential backoff and full jitter.
+    After `max_retry_attempts` consecutive failures the circuit opens and the device
+    is skipped until `circuit_reset_timeout` has passed; it is then probed once
+    (half-open) with a short TCP check before a full connect is allowed again.
+    Status changes are buffered and written to `devices.status` in batches by flush().
+    """
+
+    def __init__(self, max_failures=None, base_delay=None, max_delay=None,
+                 reset_timeout=None, probe_timeout=None, clock=time.monotonic):
+        self.max_failures = max_failures or DEVICE_CONFIGS['max_retry_attempts']
+        self.base_delay = base_delay or DEVICE_CONFIGS.get('retry_base_delay', 2)
+        self.max_delay = max_delay or DEVICE_CONFIGS.get('retry_max_delay', 300)
+        self.reset_timeout = reset_timeout or DEVICE_CONFIGS.get('circuit_reset_timeout', 600)
+        self.probe_timeout = probe_timeout or DEVICE_CONFIGS.get('probe_timeout', 2)
+        self.clock = clock
+        self._states = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def _state(self, device_id):
+        state = self._states.get(device_id)
+        if state is None:
+            state = self._states[device_id] = DeviceHealth(device_id)
+        return state
+
+    def get(self, device_id):
+        with self._lock:
+            return self._state(device_id).as_dict()
+
+    def snapshot(self):
+        with self._lock:
+            return [state.as_dict() for state in self._states.values()]
+
+    def backoff_delay(self, failures):
+        """Full-jitter exponential backoff for the given number of consecutive failures."""
+        ceiling = min(self.max_delay, self.base_delay * (2 ** max(0, failures - 1)))
+        return random.uniform(0, ceiling)
+
+    def is_available(self, device_id):
+        """Return True if the device may be contacted now, without changing its state."""
+        now = self.clock()
+        with self._lock:
+            state = self._state(device_id)
+            if state.circuit == OPEN:
+                return now - state.opened_at >= self.reset_timeout
+            if state.circuit == HALF_OPEN:
+                return False
+            return now >= state.next_attempt_at
+
+    def acquire(self, device_id):
+        """
+        Claim a connection attempt. Returns None if the device must be skipped,
+        CLOSED for a normal attempt, or HALF_OPEN if the caller should probe first.
+        """
+        now = self.clock()
+        with self._lock:
+            state = self._state(device_id)
+            if state.circuit == OPEN:
+                if now - state.opened_at < self.reset_timeout:
+                    return None
+                # Let exactly one caller through to probe the device
+                state.circuit = HALF_OPEN
+                return HALF_OPEN
+            if state.circuit == HALF_OPEN:
+                return None
+            if now < state.next_attempt_at:
+                return None
+            return CLOSED
+
+    def release(self, device_id):
+        """Give back an attempt claimed with acquire() that was not made; a half-open probe stays due."""
+        with self._lock:
+            state = self._state(device_id)
+            if state.circuit == HALF_OPEN:
+                state.circuit = OPEN
+
+    def record_success(self, device_id):
+        with self._lock:
+            state = self._state(device_id)
+            if state.circuit != CLOSED:
+                logger.info(f"Device {device_id} recovered, closing circuit")
+            state.circuit = CLOSED
+            state.failures = 0
+            state.next_attempt_at = 0.0
+            state.opened_at = None
+            state.last_error = None
+            state.last_heartbeat_at = datetime.utcnow()
+            self._set_status(state, 'online')
+
+    def record_failure(self, device_id, error=None):
+        now = self.clock()
+        with self._lock:
+            state = self._state(device_id)
+            state.failures += 1
+            state.last_error = str(error) if error else None
+            if state.circuit == HALF_OPEN or state.failures >= self.max_failures:
+                if state.circuit != OPEN:
+                    logger.warning(f"Device {device_id} failed {state.failures} times, opening circuit")
+                state.circuit = OPEN
+                state.opened_at = now
+                self._set_status(state, 'error')
+            else:
+                state.next_attempt_at = now + self.backoff_delay(state.failures)
+                self._set_status(state, 'offline')
+
+    def set_maintenance(self, device_id, enabled=True):
+        """Take a device out of polling (or put it back) without counting failures."""
+        with self._lock:
+            state = self._state(device_id)
+            if enabled:
+                state.circuit = OPEN
+                state.opened_at = float('inf')
+                self._set_status(state, 'maintenance')
+            else:
+                state.circuit = CLOSED
+                state.failures = 0
+                state.next_attempt_at = 0.0
+                self._set_status(state, 'offline')
+
+    def _set_status(self, state, status):
+        if state.status != status:
+            state.status = status
+            self._dirty.add(state.device_id)
+        elif status == 'online':
+            # Heartbeat timestamps still need persisting
+            self._dirty.add(state.device_id)
+
+    def probe(self, ip_address, port=4370):
+        """Cheap TCP reachability check so dead terminals fail in seconds, not a full timeout."""
+        try:
+            with socket.create_connection((ip_address, port), timeout=self.probe_timeout):
+                return True
+        except OSError:
+            return False
+
+    def _take_dirty(self):
+        with self._lock:
+            dirty = [self._states[device_id] for device_id in self._dirty]
+            self._dirty.clear()
+        return dirty
+
+    def _restore_dirty(self, dirty):
+        with self._lock:
+            self._dirty.update(state.device_id for state in dirty)
+
+    def write_status(self, session, dirty):
+        """Stage status changes in session: one UPDATE per status, one executemany of heartbeats."""
+        from sqlalchemy import update
+        from database.models import Device
+
+        by_status = {}
+        heartbeats = []
+        for state in dirty:
+            by_status.setdefault(state.status, []).append(state.device_id)
+            if state.status == 'online' and state.last_heartbeat_at:
+                heartbeats.append(state)
+
+        for status, ids in by_status.items():
+            session.execute(update(Device).where(Device.id.in_(ids)).values(status=status))
+        if heartbeats:
+            # Bulk UPDATE by primary key: one executemany, each device keeps its own heartbeat
+            session.execute(update(Device), [
+                {'id': state.device_id, 'last_heartbeat_at': state.last_heartbeat_at} for state in heartbeats])
+        return len(dirty)
+
+    def flush(self, session):
+        """Write buffered status changes to the devices table and commit."""
+        dirty = self._take_dirty()
+        if not dirty:
+            return 0
+        try:
+            self.write_status(session, dirty)
+            session.commit()
+            return len(dirty)
+        except Exception as e:
+            logger.error(f"Error flushing device status: {e}")
+            session.rollback()
+            self._restore_dirty(dirty)
+            return 0
+
+    def submit_flush(self):
+        """Like flush(), as a database writer job that is not waited for. Returns its future (None: nothing to write)."""
+        from database.writer import db_writer
+
+        dirty = self._take_dirty()
+        if not dirty:
+            return None
+
+        def written(future):
+            if future.exception() is not None:
+                logger.error(f"Error flushing device status: {future.exception()}")
+                self._restore_dirty(dirty)
+
+        future = db_writer.submit(self.write_status, dirty)
+        future.add_done_callback(written)
+        return future
+
+
+class DeviceConnectionManager:
+    """Opens adapters for registered devices through the health monitor and polls them in parallel."""
+
+    def __init__(self, monitor=None, adapter_factory=None, timeout=None):
+        self.monitor = monitor or health_monitor
+        self.adapter_factory = adapter_factory or self._default_adapter
+        self.timeout = timeout or DEVICE_CONFIGS['connection_timeout']
+
+    def _default_adapter(self, device):
+        from devices.identix_k20 import IdentiXK20Adapter
+        return IdentiXK20Adapter(device.ip_address, port=device.port or 4370, timeout=self.timeout)
+
+    def connect(self, device):
+        """
+        Return a connected adapter for a Device row, or None if the device is
+        backing off, its circuit is open, or the connection fails. The caller
+        records the outcome of its work with the monitor (see run()).
+        """
+        return self._open(device)[0]
+
+    def _open(self, device):
+        """connect(), returning (adapter or None, whether the device was contacted)."""
+        mode = self.monitor.acquire(device.id)
+        if mode is None:
+            logger.debug(f"Skipping device {device.id}: backing off")
+            return None, False
+
+        if mode == HALF_OPEN and not self.monitor.probe(device.ip_address, device.port or 4370):
+            self.monitor.record_failure(device.id, "probe failed")
+            return None, True
+
+        adapter = self.adapter_factory(device)
+        if adapter.connect():
+            return adapter, True
+        if getattr(adapter, 'busy', False):
+            # Another operation of ours holds the terminal's only session; not the device's fault
+            logger.info(f"Skipping device {device.id}: busy with another operation")
+            self.monitor.release(device.id)
+            return None, False
+        self.monitor.record_failure(device.id, "connect failed")
+        return None, True
+
+    def run(self, device, task):
+        """
+        Connect, run task(adapter, device) and always disconnect. Returns (ok, result).
+
+        The device only counts as healthy once the task finished: its adapter
+        reads raise (raise_errors) and device errors (DEVICE_ERRORS) count
+        against the device's circuit. Anything else the task raises (the
+        database, ingestion) is our own failure and comes back as
+        (False, {'errors': [message]}).
+        """
+        adapter, contacted = self._open(device)
+        if adapter is None:
+            return False, None if contacted else {'skipped': True}
+        adapter.raise_errors = True
+        try:
+            result = task(adapter, device)
+        except DEVICE_ERRORS as e:
+            logger.error(f"Task failed on device {device.id}: {e}")
+            self.monitor.record_failure(device.id, e)
+            return False, None
+        except Exception as e:
+            logger.error(f"Task failed on device {device.id}: {e}")
+            self.monitor.record_success(device.id)
+            return False, {'errors': [str(e)]}
+        finally:
+            adapter.disconnect()
+        self.monitor.record_success(device.id)
+        return True, result
+
+    def poll(self, devices, task, max_workers=None):
+        """
+        Run task against every device in parallel. Devices whose circuit is open
+        are skipped without occupying a worker. Returns {device_id: (ok, result)};
+        the result of a device that was not contacted (backing off, circuit
+        open) is {'skipped': True}.
+        """
+        ready = [d for d in devices if self.monitor.is_available(d.id)]
+        results = {d.id: (False, {'skipped': True}) for d in devices}
+        if not ready:
+            return results
+
+        workers = min(len(ready), max_workers or APP_CONFIGS['max_concurrent_devices'])
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(self.run, device, task): device.id for device in ready}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+        return results
+
+
+health_monitor = DeviceHealthMonitor()
@@ -0,0 +1,215 @@
+"""
+Append-only archive of the raw buffers downloaded from devices.
+
+Each device gets a directory of monthly segment files. A segment is a
+sequence of entries, each a fixed header followed by the (optionally
+zlib compressed) buffer exactly as the terminal sent it:
+
+    magic 'RDMP' | version u8 | kind u8 | flags u8 | pad u8 |
+    count u32 | stored_len u32 | raw_len u32 | captured_at f64 | crc32 u32
+
+Readers memory-map segments and decode entries in place; a torn entry at
+the end of a segment (crash while appending) is ignored.
+
+Attendance logs only grow until they are rotated, so an attendance entry
+holds just the records appended since the segment's previous entry, as a
+buffer of its own (size prefix and records). The archived count and a
+checksum of the archived records are kept in archived.json next to the
+segments; a cleared or rewritten log, or a new month, is archived whole,
+so every segment replays on its own. prune_dumps() deletes segments older
+than raw_dump_retention_months.
+"""
+import logging
+import mmap
+import os
+import struct
+import threading
+import json
+import time
+import zlib
+from datetime import date, datetime
+
+from config import DEVICE_CONFIGS
+from devices.protocols.zk_records import attendance_record_size, parse_attendance, parse_users
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'RDMP'
+VERSION = 1
+HEADER = struct.Struct('<4sBBBxIIIdI')
+
+KIND_ATTENDANCE = 1
+KIND_USERS = 2
+
+FLAG_ZLIB = 1
+
+SEGMENT_SUFFIX = '.rdmp'
+STATE_FILE = 'archived.json'
+
+
+class DumpArchive:
+    """Writes raw device buffers for one device into monthly segment files."""
+
+    def __init__(self, device_key, location=None, compress=True):
+        self.location = os.path.join(location or DEVICE_CONFIGS.get('raw_dump_location', 'data/dumps/'), device_key)
+        self.compress = compress
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_adapter(cls, adapter, **kwargs):
+        return cls(device_key(adapter.ip_address, adapter.port), **kwargs)
+
+    def segment_path(self, when=None):
+        when = when or datetime.now()
+        return os.path.join(self.location, f"{when:%Y%m}{SEGMENT_SUFFIX}")
+
+    def _load_state(self):
+        try:
+            with open(os.path.join(self.location, STATE_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_state(self, state):
+        path = os.path.join(self.location, STATE_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(path + '.tmp', path)
+
+    def _new_records(self, raw, count, segment):
+        """
+        (buffer, count, state) of the attendance records not archived in
+        segment yet; state describes the whole log once they are.
+        """
+        size = attendance_record_size(raw, count)
+        state = {'segment': os.path.basename(segment), 'size': size, 'count': count,
+                 'crc': zlib.crc32(raw[4:4 + count * size])}
+        previous = self._load_state()
+        if size and previous and previous.get('segment') == state['segment'] and previous.get('size') == size \
+                and 0 < previous['count'] <= count \
+                and zlib.crc32(raw[4:4 + previous['count'] * size]) == previous['crc']:
+            done = previous['count']
+            raw = struct.pack('<I', (count - done) * size) + raw[4 + done * size:]
+            count -= done
+        return raw, count, state
+
+    def append(self, kind, buffer, count, captured_at=None):
+        """Append one buffer (attendance: its new records only). Failures are logged and never break the download."""
+        captured_at = captured_at or time.time()
+        raw = bytes(buffer)
+        try:
+            with self._lock:
+                segment = self.segment_path(datetime.fromtimestamp(captured_at))
+                state = None
+                if kind == KIND_ATTENDANCE:
+                    raw, count, state = self._new_records(raw, count, segment)
+                    if not count:
+                        return True
+                payload = zlib.compress(raw, 6) if self.compress else raw
+                header = HEADER.pack(MAGIC, VERSION, kind, FLAG_ZLIB if self.compress else 0,
+                                     count, len(payload), len(raw), captured_at, zlib.crc32(payload))
+                os.makedirs(self.location, exist_ok=True)
+                with open(segment, 'ab') as f:
+                    f.write(header + payload)
+                if state is not None:
+                    self._save_state(state)
+            return True
+        except OSError as e:
+            logger.error(f"Error archiving raw device buffer: {e}")
+            return False
+
+
+def device_key(ip_address, port):
+    return f"{ip_address}_{port}"
+
+
+def parse_device_key(key):
+    ip_address, _, port = key.rpartition('_')
+    return ip_address, int(port or 4370)
+
+
+def iter_entries(path):
+    """
+    Yield (kind, count, captured_at, buffer) for every intact entry of a segment.
+    Uncompressed buffers are memoryviews into the mapping, valid only until the
+    next iteration step.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < HEADER.size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                offset = 0
+                while offset + HEADER.size <= size:
+                    magic, version, kind, flags, count, stored_len, raw_len, captured_at, crc = \
+                        HEADER.unpack_from(mm, offset)
+                    start = offset + HEADER.size
+                    end = start + stored_len
+                    if magic != MAGIC or version != VERSION or end > size:
+                        logger.warning(f"Stopping at damaged entry in {path} (offset {offset})")
+                        break
+                    payload = view[start:end]
+                    try:
+                        if zlib.crc32(payload) != crc:
+                            logger.warning(f"Checksum mismatch in {path} (offset {offset})")
+                            break
+                        buffer = zlib.decompress(payload) if flags & FLAG_ZLIB else payload
+                        yield kind, count, captured_at, buffer
+                    finally:
+                        payload.release()
+                    offset = end
+            finally:
+                view.release()
+
+
+def iter_segments(location=None, device_keys=None, since=None):
+    """Yield (device_key, segment_path) in device and time order. `since` is a 'YYYYMM' string."""
+    location = location or DEVICE_CONFIGS.get('raw_dump_location', 'data/dumps/')
+    if not os.path.isdir(location):
+        return
+    for key in sorted(os.listdir(location)):
+        if device_keys and key not in device_keys:
+            continue
+        directory = os.path.join(location, key)
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(SEGMENT_SUFFIX) and (not since or name[:6] >= since):
+                yield key, os.path.join(directory, name)
+
+
+def read_segment(path, encoding='UTF-8'):
+    """
+    Decode a segment into (users, punches) batches. Yields ('users', list) and
+    ('attendance', list) in archive order; attendance from old 8 byte record
+    firmware is resolved with the most recent user table before it.
+    """
+    users_by_uid = None
+    for kind, count, captured_at, buffer in iter_entries(path):
+        if kind == KIND_USERS:
+            users = parse_users(buffer, count, encoding)
+            users_by_uid = {u.uid: u.user_id for u in users}
+            yield 'users', users
+        elif kind == KIND_ATTENDANCE:
+            yield 'attendance', parse_attendance(buffer, count, users_by_uid, encoding)
+
+
+def prune_dumps(location=None, months=None, today=None):
+    """Delete segments of months before the last raw_dump_retention_months. Returns the number deleted."""
+    months = months if months is not None else DEVICE_CONFIGS['raw_dump_retention_months']
+    today = today or date.today()
+    first = today.year * 12 + today.month - 1 - months
+    cutoff = f"{first // 12:04d}{first % 12 + 1:02d}"
+    deleted = 0
+    for key, path in iter_segments(location):
+        if os.path.basename(path)[:6] < cutoff:
+            try:
+                os.remove(path)
+                deleted += 1
+            except OSError as e:
+                logger.warning(f"Could not remove raw dump segment {path}: {e}")
+    if deleted:
+        logger.info(f"Pruned {deleted} raw dump segments before {cutoff}")
+    return deleted
@@ -1,12 +1,16 @@
 
+from contextlib import contextmanager
 from zk import ZK, const
-from devices.base_adapter import BaseDeviceAdapter
+from devices.base_adapter import BaseDeviceAdapter, session_lock
+from devices.dump_archive import DumpArchive, KIND_ATTENDANCE, KIND_USERS
+from devices.protocols.zk_records import attendance_record_size, parse_attendance, parse_users
+from config import DEVICE_CONFIGS
 import logging
 
 logger = logging.getLogger(__name__)
 
 class IdentiXK20Adapter(BaseDeviceAdapter):
-    def __init__(self, ip_address, port=4370, timeout=10, password=0):
+    def __init__(self, ip_address, port=4370, timeout=10, password=0, dump_archive=None):
         super().__init__(ip_address, port, timeout, password)
         self.zk = ZK(
             ip_address, 
@@ -17,8 +21,22 @@ class IdentiXK20Adapter(BaseDeviceAdapter):
             ommit_ping=False
         )
         self.conn = None
+        self._disable_depth = 0
+        self._session = None
+        # Raw buffers are archived so they can be replayed without the device
+        if dump_archive is None and DEVICE_CONFIGS.get('raw_dump_enabled'):
+            dump_archive = DumpArchive.for_adapter(self)
+        self.dump_archive = dump_archive
 
     def connect(self):
+        if self._session is None:
+            lock = session_lock(self.ip_address, self.port)
+            if not lock.acquire(timeout=self.timeout):
+                logger.warning(f"K20 device at {self.ip_address}:{self.port} is busy with another session")
+                self.busy = True
+                return False
+            self._session = lock
+        self.busy = False
         try:
             logger.info(f"Connecting to K20 device at {self.ip_address}:{self.port}")
             self.conn = self.zk.connect()
@@ -28,8 +46,14 @@ class IdentiXK20Adapter(BaseDeviceAdapter):
         except Exception as e:
             logger.error(f"Failed to connect to K20 device: {e}")
             self.connected = False
+            self._release_session()
             return False
 
+    def _release_session(self):
+        if self._session is not None:
+            self._session.release()
+            self._session = None
+
     def disconnect(self):
         if self.conn:
             try:
@@ -39,38 +63,125 @@ class IdentiXK20Adapter(BaseDeviceAdapter):
                 logger.error(f"Error disconnecting: {e}")
         self.connected = False
         self.conn = None
+        self._disable_depth = 0
+        self._release_session()
 
     def enable_device(self):
-        if self.conn:
-            self.conn.enable_device()
+        # Calls nest so operations inside disabled() don't re-enable the device early
+        if self.conn and self._disable_depth:
+            self._disable_depth -= 1
+            if self._disable_depth == 0:
+                self.conn.enable_device()
 
     def disable_device(self):
         if self.conn:
-            self.conn.disable_device()
+            if self._disable_depth == 0:
+                self.conn.disable_device()
+            self._disable_depth += 1
+
+    @contextmanager
+    def disabled(self):
+        """Keep the device disabled (no punches accepted) across several operations."""
+        self.disable_device()
+        try:
+            yield self
+        finally:
+            self.enable_device()
 
     def get_users(self):
         if not self.conn:
             return []
         try:
             self.disable_device()
-            users = self.conn.get_users()
-            self.enable_device()
-            return users
+            self.conn.read_sizes()
+            if not self.conn.users:
+                return []
+            buffer, size = self.conn.read_with_buffer(const.CMD_USERTEMP_RRQ, const.FCT_USER)
+            if size <= 4:
+                return []
+            if self.dump_archive:
+                self.dump_archive.append(KIND_USERS, buffer, self.conn.users)
+            return parse_users(buffer, self.conn.users, self.conn.encoding)
         except Exception as e:
             logger.error(f"Error getting users: {e}")
+            if self.raise_errors:
+                raise
             return []
+        finally:
+            self.enable_device()
 
-    def get_attendance(self):
+    def get_attendance(self, users_by_uid=None):
+        """
+        Download the attendance log. The buffer is decoded here rather than by
+        pyzk, which would download the whole user table first; users are only
+        fetched for old firmware whose 8 byte records carry no user_id.
+        """
         if not self.conn:
             return []
         try:
             self.disable_device()
-            records = self.conn.get_attendance()
-            self.enable_device()
-            return records
+            self.conn.read_sizes()
+            if not self.conn.records:
+                return []
+            buffer, size = self.conn.read_with_buffer(const.CMD_ATTLOG_RRQ)
+            if size < 4:
+                return []
+            if self.dump_archive:
+                self.dump_archive.append(KIND_ATTENDANCE, buffer, self.conn.records)
+            if users_by_uid is None and attendance_record_size(buffer, self.conn.records) == 8:
+                users_by_uid = {u.uid: u.user_id for u in self.get_users()}
+            return parse_attendance(buffer, self.conn.records, users_by_uid, self.conn.encoding)
         except Exception as e:
             logger.error(f"Error getting attendance: {e}")
+            if self.raise_errors:
+                raise
             return []
+        finally:
+            self.enable_device()
+
+    def get_counters(self):
+        """
+        Read the device's storage counters (ZK "read sizes"): users, fingerprint
+        templates, attendance records, cards and faces. Cheap compared to any
+        download, so callers can compare them against a snapshot first.
+        """
+        if not self.conn:
+            return {}
+        try:
+            self.conn.read_sizes()
+            return {
+                'users': self.conn.users,
+                'fingers': self.conn.fingers,
+                'records': self.conn.records,
+                'cards': self.conn.cards,
+                'faces': self.conn.faces,
+            }
+        except Exception as e:
+            logger.error(f"Error reading device counters: {e}")
+            if self.raise_errors:
+                raise
+            return {}
+
+    def get_time(self):
+        if not self.conn:
+            return None
+        try:
+            return self.conn.get_time()
+        except Exception as e:
+            logger.error(f"Error reading device time: {e}")
+            if self.raise_errors:
+                raise
+            return None
+
+    def set_time(self, timestamp):
+        if not self.conn:
+            return False
+        try:
+            self.conn.set_time(timestamp)
+            return True
+        except Exception as e:
+            logger.error(f"Error setting device time: {e}")
+            return False
 
     def clear_attendance(self):
         if not self.conn:
@@ -78,11 +189,12 @@ class IdentiXK20Adapter(BaseDeviceAdapter):
         try:
             self.disable_device()
             self.conn.clear_attendance()
-            self.enable_device()
             return True
         except Exception as e:
             logger.error(f"Error clearing attendance: {e}")
             return False
+        finally:
+            self.enable_device()
 
     def set_user(self, uid, name, privilege=0, password='', group_id='', user_id='', card=0):
         if not self.conn:
@@ -98,11 +210,12 @@ class IdentiXK20Adapter(BaseDeviceAdapter):
                 user_id=user_id,
                 card=card
             )
-            self.enable_device()
             return True
         except Exception as e:
             logger.error(f"Error setting user: {e}")
             return False
+        finally:
+            self.enable_device()
 
     def delete_user(self, uid=None, user_id=None):
         if not self.conn:
@@ -110,12 +223,61 @@ class IdentiXK20Adapter(BaseDeviceAdapter):
         try:
             self.disable_device()
             self.conn.delete_user(uid=uid, user_id=user_id)
-            self.enable_device()
             return True
         except Exception as e:
             logger.error(f"Error deleting user: {e}")
             return False
+        finally:
+            self.enable_device()
             
+    def set_users(self, users):
+        """Write many users inside one disable window, committing once at the end."""
+        if not self.conn:
+            return 0
+        count = 0
+        try:
+            self.disable_device()
+            for user in users:
+                try:
+                    self.conn.set_user(
+                        uid=user.get('uid'),
+                        name=user.get('name', ''),
+                        privilege=user.get('privilege', 0),
+                        password=user.get('password', ''),
+                        group_id=user.get('group_id', ''),
+                        user_id=user.get('user_id', ''),
+                        card=user.get('card', 0)
+                    )
+                    count += 1
+                except Exception as e:
+                    logger.error(f"Error setting user {user.get('user_id')}: {e}")
+            self.conn.refresh_data()
+        except Exception as e:
+            logger.error(f"Error setting users: {e}")
+        finally:
+            self.enable_device()
+        return count
+
+    def delete_users(self, users):
+        """Delete many users inside one disable window."""
+        if not self.conn:
+            return 0
+        count = 0
+        try:
+            self.disable_device()
+            for user in users:
+                try:
+                    self.conn.delete_user(uid=user.get('uid'), user_id=user.get('user_id'))
+                    count += 1
+                except Exception as e:
+                    logger.error(f"Error deleting user {user.get('user_id')}: {e}")
+            self.conn.refresh_data()
+        except Exception as e:
+            logger.error(f"Error deleting users: {e}")
+        finally:
+            self.enable_device()
+        return count
+
     def get_device_info(self):
         if not self.conn:
             return {}
@@ -129,4 +291,6 @@ class IdentiXK20Adapter(BaseDeviceAdapter):
             }
         except Exception as e:
             logger.error(f"Error getting device info: {e}")
+            if self.raise_errors:
+                raise
             return {}
@@ -0,0 +1,100 @@
+"""
+Decoders for the raw attendance and user buffers returned by ZK terminals
+(CMD_ATTLOG_RRQ / CMD_USERTEMP_RRQ). They follow pyzk's layouts so the
+adapter can read buffers directly without pyzk re-downloading the user
+table for every attendance download.
+"""
+from collections import namedtuple
+from datetime import datetime
+from struct import unpack_from
+
+# Same attribute names as pyzk's Attendance and User objects
+Punch = namedtuple('Punch', ['user_id', 'timestamp', 'status', 'punch', 'uid'])
+DeviceUser = namedtuple('DeviceUser', ['uid', 'name', 'privilege', 'password', 'group_id', 'user_id', 'card'])
+
+
+def decode_time(value):
+    """Decode the packed ZK timestamp integer."""
+    second = value % 60
+    value //= 60
+    minute = value % 60
+    value //= 60
+    hour = value % 24
+    value //= 24
+    day = value % 31 + 1
+    value //= 31
+    month = value % 12 + 1
+    value //= 12
+    year = value + 2000
+    return datetime(year, month, day, hour, minute, second)
+
+
+def _cstr(raw, encoding):
+    return raw.split(b'\x00')[0].decode(encoding, errors='ignore')
+
+
+def attendance_record_size(buffer, record_count):
+    """Bytes per record, from the size prefix of an attendance buffer."""
+    if record_count <= 0 or len(buffer) < 4:
+        return 0
+    return unpack_from('<I', buffer, 0)[0] // record_count
+
+
+def parse_attendance(buffer, record_count, users_by_uid=None, encoding='UTF-8'):
+    """
+    Decode an attendance buffer (including its 4 byte size prefix).
+
+    8 byte records only carry the device slot (uid); pass users_by_uid
+    ({uid: user_id}) to resolve them, otherwise the uid is used as user_id.
+    `buffer` may be bytes, a memoryview or an mmap.
+    """
+    record_size = attendance_record_size(buffer, record_count)
+    if not record_size:
+        return []
+    end = len(buffer)
+    offset = 4
+    punches = []
+
+    if record_size == 8:
+        while offset + 8 <= end:
+            uid, status, ts, punch = unpack_from('<HBIB', buffer, offset)
+            user_id = users_by_uid.get(uid, str(uid)) if users_by_uid else str(uid)
+            punches.append(Punch(user_id, decode_time(ts), status, punch, uid))
+            offset += 8
+    elif record_size == 16:
+        while offset + 16 <= end:
+            user_id, ts, status, punch = unpack_from('<IIBB', buffer, offset)
+            punches.append(Punch(str(user_id), decode_time(ts), status, punch, user_id))
+            offset += 16
+    else:
+        while offset + 40 <= end:
+            uid, user_id, status, ts, punch = unpack_from('<H24sBIB', buffer, offset)
+            punches.append(Punch(_cstr(user_id, encoding), decode_time(ts), status, punch, uid))
+            offset += record_size
+    return punches
+
+
+def parse_users(buffer, user_count, encoding='UTF-8'):
+    """Decode a user table buffer (including its 4 byte size prefix)."""
+    if user_count <= 0 or len(buffer) < 4:
+        return []
+    packet_size = unpack_from('<I', buffer, 0)[0] // user_count
+    end = len(buffer)
+    offset = 4
+    users = []
+
+    if packet_size == 28:
+        while offset + 28 <= end:
+            uid, privilege, password, name, card, group_id, _tz, user_id = unpack_from('<HB5s8sIxBhI', buffer, offset)
+            name = _cstr(name, encoding).strip() or f"NN-{user_id}"
+            users.append(DeviceUser(uid, name, privilege, _cstr(password, encoding), str(group_id), str(user_id), card))
+            offset += 28
+    else:
+        while offset + 72 <= end:
+            uid, privilege, password, name, card, group_id, user_id = unpack_from('<HB8s24sIx7sx24s', buffer, offset)
+            user_id = _cstr(user_id, encoding)
+            name = _cstr(name, encoding).strip() or f"NN-{user_id}"
+            users.append(DeviceUser(uid, name, privilege, _cstr(password, encoding),
+                                    _cstr(group_id, encoding).strip(), user_id, card))
+            offset += 72
+    return users
@@ -10,10 +10,6 @@ try:
 except Exception:
     from zk import zk, const
 
-from PyQt6.QtWidgets import QApplication
-
-from ui.main_window import MainWindow
-
 # Ensure log directory exists before configuring logging
 log_file = "data/logs/app.log"
 os.makedirs(os.path.dirname(log_file), exist_ok=True)
@@ -27,6 +23,11 @@ logging.basicConfig(
 
 
 def main():
+    # Imported here, not at module level: payroll worker processes are spawned and
+    # re-import this script, and must not load Qt or the UI
+    from PyQt6.QtWidgets import QApplication
+    from ui.main_window import MainWindow
+
     app = QApplication(sys.argv)
     # app.setStyle("Fusion") # Good baseline for custom styling
     app.setStyle("Windows")
@@ -57,6 +58,28 @@ def main():
     except Exception as e:
         logging.exception("Error ensuring default admin or listing admins: %s", e)
 
+    # Keep daily attendance figures and leave balances current in the background
+    try:
+        from core import leaves  # posts approved leaves to the balance ledger
+        from reports import cache  # versions the data cached reports were built from
+        from core.daily_attendance import RecomputeWorker
+        RecomputeWorker().start()
+    except Exception as e:
+        logging.exception("Error starting recompute worker: %s", e)
+
+    # Run device syncs, backups and report pre-rendering on schedule, off-peak work while the UI is idle
+    from ui.main_window import ActivityFilter
+    activity_filter = ActivityFilter()
+    app.installEventFilter(activity_filter)
+    try:
+        from config import SCHEDULER_CONFIGS
+        if SCHEDULER_CONFIGS['enabled']:
+            from tasks.scheduler import job_scheduler
+            job_scheduler.start()
+            app.aboutToQuit.connect(job_scheduler.shutdown)
+    except Exception as e:
+        logging.exception("Error starting job scheduler: %s", e)
+
     # Show login first; open main app only after successful login
     from ui.login_window import LoginWindow
     login = LoginWindow()
@@ -69,5 +69,360 @@ def migrate():
         except Exception as e:
             print(f"Error setting up admin_users: {e}")
 
+        # 4. Add health and sync tracking columns to devices
+        print("Adding health and sync columns to 'devices'...")
+        try:
+            result = conn.execute(text("PRAGMA table_info(devices)"))
+            columns = [row[1] for row in result]
+            for column, col_type in (('last_sync_at', 'DATETIME'), ('last_heartbeat_at', 'DATETIME'),
+                                     ('sync_snapshot', 'TEXT')):
+                if column not in columns:
+                    conn.execute(text(f"ALTER TABLE devices ADD COLUMN {column} {col_type}"))
+                    print(f"Column '{column}' added.")
+                else:
+                    print(f"Column '{column}' already exists.")
+            conn.commit()
+        except Exception as e:
+            print(f"Error adding device columns: {e}")
+
+        # 5. Create shifts and employee_shifts tables
+        print("Creating 'shifts' and 'employee_shifts' tables...")
+        try:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS shifts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    organization_id INTEGER NOT NULL,
+                    shift_name VARCHAR(100) NOT NULL,
+                    shift_code VARCHAR(50) NOT NULL,
+                    start_time TIME NOT NULL,
+                    end_time TIME NOT NULL,
+                    duration_minutes INTEGER NOT NULL,
+                    break_minutes INTEGER DEFAULT 0,
+                    grace_period_in INTEGER DEFAULT 0,
+                    grace_period_out INTEGER DEFAULT 0,
+                    is_overnight BOOLEAN DEFAULT 0,
+                    active BOOLEAN DEFAULT 1,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE (organization_id, shift_code),
+                    FOREIGN KEY(organization_id) REFERENCES organizations(id)
+                )
+            """))
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS employee_shifts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    employee_id INTEGER NOT NULL,
+                    shift_id INTEGER NOT NULL,
+                    effective_date DATE NOT NULL,
+                    end_date DATE,
+                    day_of_week INTEGER,
+                    notes TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY(employee_id) REFERENCES employees(id),
+                    FOREIGN KEY(shift_id) REFERENCES shifts(id)
+                )
+            """))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_empshift_emp_date ON employee_shifts (employee_id, effective_date)"))
+            conn.commit()
+            print("Shift tables created (if not existed).")
+        except Exception as e:
+            print(f"Error creating shift tables: {e}")
+
+        # 6. Create daily_attendance table
+        print("Creating 'daily_attendance' table...")
+        try:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS daily_attendance (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    employee_id INTEGER NOT NULL,
+                    attendance_date DATE NOT NULL,
+                    shift_id INTEGER,
+                    first_in DATETIME,
+                    last_out DATETIME,
+                    total_hours DECIMAL(5,2) DEFAULT 0,
+                    regular_hours DECIMAL(5,2) DEFAULT 0,
+                    overtime_hours DECIMAL(5,2) DEFAULT 0,
+                    break_hours DECIMAL(5,2) DEFAULT 0,
+                    late_minutes INTEGER DEFAULT 0,
+                    early_departure_minutes INTEGER DEFAULT 0,
+                    status VARCHAR(20) DEFAULT 'absent',
+                    is_processed BOOLEAN DEFAULT 0,
+                    processed_at DATETIME,
+                    notes TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE (employee_id, attendance_date),
+                    FOREIGN KEY(employee_id) REFERENCES employees(id),
+                    FOREIGN KEY(shift_id) REFERENCES shifts(id)
+                )
+            """))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_daily_date ON daily_attendance (attendance_date)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_daily_processed ON daily_attendance (is_processed)"))
+            conn.commit()
+            print("Daily attendance table created (if not existed).")
+        except Exception as e:
+            print(f"Error creating daily_attendance table: {e}")
+
+        # 7. Create holidays table and organization rest days
+        print("Creating 'holidays' table...")
+        try:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS holidays (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    organization_id INTEGER NOT NULL,
+                    holiday_name VARCHAR(255) NOT NULL,
+                    holiday_date DATE NOT NULL,
+                    holiday_type VARCHAR(20) DEFAULT 'public',
+                    is_recurring BOOLEAN DEFAULT 0,
+                    applies_to_all BOOLEAN DEFAULT 1,
+                    description TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY(organization_id) REFERENCES organizations(id)
+                )
+            """))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_holiday_org_date ON holidays (organization_id, holiday_date)"))
+            result = conn.execute(text("PRAGMA table_info(organizations)"))
+            columns = [row[1] for row in result]
+            if 'weekend_days' not in columns:
+                conn.execute(text("ALTER TABLE organizations ADD COLUMN weekend_days VARCHAR(20)"))
+                print("Column 'weekend_days' added.")
+            else:
+                print("Column 'weekend_days' already exists.")
+            conn.commit()
+            print("Holidays table created (if not existed).")
+        except Exception as e:
+            print(f"Error creating holidays table: {e}")
+
+        # 8. Create leave types, balances and ledger tables
+        print("Creating leave ledger tables...")
+        try:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS leave_types (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    organization_id INTEGER NOT NULL,
+                    leave_name VARCHAR(100) NOT NULL,
+                    leave_code VARCHAR(50) NOT NULL,
+                    description TEXT,
+                    is_paid BOOLEAN DEFAULT 1,
+                    max_days_per_year INTEGER,
+                    carry_forward BOOLEAN DEFAULT 0,
+                    include_weekends BOOLEAN DEFAULT 0,
+                    active BOOLEAN DEFAULT 1,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE (organization_id, leave_code),
+                    FOREIGN KEY(organization_id) REFERENCES organizations(id)
+                )
+            """))
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS leave_balances (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    employee_id INTEGER NOT NULL,
+                    leave_type_id INTEGER NOT NULL,
+                    year INTEGER NOT NULL,
+                    opening_balance DECIMAL(5,2) DEFAULT 0,
+                    earned DECIMAL(5,2) DEFAULT 0,
+                    used DECIMAL(5,2) DEFAULT 0,
+                    adjusted DECIMAL(5,2) DEFAULT 0,
+                    closing_balance DECIMAL(5,2) DEFAULT 0,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE (employee_id, leave_type_id, year),
+                    FOREIGN KEY(employee_id) REFERENCES employees(id),
+                    FOREIGN KEY(leave_type_id) REFERENCES leave_types(id)
+                )
+            """))
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS leave_ledger (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    employee_id INTEGER NOT NULL,
+                    leave_type_id INTEGER NOT NULL,
+                    period DATE NOT NULL,
+                    entry_type VARCHAR(20) NOT NULL,
+                    days DECIMAL(5,2) NOT NULL,
+                    leave_id INTEGER,
+                    reason VARCHAR(255),
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY(employee_id) REFERENCES employees(id),
+                    FOREIGN KEY(leave_type_id) REFERENCES leave_types(id),
+                    FOREIGN KEY(leave_id) REFERENCES leaves(id) ON DELETE SET NULL
+                )
+            """))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_ledger_period ON leave_ledger (period, employee_id)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_ledger_leave ON leave_ledger (leave_id)"))
+            conn.commit()
+            print("Leave ledger tables created (if not existed).")
+        except Exception as e:
+            print(f"Error creating leave ledger tables: {e}")
+
+        # 9. Add clock and time zone columns
+        print("Adding clock and time zone columns...")
+        try:
+            for table, column, col_type in (('devices', 'clock_offset_seconds', 'FLOAT'),
+                                            ('devices', 'clock_checked_at', 'DATETIME'),
+                                            ('devices', 'timezone', 'VARCHAR(50)'),
+                                            ('organizations', 'timezone', 'VARCHAR(50)'),
+                                            ('attendance_records', 'device_time', 'DATETIME')):
+                result = conn.execute(text(f"PRAGMA table_info({table})"))
+                columns = [row[1] for row in result]
+                if column not in columns:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {col_type}"))
+                    print(f"Column '{table}.{column}' added.")
+                else:
+                    print(f"Column '{table}.{column}' already exists.")
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_attendance_emp_device_time ON attendance_records (employee_id, device_time)"))
+            conn.commit()
+        except Exception as e:
+            print(f"Error adding clock columns: {e}")
+
+        # 10. Create device sync log table
+        print("Creating device_sync_logs table...")
+        try:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS device_sync_logs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    device_id INTEGER NOT NULL,
+                    operation VARCHAR(10) NOT NULL,
+                    status VARCHAR(10) NOT NULL,
+                    started_at DATETIME NOT NULL,
+                    finished_at DATETIME,
+                    records INTEGER DEFAULT 0,
+                    new_records INTEGER DEFAULT 0,
+                    message TEXT,
+                    FOREIGN KEY(device_id) REFERENCES devices(id)
+                )
+            """))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_sync_log_started ON device_sync_logs (started_at)"))
+            conn.commit()
+            print("Table 'device_sync_logs' created (if not existed).")
+        except Exception as e:
+            print(f"Error creating device_sync_logs table: {e}")
+
+        # 11. Index punches by time for keyset-paginated exports
+        print("Creating attendance time index...")
+        try:
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_att_time ON attendance_records (punch_time)"))
+            conn.commit()
+            print("Index 'idx_att_time' created (if not existed).")
+        except Exception as e:
+            print(f"Error creating attendance time index: {e}")
+
+        # 12. Create data version counters used to key the report cache
+        print("Creating data_versions table...")
+        try:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS data_versions (
+                    scope VARCHAR(30) PRIMARY KEY,
+                    version INTEGER NOT NULL DEFAULT 0,
+                    updated_at DATETIME
+                )
+            """))
+            conn.commit()
+            print("Table 'data_versions' created (if not existed).")
+        except Exception as e:
+            print(f"Error creating data_versions table: {e}")
+
+        # 13. Create scheduled job run history
+        print("Creating job_runs table...")
+        try:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS job_runs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id VARCHAR(100) NOT NULL,
+                    job_class VARCHAR(30) NOT NULL,
+                    status VARCHAR(10) NOT NULL,
+                    scheduled_at DATETIME,
+                    started_at DATETIME NOT NULL,
+                    finished_at DATETIME,
+                    message TEXT
+                )
+            """))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_job_run_started ON job_runs (job_id, started_at)"))
+            conn.commit()
+            print("Table 'job_runs' created (if not existed).")
+        except Exception as e:
+            print(f"Error creating job_runs table: {e}")
+
+        # 14. Create backup history table
+        print("Creating backup_history table...")
+        try:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS backup_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    backup_name VARCHAR(255) NOT NULL,
+                    backup_type VARCHAR(12) NOT NULL,
+                    backup_path VARCHAR(500) NOT NULL,
+                    file_size_bytes BIGINT,
+                    status VARCHAR(11) NOT NULL,
+                    started_at DATETIME NOT NULL,
+                    completed_at DATETIME,
+                    error_message TEXT,
+                    created_by INTEGER,
+                    parent_id INTEGER,
+                    FOREIGN KEY(created_by) REFERENCES admin_users(id),
+                    FOREIGN KEY(parent_id) REFERENCES backup_history(id)
+                )
+            """))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_backup_status ON backup_history (status)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_backup_date ON backup_history (started_at)"))
+            conn.commit()
+            print("Table 'backup_history' created (if not existed).")
+        except Exception as e:
+            print(f"Error creating backup_history table: {e}")
+
+        # 15. Create the archive partition registry; the monthly tables are created by database/archive.py
+        print("Creating attendance_partitions table...")
+        try:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS attendance_partitions (
+                    month DATE PRIMARY KEY,
+                    table_name VARCHAR(64) NOT NULL,
+                    status VARCHAR(9) NOT NULL,
+                    row_count INTEGER DEFAULT 0,
+                    archived_at DATETIME
+                )
+            """))
+            conn.commit()
+            print("Table 'attendance_partitions' created (if not existed).")
+        except Exception as e:
+            print(f"Error creating attendance_partitions table: {e}")
+
+        # 16. Let ledger entries outlive their leave (leave_id ON DELETE SET NULL); SQLite rebuilds the table
+        print("Updating leave_ledger.leave_id foreign key...")
+        try:
+            keys = conn.execute(text("PRAGMA foreign_key_list(leave_ledger)")).fetchall()
+            if any(row[2] == 'leaves' and row[6] != 'SET NULL' for row in keys):
+                conn.execute(text("""
+                    CREATE TABLE leave_ledger_new (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        employee_id INTEGER NOT NULL,
+                        leave_type_id INTEGER NOT NULL,
+                        period DATE NOT NULL,
+                        entry_type VARCHAR(20) NOT NULL,
+                        days DECIMAL(5,2) NOT NULL,
+                        leave_id INTEGER,
+                        reason VARCHAR(255),
+                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY(employee_id) REFERENCES employees(id),
+                        FOREIGN KEY(leave_type_id) REFERENCES leave_types(id),
+                        FOREIGN KEY(leave_id) REFERENCES leaves(id) ON DELETE SET NULL
+                    )
+                """))
+                # Entries of leaves deleted before this change point at nothing
+                conn.execute(text("""
+                    INSERT INTO leave_ledger_new
+                    SELECT id, employee_id, leave_type_id, period, entry_type, days,
+                           CASE WHEN leave_id IN (SELECT id FROM leaves) THEN leave_id END, reason, created_at
+                    FROM leave_ledger
+                """))
+                conn.execute(text("DROP TABLE leave_ledger"))
+                conn.execute(text("ALTER TABLE leave_ledger_new RENAME TO leave_ledger"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS idx_ledger_period ON leave_ledger (period, employee_id)"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS idx_ledger_leave ON leave_ledger (leave_id)"))
+                conn.commit()
+                print("Foreign key 'leave_ledger.leave_id' updated.")
+            else:
+                print("Foreign key 'leave_ledger.leave_id' already up to date.")
+        except Exception as e:
+            conn.rollback()
+            print(f"Error updating leave_ledger foreign key: {e}")
+
 if __name__ == "__main__":
     migrate()
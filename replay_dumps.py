@@ -0,0 +1,35 @@
+"""
+Replay archived raw device dumps into the database.
+Usage: python replay_dumps.py [--since YYYYMM] [--device IP_PORT ...] [--location DIR]
+"""
+import argparse
+import logging
+
+from config import DATABASE_CONFIGS, DEVICE_CONFIGS
+from database.connection import db_manager
+from services.sync_service import sync_service
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-ingest raw device dumps without contacting the devices.")
+    parser.add_argument('--since', help="First month to replay (YYYYMM)")
+    parser.add_argument('--device', action='append', help="Device key (IP_PORT) to replay; repeatable")
+    parser.add_argument('--location', default=DEVICE_CONFIGS.get('raw_dump_location', 'data/dumps/'))
+    args = parser.parse_args()
+
+    if not db_manager.connect(DATABASE_CONFIGS['sqlite']):
+        print("Could not connect to the database.")
+        return
+
+    stats = sync_service.replay_archive(db_manager.get_session(), args.location, args.device, args.since)
+    for key, counts in stats.items():
+        print(f"{key}: {counts['segments']} segments, {counts['records']} punches, "
+              f"{counts['new_records']} new, {counts['new_users']} new users")
+    if not stats:
+        print("Nothing to replay.")
+
+
+if __name__ == "__main__":
+    main()
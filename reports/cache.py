@@ -0,0 +1,237 @@
+"""
+On-disk cache of rendered reports and their row sets.
+
+Entries are keyed on report type, parameters and a data-version token
+built from what the report actually reads (reports.sources.data_scope):
+count and max id of the append-mostly tables over the report's own date
+range, plus the data_versions counters that ORM edits bump. A new punch
+therefore only changes the token of reports whose range covers it; other
+entries keep hitting. Files live under cache_location, recency is the file
+mtime (refreshed on every hit) and the least recently used files are
+evicted once the directory grows past cache_max_bytes.
+"""
+import glob
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+from datetime import datetime
+
+from sqlalchemy import event, func, insert, update
+from sqlalchemy.orm import Session
+
+from config import REPORT_CONFIGS
+
+logger = logging.getLogger(__name__)
+
+
+def _digest(value):
+    return hashlib.sha1(repr(value).encode('utf-8')).hexdigest()[:16]
+
+
+def data_token(session, report_key, params):
+    """Version token for the data one report run reads; equal tokens mean identical output."""
+    from database.models import AttendanceRecord, DataVersion, DeviceSyncLog, LeaveLedgerEntry
+    from reports.sources import data_scope
+
+    columns = {
+        'attendance_records': (AttendanceRecord.id, AttendanceRecord.punch_time),
+        'leave_ledger': (LeaveLedgerEntry.id, LeaveLedgerEntry.period),
+        'device_sync_logs': (DeviceSyncLog.id, DeviceSyncLog.started_at),
+    }
+    ranges, scopes = data_scope(report_key, params)
+    parts = []
+    for table in sorted(ranges):
+        id_column, range_column = columns[table]
+        start, end = ranges[table]
+        # Index range scans; count catches deletes, max(id) catches inserts
+        count, last_id = session.query(func.count(id_column), func.max(id_column)).filter(
+            range_column >= start, range_column < end
+        ).one()
+        parts.append(f"{table}:{count}:{last_id or 0}")
+    versions = dict(session.query(DataVersion.scope, DataVersion.version).filter(
+        DataVersion.scope.in_(scopes)))
+    parts.extend(f"{scope}:{versions.get(scope, 0)}" for scope in scopes)
+    return '|'.join(parts)
+
+
+class ReportCache:
+    """Size-bounded LRU of files named <report>-<params digest>-<token digest>.<kind>."""
+
+    def __init__(self, location=None, max_bytes=None):
+        self.location = location or REPORT_CONFIGS['cache_location']
+        self.max_bytes = max_bytes or REPORT_CONFIGS['cache_max_bytes']
+        self._lock = threading.Lock()
+
+    def _prefix(self, report_key, params):
+        return os.path.join(self.location, f"{report_key}-{_digest(sorted(params.items()))}")
+
+    def path(self, kind, report_key, params, token):
+        return f"{self._prefix(report_key, params)}-{_digest(token)}.{kind}"
+
+    def get(self, kind, report_key, params, token):
+        """Path of a cached entry, or None. A hit makes the entry most recently used."""
+        path = self.path(kind, report_key, params, token)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def put(self, kind, report_key, params, token, source, move=False):
+        """Store a file as an entry, dropping the entries it supersedes, and return the entry path."""
+        import shutil
+
+        path = self.path(kind, report_key, params, token)
+        with self._lock:
+            os.makedirs(self.location, exist_ok=True)
+            if move:
+                os.replace(source, path)
+            else:
+                # Copy beside the entry first so readers never see a partial file
+                temp = self.temp_path()
+                shutil.copyfile(source, temp)
+                os.replace(temp, path)
+            # Same report and parameters under an older token can never hit again
+            for stale in glob.glob(f"{glob.escape(self._prefix(report_key, params))}-*.{kind}"):
+                if stale != path:
+                    self._remove(stale)
+            self._evict()
+        return path
+
+    def temp_path(self):
+        """A fresh file inside the cache directory, so put(move=True) is an atomic rename."""
+        os.makedirs(self.location, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=self.location, suffix='.tmp')
+        os.close(fd)
+        return temp
+
+    def clear(self):
+        with self._lock:
+            for path in glob.glob(os.path.join(glob.escape(self.location), '*')):
+                self._remove(path)
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.location):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+            logger.debug(f"Evicted report cache entry {path}")
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+report_cache = ReportCache()
+
+
+def cached_rows(session, report_key, params, token, cache=None):
+    """
+    Report rows served from the cache when present; otherwise read from the
+    source and written to the cache block by block as they are yielded.
+    An abandoned iteration (a cancelled report) leaves no entry behind.
+    """
+    from reports.sources import REPORTS, blocks
+
+    cache = cache or report_cache
+    path = cache.get('rows', report_key, params, token)
+    if path is not None:
+        with open(path, 'rb') as fileobj:
+            while True:
+                try:
+                    block = pickle.load(fileobj)
+                except EOFError:
+                    return
+                yield from block
+
+    rows = REPORTS[report_key][2]
+    temp = cache.temp_path()
+    complete = False
+    try:
+        with open(temp, 'wb') as fileobj:
+            for block in blocks(rows(session, params)):
+                pickle.dump(block, fileobj, pickle.HIGHEST_PROTOCOL)
+                yield from block
+        complete = True
+    finally:
+        if complete:
+            try:
+                cache.put('rows', report_key, params, token, temp, move=True)
+            except OSError as e:
+                logger.warning(f"Could not cache {report_key} rows: {e}")
+        ReportCache._remove(temp)
+
+
+# --- change tracking -------------------------------------------------------
+
+def bump_versions(session, scopes):
+    """Increment data_versions counters inside the session's transaction."""
+    from database.models import DataVersion
+
+    scopes = sorted(set(scopes))
+    now = datetime.utcnow()
+    session.execute(update(DataVersion).where(DataVersion.scope.in_(scopes)).values(
+        version=DataVersion.version + 1, updated_at=now))
+    existing = {scope for (scope,) in session.query(DataVersion.scope).filter(DataVersion.scope.in_(scopes))}
+    missing = [{'scope': scope, 'version': 1, 'updated_at': now} for scope in scopes if scope not in existing]
+    if missing:
+        session.execute(insert(DataVersion), missing)
+
+
+def _tracker(scope):
+    def track(mapper, connection, target):
+        from sqlalchemy.orm import object_session
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault('report_scopes', set()).add(scope)
+    return track
+
+
+def _after_flush_postexec(session, flush_context):
+    scopes = session.info.pop('report_scopes', None)
+    if scopes:
+        bump_versions(session, scopes)
+
+
+def _after_rollback(session):
+    session.info.pop('report_scopes', None)
+
+
+def _register_listeners():
+    from database.models import (AttendanceRecord, Department, Device, Employee, EmployeeShift, Holiday, Leave,
+                                 LeaveType, Organization, Shift)
+
+    scopes = {
+        'employees': (Employee, Department),
+        'leaves': (Leave, LeaveType),
+        'shifts': (Shift, EmployeeShift),
+        'calendar': (Holiday, Organization),
+        'devices': (Device,),
+    }
+    for scope, models in scopes.items():
+        track = _tracker(scope)
+        for model in models:
+            for name in ('after_insert', 'after_update', 'after_delete'):
+                event.listen(model, name, track)
+    # New punches are covered by the range part of the token; only edits need a counter
+    track = _tracker('punches')
+    event.listen(AttendanceRecord, 'after_update', track)
+    event.listen(AttendanceRecord, 'after_delete', track)
+    event.listen(Session, 'after_flush_postexec', _after_flush_postexec)
+    event.listen(Session, 'after_rollback', _after_rollback)
+
+
+_register_listeners()
@@ -0,0 +1,180 @@
+"""
+Streaming Excel export of attendance punches.
+
+Punches are read in keyset-paginated pages ordered by (punch_time, id), so
+every page is an index range scan no matter how deep into the export it is,
+and written to an openpyxl write-only workbook, which serializes each row
+to a temporary sheet file as it is appended. Memory stays constant whatever
+the row count; sheets roll over at Excel's row limit.
+"""
+import gzip
+import heapq
+import itertools
+import logging
+import os
+
+from sqlalchemy import and_, or_
+
+from config import REPORT_CONFIGS
+from utils.formatting import PUNCH_TYPE_LABELS
+
+logger = logging.getLogger(__name__)
+
+HEADER = ("Employee ID", "Name", "Department", "Punch Time", "Type", "Device", "Status")
+
+
+class _StreamOnly:
+    """File wrapper without seek(), so zipfile writes sequentially (data descriptors) into a gzip stream."""
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._position = 0
+
+    def write(self, data):
+        self._fileobj.write(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        self._fileobj.flush()
+
+
+def _bounds(start_date=None, end_date=None):
+    from datetime import datetime, timedelta
+
+    start = datetime.combine(start_date, datetime.min.time()) if start_date is not None else None
+    end = datetime.combine(end_date, datetime.min.time()) + timedelta(days=1) if end_date is not None else None
+    return start, end
+
+
+def _punch_query(session, punches, start=None, end=None, department_id=None):
+    from database.models import Department, Employee
+
+    query = session.query(
+        punches.c.id, punches.c.punch_time, Employee.employee_number, Employee.first_name,
+        Employee.last_name, Department.name, punches.c.punch_type, punches.c.device_id,
+        punches.c.status
+    ).join(Employee, Employee.id == punches.c.employee_id
+    ).outerjoin(Department, Department.id == Employee.department_id)
+    if start is not None:
+        query = query.filter(punches.c.punch_time >= start)
+    if end is not None:
+        query = query.filter(punches.c.punch_time < end)
+    if department_id is not None:
+        query = query.filter(Employee.department_id == department_id)
+    return query
+
+
+def _table_pages(query, punches, page_size):
+    last = None
+    while True:
+        page_query = query
+        if last is not None:
+            last_time, last_id = last
+            page_query = page_query.filter(or_(
+                punches.c.punch_time > last_time,
+                and_(punches.c.punch_time == last_time, punches.c.id > last_id)
+            ))
+        page = page_query.order_by(punches.c.punch_time, punches.c.id).limit(page_size).all()
+        if not page:
+            return
+        yield page
+        last = (page[-1].punch_time, page[-1].id)
+
+
+def count_punches(session, start_date=None, end_date=None, department_id=None):
+    from database.archive import punch_tables
+
+    start, end = _bounds(start_date, end_date)
+    return sum(_punch_query(session, table, start, end, department_id).count()
+               for table in punch_tables(session, start, end))
+
+
+def punch_pages(session, start_date=None, end_date=None, department_id=None, page_size=None):
+    """
+    Yield pages of punch rows ordered by (punch_time, id), continuing after the last key seen.
+    Archive partitions in the range are paged separately and merged, so no page sorts a union.
+    """
+    from database.archive import punch_tables
+
+    page_size = page_size or REPORT_CONFIGS['export_page_size']
+    start, end = _bounds(start_date, end_date)
+    tables = punch_tables(session, start, end)
+    streams = [_table_pages(_punch_query(session, table, start, end, department_id), table, page_size)
+               for table in tables]
+    if len(streams) == 1:
+        yield from streams[0]
+        return
+    page = []
+    rows = heapq.merge(*(itertools.chain.from_iterable(stream) for stream in streams),
+                       key=lambda row: (row.punch_time, row.id))
+    for row in rows:
+        page.append(row)
+        if len(page) == page_size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def export_attendance(path, start_date=None, end_date=None, department_id=None, compress=False,
+                      session_factory=None, progress=None):
+    """
+    Export punches to an .xlsx file and return the path written. With
+    compress, the workbook is gzipped as it is written (path gets .gz).
+    progress, if given, is called as progress(rows_done, rows_total) after
+    every page; returning False from it cancels the export.
+    """
+    from openpyxl import Workbook
+
+    from database.connection import db_manager
+
+    max_rows = REPORT_CONFIGS['excel_max_rows'] - 1  # header row
+    if compress and not path.endswith('.gz'):
+        path += '.gz'
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    session_factory = session_factory or db_manager.get_read_session()
+    session = session_factory()
+    try:
+        total = count_punches(session, start_date, end_date, department_id)
+        workbook = Workbook(write_only=True)
+        sheet = None
+        sheet_rows = max_rows
+        done = 0
+        for page in punch_pages(session, start_date, end_date, department_id):
+            for row in page:
+                if sheet_rows >= max_rows:
+                    sheet = workbook.create_sheet(f"Punches {len(workbook.worksheets) + 1}")
+                    sheet.append(HEADER)
+                    sheet_rows = 0
+                sheet.append((
+                    row.employee_number,
+                    f"{row.first_name} {row.last_name}",
+                    row.name,
+                    row.punch_time,
+                    PUNCH_TYPE_LABELS.get(row.punch_type, row.punch_type),
+                    f"Device {row.device_id}",
+                    row.status,
+                ))
+                sheet_rows += 1
+            done += len(page)
+            if progress is not None and progress(done, max(total, done)) is False:
+                # Sheet files are temporary; nothing has been written to path yet
+                logger.info("Attendance export cancelled")
+                return None
+        if sheet is None:
+            workbook.create_sheet("Punches 1").append(HEADER)
+
+        if compress:
+            with gzip.open(path, 'wb') as fileobj:
+                workbook.save(_StreamOnly(fileobj))
+        else:
+            workbook.save(path)
+        logger.info(f"Exported {done} punches to {path}")
+        return path
+    finally:
+        session.close()
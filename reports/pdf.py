@@ -0,0 +1,152 @@
+"""
+Streaming PDF rendering for the reports in reports/sources.py.
+
+reportlab's doc template consumes its flowable list from the front, one
+flowable at a time. The list handed to build() is refilled lazily from a
+generator that turns rows_per_table report rows into one Table, so only the
+current table (and the compressed pages already written) is ever in memory.
+Finished PDFs and their rows go to the report cache (reports/cache.py), so a
+repeat run over unchanged data is a file copy.
+"""
+import logging
+import os
+import shutil
+from datetime import datetime
+
+from config import REPORT_CONFIGS
+
+logger = logging.getLogger(__name__)
+
+
+class StreamedFlowables(list):
+    """A flowable list that pulls the next flowable from an iterator whenever it runs empty."""
+
+    def __init__(self, flowables):
+        super().__init__()
+        self._source = iter(flowables)
+
+    def _fill(self):
+        if not list.__len__(self):
+            for flowable in self._source:
+                self.append(flowable)
+                break
+
+    def __len__(self):
+        self._fill()
+        return list.__len__(self)
+
+    def __getitem__(self, index):
+        self._fill()
+        return list.__getitem__(self, index)
+
+
+def report_path(report_key, params, location=None):
+    location = location or REPORT_CONFIGS['output_location']
+    stamp = '_'.join(str(params[k]) for k in sorted(params))
+    return os.path.join(location, f"{report_key}_{stamp}.pdf".replace(' ', '_').replace(':', ''))
+
+
+def render_pdf(report_key, params, path=None, session_factory=None, progress=None):
+    """
+    Render one report to a PDF file and return its path. progress, if given,
+    is called as progress(rows_done, rows_total) after every table block;
+    returning False from it cancels the report (the partial file is removed).
+    """
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import mm
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+    from database.connection import db_manager
+    from reports.cache import cached_rows, data_token, report_cache
+    from reports.sources import REPORTS, blocks, describe_params
+
+    title, columns, _, count = REPORTS[report_key]
+    path = path or report_path(report_key, params)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    styles = getSampleStyleSheet()
+    cell = styles['BodyText'].clone('ReportCell', fontName='Helvetica', fontSize=7, leading=8.5)
+    doc = SimpleDocTemplate(path, pagesize=landscape(A4), pageCompression=1, title=title,
+                            leftMargin=12 * mm, rightMargin=12 * mm, topMargin=12 * mm, bottomMargin=12 * mm)
+    total_weight = sum(weight for _, weight in columns)
+    widths = [doc.width * weight / total_weight for _, weight in columns]
+    header = [label for label, _ in columns]
+    # Text wider than this (column minus cell padding) is wrapped
+    fits = [width - 6 for width in widths]
+    table_style = TableStyle([
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 7),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#E8EAF0')),
+        ('LINEBELOW', (0, 0), (-1, -1), 0.25, colors.HexColor('#C8CCD4')),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ])
+
+    def footer(canvas, document):
+        canvas.saveState()
+        canvas.setFont('Helvetica', 7)
+        canvas.drawString(doc.leftMargin, 7 * mm, f"{title} - {describe_params(report_key, params)}")
+        canvas.drawRightString(doc.leftMargin + doc.width, 7 * mm, f"Page {document.page}")
+        canvas.restoreState()
+
+    class Cancelled(Exception):
+        pass
+
+    session_factory = session_factory or db_manager.get_read_session()
+    session = session_factory()
+    try:
+        token = data_token(session, report_key, params)
+        cached = report_cache.get('pdf', report_key, params, token)
+        if cached is not None:
+            shutil.copyfile(cached, path)
+            logger.info(f"Served {report_key} report from cache to {path}")
+            return path
+        total = count(session, params)
+
+        def flowables():
+            yield Paragraph(title, styles['Title'])
+            yield Paragraph(f"{describe_params(report_key, params)} &middot; generated "
+                            f"{datetime.now():%Y-%m-%d %H:%M}", styles['Normal'])
+            yield Spacer(1, 4 * mm)
+            done = 0
+            rows = cached_rows(session, report_key, params, token)
+            try:
+                for block in blocks(rows, REPORT_CONFIGS['rows_per_table']):
+                    data = [header] + [[_cell(value, width, cell) for value, width in zip(row, fits)]
+                                       for row in block]
+                    yield Table(data, colWidths=widths, repeatRows=1, style=table_style)
+                    done += len(block)
+                    if progress is not None and progress(done, max(total, done)) is False:
+                        raise Cancelled()
+            finally:
+                rows.close()
+            if not done:
+                yield Paragraph("No data for this period.", styles['Italic'])
+
+        try:
+            doc.build(StreamedFlowables(flowables()), onFirstPage=footer, onLaterPages=footer)
+        except Cancelled:
+            if os.path.exists(path):
+                os.remove(path)
+            logger.info(f"Report {report_key} cancelled")
+            return None
+        try:
+            report_cache.put('pdf', report_key, params, token, path)
+        except OSError as e:
+            logger.warning(f"Could not cache {report_key} report: {e}")
+        logger.info(f"Rendered {report_key} report to {path}")
+        return path
+    finally:
+        session.close()
+
+
+def _cell(value, width, style):
+    """Plain strings are cheap to lay out; only values too wide for their column become wrapping Paragraphs."""
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+    from reportlab.platypus import Paragraph
+
+    value = str(value)
+    if stringWidth(value, style.fontName, style.fontSize) <= width:
+        return value
+    return Paragraph(value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;'), style)
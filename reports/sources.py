@@ -0,0 +1,245 @@
+"""
+Row sources for the reports on the Reports page.
+
+Every report is a generator of display rows (tuples of strings) read from a
+streaming cursor and processed a fetch_size block at a time, plus a cheap
+count used for progress. Nothing here holds more than one block of rows, so
+renderers can write any number of rows in bounded memory.
+"""
+from datetime import date, datetime, timedelta
+from itertools import islice
+
+from config import REPORT_CONFIGS
+
+
+def blocks(rows, size=None):
+    """Split an iterator into lists of at most size items."""
+    size = size or REPORT_CONFIGS['fetch_size']
+    rows = iter(rows)
+    while True:
+        block = list(islice(rows, size))
+        if not block:
+            return
+        yield block
+
+
+def _number(value, digits=2):
+    return f"{float(value or 0):.{digits}f}"
+
+
+def _active_employees(session):
+    from database.models import Department, Employee
+
+    return session.query(
+        Employee.id, Employee.organization_id, Employee.employee_number, Employee.first_name,
+        Employee.last_name, Department.name
+    ).join(Department, Department.id == Employee.department_id).filter(Employee.status == 'active')
+
+
+# --- Daily Attendance --------------------------------------------------------
+
+def daily_attendance_count(session, params):
+    return _active_employees(session).count()
+
+
+def daily_attendance_rows(session, params):
+    """One row per active employee for params['date'], computed from punches, shifts, leave and calendar."""
+    from core.daily_attendance import day_status
+    from core.leave_index import leave_index
+    from core.shifts import attendance_exceptions, shift_resolver
+    from core.work_calendar import work_calendar
+    from database.models import Department, Employee
+    from utils.formatting import format_datetimes
+
+    day = params['date']
+    scheduled = shift_resolver.tables()['scheduled']
+    employees = _active_employees(session).order_by(Department.name, Employee.employee_number).yield_per(
+        REPORT_CONFIGS['fetch_size'])
+    for block in blocks(employees):
+        ids = [e.id for e in block]
+        frame = attendance_exceptions(session, day, day, ids)
+        by_emp = {int(rec['employee_id']): rec for rec in frame.to_dict('records')}
+        on_leave = leave_index.on_leave_many(ids, [day] * len(ids))
+        recs = [by_emp.get(e.id) for e in block]
+        first_in = format_datetimes([r['first_in'] if r is not None else None for r in recs])[1].tolist()
+        last_out = format_datetimes([r['last_out'] if r is not None else None for r in recs])[1].tolist()
+        for i, (emp, rec) in enumerate(zip(block, recs)):
+            shift_id = int(rec['shift_id']) if rec is not None else 0
+            if rec is not None and rec['first_in'] != rec['first_in']:
+                # NaT: a day the schedule expected but nobody punched
+                rec = dict(rec, first_in=None)
+            status = day_status(rec, bool(on_leave[i]), float(scheduled[shift_id]),
+                                work_calendar.day_type(emp.organization_id, day))
+            yield (
+                emp.employee_number,
+                f"{emp.first_name} {emp.last_name}",
+                emp.name,
+                first_in[i],
+                last_out[i],
+                _number(rec['worked_minutes'] / 60) if rec is not None else _number(0),
+                str(int(round(rec['late_minutes']))) if rec is not None else '0',
+                status.replace('_', ' ').capitalize(),
+            )
+
+
+# --- Monthly Leave Summary ---------------------------------------------------
+
+def leave_summary_count(session, params):
+    from core.leaves import leave_summary_query
+    return leave_summary_query(session, params['year'], params['month']).count()
+
+
+def leave_summary_rows(session, params):
+    from core.leaves import leave_summary_query
+
+    query = leave_summary_query(session, params['year'], params['month'])
+    for row in query.yield_per(REPORT_CONFIGS['fetch_size']):
+        yield (
+            row.employee_number,
+            f"{row.first_name} {row.last_name}",
+            row.department,
+            row.leave_name,
+            _number(row.days_taken, 1),
+            _number(row.balance, 1) if row.balance is not None else '',
+        )
+
+
+# --- Employee Working Hours --------------------------------------------------
+
+def working_hours_count(session, params):
+    return _active_employees(session).count()
+
+
+def working_hours_rows(session, params):
+    """Payroll totals, one partition (department slice) at a time in department order."""
+    from core.payroll import iter_payroll_hours
+
+    for frame in iter_payroll_hours(params['start_date'], params['end_date'], ordered=True):
+        for row in frame.itertuples(index=False):
+            yield (
+                row.employee_number,
+                row.name,
+                row.department,
+                str(row.days_worked),
+                _number(row.worked_hours),
+                _number(row.regular_hours),
+                _number(row.overtime_hours),
+                str(row.late_minutes),
+                str(row.absent_days),
+                str(row.leave_days),
+            )
+
+
+# --- Device Sync Logs --------------------------------------------------------
+
+def _sync_log_query(session, params):
+    from database.models import Device, DeviceSyncLog
+
+    start = datetime.combine(params['start_date'], datetime.min.time())
+    end = datetime.combine(params['end_date'], datetime.min.time()) + timedelta(days=1)
+    return session.query(
+        DeviceSyncLog.started_at, DeviceSyncLog.finished_at, Device.device_name, Device.ip_address,
+        DeviceSyncLog.operation, DeviceSyncLog.status, DeviceSyncLog.records, DeviceSyncLog.new_records,
+        DeviceSyncLog.message
+    ).join(Device, Device.id == DeviceSyncLog.device_id).filter(
+        DeviceSyncLog.started_at >= start,
+        DeviceSyncLog.started_at < end
+    )
+
+
+def sync_log_count(session, params):
+    return _sync_log_query(session, params).count()
+
+
+def sync_log_rows(session, params):
+    from database.models import DeviceSyncLog
+    from utils.formatting import format_datetimes
+
+    query = _sync_log_query(session, params).order_by(DeviceSyncLog.started_at.desc())
+    for block in blocks(query.yield_per(REPORT_CONFIGS['fetch_size'])):
+        dates, times = format_datetimes([r.started_at for r in block])
+        for row, day, time in zip(block, dates.tolist(), times.tolist()):
+            seconds = (row.finished_at - row.started_at).total_seconds() if row.finished_at else None
+            yield (
+                f"{day} {time}",
+                f"{row.device_name} ({row.ip_address})" if row.ip_address else row.device_name,
+                row.operation.capitalize(),
+                row.status.capitalize(),
+                f"{seconds:.1f}s" if seconds is not None else '',
+                str(row.records or 0),
+                str(row.new_records or 0),
+                row.message or '',
+            )
+
+
+def default_params(report_key, day=None):
+    """Parameters a report is run with for a reference day (today by default)."""
+    day = day or date.today()
+    if report_key == 'daily_attendance':
+        return {'date': day}
+    if report_key == 'leave_summary':
+        return {'year': day.year, 'month': day.month}
+    if report_key == 'working_hours':
+        return {'start_date': day.replace(day=1), 'end_date': day}
+    return {'start_date': day - timedelta(days=REPORT_CONFIGS['sync_log_days'] - 1), 'end_date': day}
+
+
+# key -> (title, [(column label, relative width)], rows(session, params), count(session, params))
+REPORTS = {
+    'daily_attendance': (
+        "Daily Attendance Report",
+        [("Employee ID", 1), ("Name", 2.2), ("Department", 1.6), ("First In", 1), ("Last Out", 1),
+         ("Hours", 0.8), ("Late (min)", 0.8), ("Status", 1)],
+        daily_attendance_rows, daily_attendance_count,
+    ),
+    'leave_summary': (
+        "Monthly Leave Summary",
+        [("Employee ID", 1), ("Name", 2.2), ("Department", 1.6), ("Leave Type", 1.4), ("Days Taken", 0.9),
+         ("Balance", 0.9)],
+        leave_summary_rows, leave_summary_count,
+    ),
+    'working_hours': (
+        "Employee Working Hours",
+        [("Employee ID", 1), ("Name", 2), ("Department", 1.5), ("Days", 0.6), ("Worked h", 0.8),
+         ("Regular h", 0.8), ("Overtime h", 0.8), ("Late (min)", 0.8), ("Absent", 0.7), ("Leave", 0.6)],
+        working_hours_rows, working_hours_count,
+    ),
+    'sync_logs': (
+        "Device Sync Logs",
+        [("Started", 1.5), ("Device", 2), ("Operation", 0.9), ("Status", 0.8), ("Duration", 0.8),
+         ("Records", 0.8), ("New", 0.7), ("Message", 3)],
+        sync_log_rows, sync_log_count,
+    ),
+}
+
+
+def data_scope(report_key, params):
+    """
+    What a report's output depends on: half-open {table: (start, end)} ranges
+    of the append-mostly tables it reads (punches, leave ledger, sync logs)
+    and the data_versions counters covering everything edited through the ORM.
+    """
+    def days(start, end, extra=1):
+        return (datetime.combine(start, datetime.min.time()),
+                datetime.combine(end, datetime.min.time()) + timedelta(days=extra))
+
+    if report_key == 'daily_attendance':
+        # load_punches() reads one extra day to close overnight sessions
+        return {'attendance_records': days(params['date'], params['date'], 2)}, \
+            ('employees', 'leaves', 'shifts', 'calendar', 'punches')
+    if report_key == 'leave_summary':
+        year = params['year']
+        return {'leave_ledger': (date(year, 1, 1), date(year + 1, 1, 1))}, ('employees', 'leaves')
+    if report_key == 'working_hours':
+        return {'attendance_records': days(params['start_date'], params['end_date'], 2)}, \
+            ('employees', 'leaves', 'shifts', 'calendar', 'punches')
+    return {'device_sync_logs': days(params['start_date'], params['end_date'])}, ('devices',)
+
+
+def describe_params(report_key, params):
+    """Human readable parameter line for report headers."""
+    if report_key == 'daily_attendance':
+        return params['date'].strftime('%A, %d %B %Y')
+    if report_key == 'leave_summary':
+        return date(params['year'], params['month'], 1).strftime('%B %Y')
+    return f"{params['start_date']:%d %b %Y} - {params['end_date']:%d %b %Y}"
@@ -0,0 +1,328 @@
+"""
+Online database backups.
+
+SQLite databases are copied with the online backup API, step_pages pages
+at a time, while one read transaction is held on the source. In WAL mode
+(set by db_manager.connect) that read snapshot does not block writers, and
+because the snapshot is fixed the copy never restarts when a device sync
+commits halfway through, however large the database is.
+
+Each copy is checked, then stored as either a full backup (the gzipped
+database file) or an incremental one: only the pages whose digest differs
+from the previous backup's page manifest. A full backup is taken when the
+last one is older than full_every_days or the chain is unusable.
+restore() rebuilds a database from a full backup and its incrementals.
+
+Other dialects are dumped with their own tool (pg_dump, mysqldump), which
+takes a consistent snapshot without locking writers.
+
+Every run is recorded in backup_history; backups past retention_days are
+pruned unless a retained incremental still depends on them.
+"""
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import struct
+import subprocess
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from config import BACKUP_CONFIGS
+
+logger = logging.getLogger(__name__)
+
+# Header line of an incremental file, then (page number, page bytes) records
+INCREMENTAL_MAGIC = b'TTINC1'
+PAGE_NUMBER = struct.Struct('>I')
+COPY_CHUNK = 1024 * 1024
+
+
+def _open(path, mode):
+    return gzip.open(path, mode) if path.endswith('.gz') else open(path, mode)
+
+
+def page_digests(path, page_size):
+    """8-byte digest of every page of a database file, as a uint64 array."""
+    digests = []
+    with open(path, 'rb') as fileobj:
+        while True:
+            page = fileobj.read(page_size)
+            if not page:
+                break
+            digests.append(hashlib.blake2b(page, digest_size=8).digest())
+    return np.frombuffer(b''.join(digests), dtype='<u8')
+
+
+class BackupService:
+    """Runs, restores and prunes backups of the application database."""
+
+    def __init__(self, location=None, session_factory=None):
+        self.location = location or BACKUP_CONFIGS['backup_location']
+        self.session_factory = session_factory
+
+    def _session(self):
+        from database.connection import db_manager
+        return (self.session_factory or db_manager.get_session())()
+
+    # --- running ---------------------------------------------------------
+
+    def run(self, backup_type=None, created_by=None, engine=None):
+        """
+        Back up the database now. backup_type 'full' forces a full backup;
+        by default SQLite backups are incremental when a usable parent exists.
+        Returns {'success', 'backup_id', 'backup_type', 'path', 'size', 'error'}.
+        """
+        from database.connection import db_manager
+        from database.models import BackupHistory
+
+        url = (engine or db_manager.engine).url
+        os.makedirs(self.location, exist_ok=True)
+        stamp = f"timetracker_{datetime.now():%Y%m%d_%H%M%S}"
+        session = self._session()
+        try:
+            row = BackupHistory(backup_name=stamp, backup_type=backup_type or 'full', backup_path=self.location,
+                                status='in_progress', started_at=datetime.utcnow(), created_by=created_by)
+            session.add(row)
+            session.flush()
+            # The row id keeps the files of two runs started in the same second apart
+            name = row.backup_name = f"{stamp}_{row.id}"
+            session.commit()
+            started = time.monotonic()
+            try:
+                if url.get_backend_name() == 'sqlite':
+                    kind, path, parent_id = self._sqlite_backup(session, url.database, name, backup_type)
+                else:
+                    kind, path, parent_id = 'full', self._dump_backup(url, name), None
+            except Exception as e:
+                session.rollback()
+                row.status = 'failed'
+                row.completed_at = datetime.utcnow()
+                row.error_message = str(e)
+                session.commit()
+                logger.error(f"Backup {name} failed: {e}")
+                return {'success': False, 'backup_id': row.id, 'backup_type': row.backup_type, 'path': None,
+                        'size': 0, 'error': str(e)}
+
+            row.backup_type = kind
+            row.backup_path = path
+            row.parent_id = parent_id
+            row.file_size_bytes = os.path.getsize(path)
+            row.status = 'success'
+            row.completed_at = datetime.utcnow()
+            session.commit()
+            logger.info(f"{kind.capitalize()} backup {path} ({row.file_size_bytes} bytes) "
+                        f"in {time.monotonic() - started:.1f}s")
+            return {'success': True, 'backup_id': row.id, 'backup_type': kind, 'path': path,
+                    'size': row.file_size_bytes, 'error': None}
+        finally:
+            session.close()
+
+    def _snapshot(self, source_path, target_path):
+        """Copy the live database page-step by page-step from one read snapshot."""
+        source = sqlite3.connect(source_path, isolation_level=None, timeout=30)
+        target = sqlite3.connect(target_path)
+        try:
+            # The read transaction pins the snapshot, so commits by other connections don't restart the copy
+            source.execute("BEGIN")
+            source.execute("SELECT count(*) FROM sqlite_master").fetchone()
+            source.backup(target, pages=BACKUP_CONFIGS['step_pages'], sleep=BACKUP_CONFIGS['step_sleep'])
+            source.execute("COMMIT")
+            if BACKUP_CONFIGS['verify']:
+                result = target.execute("PRAGMA quick_check").fetchone()[0]
+                if result != 'ok':
+                    raise RuntimeError(f"Backup copy failed its integrity check: {result}")
+            # Pages are copied as they are; the copy keeps the source's journal mode in its header
+            target.execute("PRAGMA journal_mode=DELETE")
+            return target.execute("PRAGMA page_size").fetchone()[0]
+        finally:
+            target.close()
+            source.close()
+
+    def _parent(self, session, page_size, backup_type):
+        """Latest successful SQLite backup an incremental can be based on, or None for a full backup."""
+        from database.models import BackupHistory
+
+        if backup_type == 'full':
+            return None
+        last = session.query(BackupHistory).filter(BackupHistory.status == 'success').order_by(
+            BackupHistory.started_at.desc(), BackupHistory.id.desc()).first()
+        if last is None or not os.path.exists(last.backup_path) or not os.path.exists(self._manifest(last.backup_path)):
+            return None
+        # Walk up to the chain's full backup: it must exist and be recent enough
+        node = last
+        while node.backup_type != 'full':
+            node = session.get(BackupHistory, node.parent_id) if node.parent_id else None
+            if node is None or not os.path.exists(node.backup_path):
+                return None
+        if datetime.utcnow() - node.started_at > timedelta(days=BACKUP_CONFIGS['full_every_days']):
+            return None
+        with open(self._manifest(last.backup_path), 'rb') as fileobj:
+            if int(fileobj.read(8).decode() or 0) != page_size:
+                return None
+        return last
+
+    @staticmethod
+    def _manifest(backup_path):
+        root = backup_path[:-3] if backup_path.endswith('.gz') else backup_path
+        return os.path.splitext(root)[0] + '.pages'
+
+    def _sqlite_backup(self, session, source_path, name, backup_type):
+        snapshot = os.path.join(self.location, f"{name}.snapshot")
+        try:
+            page_size = self._snapshot(source_path, snapshot)
+            digests = page_digests(snapshot, page_size)
+            parent = self._parent(session, page_size, backup_type)
+            suffix = '.gz' if BACKUP_CONFIGS['compress'] else ''
+
+            if parent is None:
+                kind, parent_id = 'full', None
+                path = os.path.join(self.location, f"{name}.db{suffix}")
+                with open(snapshot, 'rb') as source, _open(path, 'wb') as target:
+                    shutil.copyfileobj(source, target, COPY_CHUNK)
+            else:
+                kind, parent_id = 'incremental', parent.id
+                path = os.path.join(self.location, f"{name}.inc{suffix}")
+                with open(self._manifest(parent.backup_path), 'rb') as fileobj:
+                    fileobj.read(8)
+                    previous = np.frombuffer(fileobj.read(), dtype='<u8')
+                common = min(len(previous), len(digests))
+                changed = np.concatenate([np.nonzero(previous[:common] != digests[:common])[0],
+                                          np.arange(common, len(digests))])
+                with open(snapshot, 'rb') as source, _open(path, 'wb') as target:
+                    target.write(INCREMENTAL_MAGIC + f" {page_size} {len(digests)} {parent.backup_name}\n".encode())
+                    for page_number in changed.tolist():
+                        source.seek(page_number * page_size)
+                        target.write(PAGE_NUMBER.pack(page_number))
+                        target.write(source.read(page_size))
+                logger.info(f"Incremental backup {name}: {len(changed)} of {len(digests)} pages changed")
+
+            with open(self._manifest(path), 'wb') as fileobj:
+                fileobj.write(f"{page_size:08d}".encode())
+                fileobj.write(digests.tobytes())
+            return kind, path, parent_id
+        finally:
+            if os.path.exists(snapshot):
+                os.remove(snapshot)
+
+    def _dump_backup(self, url, name):
+        """Stream the dialect's dump tool output into the backup file."""
+        env = dict(os.environ)
+        dialect = url.get_backend_name()
+        if dialect == 'postgresql':
+            if url.password:
+                env['PGPASSWORD'] = url.password
+            dsn = url.set(drivername='postgresql', password=None).render_as_string(hide_password=False)
+            command = ['pg_dump', '--no-owner', '--dbname', dsn]
+        elif dialect in ('mysql', 'mariadb'):
+            if url.password:
+                env['MYSQL_PWD'] = url.password
+            command = ['mysqldump', '--single-transaction', '--quick', '--routines',
+                       '-h', url.host or 'localhost', '-P', str(url.port or 3306), '-u', url.username or '', url.database]
+        else:
+            raise RuntimeError(f"No backup strategy for {dialect} databases")
+
+        path = os.path.join(self.location, f"{name}.sql" + ('.gz' if BACKUP_CONFIGS['compress'] else ''))
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        except FileNotFoundError:
+            raise RuntimeError(f"{command[0]} was not found on PATH")
+        try:
+            with _open(path, 'wb') as target:
+                shutil.copyfileobj(process.stdout, target, COPY_CHUNK)
+            error = process.stderr.read().decode(errors='replace').strip()
+            if process.wait() != 0:
+                raise RuntimeError(f"{command[0]} exited with {process.returncode}: {error}")
+        except Exception:
+            process.kill()
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        return path
+
+    # --- restoring -------------------------------------------------------
+
+    def restore(self, backup_id, target_path):
+        """Rebuild the SQLite database as of a backup into target_path. Returns target_path."""
+        from database.models import BackupHistory
+
+        session = self._session()
+        try:
+            chain = []
+            node = session.get(BackupHistory, backup_id)
+            while node is not None:
+                if node.status != 'success' or not os.path.exists(node.backup_path):
+                    raise RuntimeError(f"Backup {node.backup_name} is not available")
+                chain.append((node.backup_type, node.backup_path))
+                node = session.get(BackupHistory, node.parent_id) if node.backup_type != 'full' else None
+            if not chain or chain[-1][0] != 'full':
+                raise RuntimeError(f"Backup {backup_id} has no full backup to start from")
+        finally:
+            session.close()
+
+        chain.reverse()
+        if chain[0][1].endswith(('.sql', '.sql.gz')):
+            raise RuntimeError("Database dumps are restored with the database's own client")
+        with _open(chain[0][1], 'rb') as source, open(target_path, 'wb') as target:
+            shutil.copyfileobj(source, target, COPY_CHUNK)
+        for _, path in chain[1:]:
+            with _open(path, 'rb') as source, open(target_path, 'r+b') as target:
+                magic, page_size, page_count, _ = source.readline().split(b' ', 3)
+                if magic != INCREMENTAL_MAGIC:
+                    raise RuntimeError(f"{path} is not an incremental backup")
+                page_size, page_count = int(page_size), int(page_count)
+                while True:
+                    number = source.read(PAGE_NUMBER.size)
+                    if not number:
+                        break
+                    target.seek(PAGE_NUMBER.unpack(number)[0] * page_size)
+                    target.write(source.read(page_size))
+                target.truncate(page_count * page_size)
+        logger.info(f"Restored backup {backup_id} into {target_path} from {len(chain)} files")
+        return target_path
+
+    # --- retention -------------------------------------------------------
+
+    def prune(self, retention_days=None):
+        """Delete backups (files and history) older than retention_days that no kept backup depends on."""
+        from database.models import BackupHistory
+
+        cutoff = datetime.utcnow() - timedelta(days=retention_days or BACKUP_CONFIGS['retention_days'])
+        session = self._session()
+        try:
+            rows = session.query(BackupHistory).order_by(BackupHistory.started_at).all()
+            by_id = {row.id: row for row in rows}
+            keep = set()
+            for row in rows:
+                if row.started_at >= cutoff or row.status == 'in_progress':
+                    node = row
+                    while node is not None and node.id not in keep:
+                        keep.add(node.id)
+                        node = by_id.get(node.parent_id)
+            removed = 0
+            for row in rows:
+                if row.id in keep:
+                    continue
+                if row.status == 'success':
+                    for path in (row.backup_path, self._manifest(row.backup_path)):
+                        if os.path.isfile(path):
+                            os.remove(path)
+                    removed += 1
+                session.delete(row)
+            session.commit()
+            if removed:
+                logger.info(f"Pruned {removed} backups older than {cutoff:%Y-%m-%d}")
+            return removed
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error pruning backups: {e}")
+            return 0
+        finally:
+            session.close()
+
+
+backup_service = BackupService()
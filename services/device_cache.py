@@ -0,0 +1,158 @@
+"""
+Local copy of what device syncs need from the database.
+
+A sync cycle needs the active devices, each one's clock zone and sync
+snapshot, the default organization and department for new users, and the
+employee numbers already known (punches from unknown users trigger a user
+download). DeviceCache.load() checks the data_versions counters of those
+tables and only re-reads what changed: the devices (and their snapshots)
+when 'devices' or 'calendar' moved, the employee numbers when 'employees'
+did. The devices, defaults and employee numbers, without the snapshots,
+are saved to device_cache_file whenever they change; when the database is
+unreachable load() answers from memory or that file, and only tries the
+database again after spool_retry_seconds, so devices keep being polled
+(into the punch spool) during an outage without every cycle waiting on
+connection timeouts.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+from config import DEVICE_CONFIGS
+
+logger = logging.getLogger(__name__)
+
+DEVICE_FIELDS = ('id', 'organization_id', 'device_name', 'serial_number', 'ip_address', 'port')
+
+# data_versions scopes of the cached tables (Organization, for the zones, is under 'calendar')
+VERSION_SCOPES = ('employees', 'devices', 'calendar')
+
+
+class DeviceCache:
+    """Devices, zones, snapshots and known employee numbers, from the database or the last saved copy."""
+
+    def __init__(self, path=None, retry_seconds=None, clock=time.monotonic):
+        self.path = path or DEVICE_CONFIGS['device_cache_file']
+        self.retry_seconds = retry_seconds or DEVICE_CONFIGS['spool_retry_seconds']
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._data = None
+        # What device_cache_file holds, as last saved or read
+        self._saved_copy = None
+        self._added = set()     # users downloaded since, possibly not stored yet
+        self._retry_at = 0.0
+        self.offline = False
+
+    def _read(self, session_factory, previous):
+        from database.models import DataVersion, Department, Device, Employee, Organization
+
+        if previous is not None and 'versions' not in previous:
+            # Read from device_cache_file: nothing to compare with
+            previous = None
+        session = session_factory()
+        try:
+            versions = dict(session.query(DataVersion.scope, DataVersion.version).filter(
+                DataVersion.scope.in_(VERSION_SCOPES)))
+            seen = previous.get('versions', {}) if previous is not None else {}
+            if previous is not None and seen == versions:
+                return previous
+            data = dict(previous or {}, versions=versions)
+            if previous is None or any(seen.get(scope) != versions.get(scope) for scope in ('devices', 'calendar')):
+                zones = dict(session.query(Organization.id, Organization.timezone))
+                devices = []
+                for device in session.query(Device).filter(Device.active == True).order_by(Device.id):
+                    entry = {field: getattr(device, field) for field in DEVICE_FIELDS}
+                    entry['zone'] = device.timezone or zones.get(device.organization_id)
+                    entry['snapshot'] = device.sync_snapshot
+                    devices.append(entry)
+                data['devices'] = devices
+                data['org_id'] = session.query(Organization.id).order_by(Organization.id).limit(1).scalar()
+            if previous is None or seen.get('employees') != versions.get('employees'):
+                data['dept_id'] = session.query(Department.id).order_by(Department.id).limit(1).scalar()
+                data['employee_numbers'] = [number for (number,) in session.query(Employee.employee_number)]
+                data['known'] = set(data['employee_numbers'])
+        finally:
+            session.close()
+        if data['org_id'] is None or data['dept_id'] is None:
+            # A fresh database: create the defaults through the writer, as a sync would
+            from database.writer import db_writer
+            from services.sync_service import sync_service
+            data['org_id'], data['dept_id'] = db_writer.call(
+                lambda session: tuple(row.id for row in sync_service.ensure_defaults(session)))
+        return data
+
+    def _persisted(self, data):
+        """What is saved to device_cache_file: everything but the per-device sync snapshots."""
+        return {'org_id': data['org_id'], 'dept_id': data['dept_id'],
+                'devices': [{key: value for key, value in entry.items() if key != 'snapshot'}
+                            for entry in data['devices']],
+                'employee_numbers': data['employee_numbers']}
+
+    def _save(self, data):
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            temp = self.path + '.tmp'
+            with open(temp, 'w') as fileobj:
+                json.dump(data, fileobj)
+            os.replace(temp, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save the device cache to {self.path}: {e}")
+
+    def _saved(self):
+        if self._data is None:
+            try:
+                with open(self.path) as fileobj:
+                    self._data = json.load(fileobj)
+            except (OSError, ValueError) as e:
+                raise RuntimeError(f"Database unreachable and no device cache at {self.path}: {e}")
+            self._data['known'] = set(self._data['employee_numbers'])
+            self._saved_copy = self._persisted(self._data)
+        return self._data
+
+    def load(self, session_factory=None, device_ids=None):
+        """
+        (devices, org_id, dept_id): active devices as objects with the Device
+        columns syncs use plus zone and snapshot (JSON text, None when read
+        from the file), database first.
+        """
+        with self._lock:
+            if self._clock() >= self._retry_at:
+                try:
+                    if session_factory is None:
+                        from database.connection import db_manager
+                        session_factory = db_manager.get_read_session()
+                    data = self._read(session_factory, self._data)
+                    if data is not self._data:
+                        persisted = self._persisted(data)
+                        if persisted != self._saved_copy:
+                            self._save(persisted)
+                            self._saved_copy = persisted
+                        self._data = data
+                    if self.offline:
+                        logger.info("Database reachable again, device cache refreshed")
+                    self.offline = False
+                except Exception as e:
+                    self._retry_at = self._clock() + self.retry_seconds
+                    self.offline = True
+                    logger.warning(f"Database unreachable, syncing devices from {self.path}: {e}")
+            data = self._saved()
+            devices = [SimpleNamespace(**dict({'snapshot': None}, **entry)) for entry in data['devices']
+                       if device_ids is None or entry['id'] in device_ids]
+            return devices, data['org_id'], data['dept_id']
+
+    def known_users(self, user_ids):
+        """The device user ids among user_ids that are known employee numbers."""
+        with self._lock:
+            known = self._data['known'] if self._data is not None else set()
+            return {user_id for user_id in user_ids if user_id in known or user_id in self._added}
+
+    def add_users(self, user_ids):
+        """Count user ids as known before their download is stored (it sits in the spool)."""
+        with self._lock:
+            self._added.update(user_ids)
+
+
+device_cache = DeviceCache()
@@ -0,0 +1,385 @@
+import hashlib
+import logging
+
+from config import DEVICE_CONFIGS
+from database.connection import db_manager
+from devices.connection_manager import DeviceConnectionManager
+
+logger = logging.getLogger(__name__)
+
+# K20 firmware stores user names in a 24 byte field
+MAX_DEVICE_NAME = 24
+
+
+def device_name_for(employee):
+    """Name written to the terminal for an employee (mirrors how device users are imported)."""
+    if employee.last_name and employee.last_name != employee.employee_number:
+        name = f"{employee.first_name} {employee.last_name}"
+    else:
+        name = employee.first_name or ''
+    return name[:MAX_DEVICE_NAME]
+
+
+def user_fingerprint(user_id, name):
+    """Short digest of the fields we manage on the device for one user."""
+    return hashlib.sha1(f"{user_id}\x1f{name}".encode('utf-8')).hexdigest()[:16]
+
+
+def diff_users(device_users, desired, removed):
+    """
+    Compare the device user table with the desired state.
+
+    device_users: users returned by the adapter (objects with uid, user_id, name, ...)
+    desired: {user_id: name} that should be present
+    removed: set of user_ids that must not be present
+    Returns (upserts, deletes, unchanged) where upserts/deletes are adapter kwargs dicts.
+    """
+    on_device = {}
+    used_uids = set()
+    for u in device_users:
+        on_device[str(u.user_id)] = u
+        used_uids.add(u.uid)
+
+    next_uid = 1
+    upserts = []
+    unchanged = 0
+    for user_id, name in desired.items():
+        current = on_device.get(user_id)
+        if current is None:
+            while next_uid in used_uids:
+                next_uid += 1
+            used_uids.add(next_uid)
+            upserts.append({'uid': next_uid, 'name': name, 'user_id': user_id})
+        elif user_fingerprint(user_id, current.name or '') != user_fingerprint(user_id, name):
+            # Keep what HR doesn't manage (privilege, password, card) as enrolled on the device
+            upserts.append({
+                'uid': current.uid,
+                'name': name,
+                'privilege': current.privilege,
+                'password': current.password,
+                'group_id': current.group_id,
+                'user_id': user_id,
+                'card': current.card,
+            })
+        else:
+            unchanged += 1
+
+    deletes = [{'uid': on_device[user_id].uid, 'user_id': user_id}
+               for user_id in removed if user_id in on_device]
+    return upserts, deletes, unchanged
+
+
+class DeviceService:
+    """Device operations from the internal API that work on registered `Device` rows."""
+
+    def __init__(self, connection_manager=None):
+        self.connections = connection_manager or DeviceConnectionManager()
+        self.batch_size = DEVICE_CONFIGS.get('user_push_batch_size', 200)
+
+    def _load_devices(self, session, device_ids=None):
+        from database.models import Device
+
+        query = session.query(Device).filter(Device.active == True)
+        if device_ids is not None:
+            query = query.filter(Device.id.in_(device_ids))
+        return query.all()
+
+    def _desired_users(self, session, organization_ids, employee_ids=None):
+        """Return {organization_id: (desired, removed)} from the Employee table."""
+        from database.models import Employee
+
+        query = session.query(
+            Employee.organization_id, Employee.employee_number, Employee.first_name,
+            Employee.last_name, Employee.status
+        ).filter(Employee.organization_id.in_(organization_ids))
+        if employee_ids is not None:
+            query = query.filter(Employee.id.in_(employee_ids))
+
+        result = {org_id: ({}, set()) for org_id in organization_ids}
+        for row in query:
+            desired, removed = result[row.organization_id]
+            if row.status == 'active':
+                desired[row.employee_number] = device_name_for(row)
+            else:
+                removed.add(row.employee_number)
+        return result
+
+    def _log_results(self, operation, started_at, results, counts, session=None):
+        """Record one device_sync_logs row per device result, as a database writer job."""
+        from database.writer import db_writer
+        from services.sync_service import sync_service
+
+        def log_results(session):
+            from database.models import Device
+
+            known = {device_id for (device_id,) in session.query(Device.id).filter(Device.id.in_(list(results)))}
+            for device_id, result in results.items():
+                if device_id not in known:
+                    continue
+                records, new_records = counts(result)
+                message = '; '.join(result.get('errors') or []) or None
+                if operation == 'clock' and result.get('offset') is not None:
+                    message = f"offset {result['offset']}s" + (", reset" if result.get('reset') else "") + \
+                        (", reset pending" if result.get('pending') else "")
+                sync_service.log_sync(session, device_id, operation, started_at,
+                                      'success' if result.get('success') else 'failed', records, new_records, message)
+
+        if session is not None:
+            # Part of the caller's writer job
+            return log_results(session)
+        try:
+            db_writer.call(log_results)
+        except Exception as e:
+            logger.error(f"Error logging {operation} results: {e}")
+
+    def _push(self, adapter, device, desired, removed):
+        device_users = adapter.get_users()
+        if not device_users and adapter.get_counters().get('users'):
+            # A failed download would make every employee look new and overwrite slots
+            return {'success': False, 'synced_count': 0, 'failed_count': 0,
+                    'errors': [f"Could not read the user table of device {device.id}"]}
+        upserts, deletes, unchanged = diff_users(device_users, desired, removed)
+
+        written = 0
+        for start in range(0, len(upserts), self.batch_size):
+            written += adapter.set_users(upserts[start:start + self.batch_size])
+        deleted = adapter.delete_users(deletes) if deletes else 0
+
+        failed = (len(upserts) - written) + (len(deletes) - deleted)
+        errors = [f"{failed} user changes were rejected by device {device.id}"] if failed else []
+        return {
+            'success': failed == 0,
+            'synced_count': written,
+            'deleted_count': deleted,
+            'unchanged_count': unchanged,
+            'failed_count': failed,
+            'errors': errors,
+        }
+
+    def sync_employees_to_device(self, device_id, employee_ids=None):
+        """Push employee changes to one device. See sync_employees_to_devices."""
+        return self.sync_employees_to_devices([device_id], employee_ids)[device_id]
+
+    def sync_employees_to_devices(self, device_ids=None, employee_ids=None):
+        """
+        Delta-push employees to many devices in parallel.
+
+        Each device's user table is downloaded once, diffed against the active
+        employees of its organization, and only new or renamed users are written,
+        in batches that each hold the device disabled once. Users of inactive
+        employees are removed. Returns {device_id: result dict}.
+        """
+        from datetime import datetime
+
+        started_at = datetime.utcnow()
+        session = db_manager.get_read_session()()
+        try:
+            devices = self._load_devices(session, device_ids)
+            wanted = self._desired_users(session, {d.organization_id for d in devices}, employee_ids)
+            session.expunge_all()
+        finally:
+            session.close()
+
+        results = {device_id: {'success': False, 'synced_count': 0, 'failed_count': 0,
+                               'errors': [f"Device {device_id} not found"]}
+                   for device_id in (device_ids or [])}
+        if not devices:
+            return results
+
+        def task(adapter, device):
+            desired, removed = wanted[device.organization_id]
+            return self._push(adapter, device, desired, removed)
+
+        for device_id, (ok, result) in self.connections.poll(devices, task).items():
+            if not ok:
+                result = {'success': False, 'synced_count': 0, 'failed_count': 0,
+                          'errors': (result or {}).get('errors') or [f"Device {device_id} is unreachable"]}
+            results[device_id] = result
+            logger.info(f"User sync to device {device_id}: {result}")
+
+        self._log_results('users', started_at, results, lambda r: (r.get('synced_count', 0), 0))
+        self.connections.monitor.submit_flush()
+        return results
+
+    def _sync_attendance(self, adapter, device, org_id, dept_id, rotate):
+        from datetime import datetime
+        from services.device_cache import device_cache
+        from services.sync_service import sync_service
+
+        started_at = datetime.utcnow()
+        try:
+            args = sync_service.download(adapter, device.id, org_id, dept_id, device.zone,
+                                         sync_service.current_snapshot(device.id, device.snapshot),
+                                         device_cache.known_users, started_at)
+            future, spooled = sync_service.store(args)
+        except Exception as e:
+            sync_service.log_failure(device.id, started_at, e, wait=False)
+            raise
+        result = {'success': True, 'records': len(args[6]), 'new_records': 0, 'users_synced': False,
+                  'new_users': 0, 'store': future, 'spooled': spooled}
+        if rotate:
+            # Only punches the database holds may be cleared from the device
+            try:
+                future.result()
+            except Exception as e:
+                result['rotation'] = {'rotated': False, 'error': f"Not rotated, punches not stored: {e}"}
+            else:
+                result['rotation'] = sync_service.rotate_log(db_manager.get_read_session(), adapter, args)
+        return result
+
+    def _wait_stored(self, results, started_at):
+        """Fold the outcome of the writer jobs queued by a sync cycle into its results, waiting up to spool_store_wait."""
+        import concurrent.futures
+        import time
+        from services.sync_service import sync_service
+
+        deadline = time.monotonic() + DEVICE_CONFIGS['spool_store_wait']
+        for device_id, result in results.items():
+            future = result.pop('store', None)
+            if future is None:
+                continue
+            spooled = result.pop('spooled')
+            try:
+                result.update(future.result(timeout=max(0.0, deadline - time.monotonic())))
+            except concurrent.futures.TimeoutError:
+                # Still queued; the writer stores it (or the spool replayer does)
+                result['pending'] = True
+            except Exception as e:
+                if spooled:
+                    result['spooled'] = True
+                else:
+                    result['success'] = False
+                    result['errors'] = [f"Storing the sync of device {device_id} failed: {e}"]
+                    sync_service.log_failure(device_id, started_at, e, wait=False)
+
+    def sync_attendance(self, device_ids=None, rotate=False):
+        """
+        Pull new punches from every active device in parallel (see
+        SyncService.download/store). The devices come from services/device_cache.py
+        and every download is spooled before its writer job is queued, so
+        devices are polled and acknowledged whether or not the database keeps
+        up; the cycle waits up to spool_store_wait seconds for the stores
+        (results marked 'pending' or 'spooled' otherwise). With rotate, device
+        logs holding enough archived punches are cleared afterwards.
+        Returns {device_id: result dict}.
+        """
+        from datetime import datetime
+        from services.device_cache import device_cache
+        from services.punch_spool import punch_spool
+        from services.sync_service import sync_service
+
+        started_at = datetime.utcnow()
+        if punch_spool.pending_count():
+            # Punches spooled while the database was unreachable (or by an earlier run)
+            sync_service.wake_replayer()
+        devices, org_id, dept_id = device_cache.load(None, device_ids)
+
+        results = {device_id: {'success': False, 'records': 0, 'new_records': 0,
+                               'errors': [f"Device {device_id} not found"]}
+                   for device_id in (device_ids or [])}
+        if not devices:
+            return results
+
+        connected = set()
+
+        def task(adapter, device):
+            connected.add(device.id)
+            return self._sync_attendance(adapter, device, org_id, dept_id, rotate)
+
+        failed_connects = []
+        for device_id, (ok, result) in self.connections.poll(devices, task).items():
+            if not ok:
+                if device_id not in connected and not (result or {}).get('skipped'):
+                    failed_connects.append(device_id)
+                result = {'success': False, 'records': 0, 'new_records': 0,
+                          'errors': (result or {}).get('errors') or [
+                              f"Device {device_id} is unreachable" if device_id not in connected
+                              else f"Sync of device {device_id} failed"]}
+            results[device_id] = result
+        self._wait_stored(results, started_at)
+
+        # Failed syncs were logged by sync_service; devices skipped while backing off are not logged
+        for device_id in failed_connects:
+            sync_service.log_failure(device_id, started_at, '; '.join(results[device_id]['errors']), wait=False)
+        self.connections.monitor.submit_flush()
+        return results
+
+    def _sync_clock(self, adapter, device, zone, set_time):
+        from core.clock import host_now, measure_offset
+        from services.sync_service import sync_service
+
+        offset = measure_offset(adapter, zone)
+        result = {'success': offset is not None, 'offset': offset, 'reset': False, 'pending': False}
+        if offset is None:
+            result['errors'] = [f"Could not read the clock of device {device.id}"]
+            return result
+        if not set_time or abs(offset) <= DEVICE_CONFIGS.get('clock_sync_threshold', 0):
+            return result
+
+        # Punches still on the device were stamped with the old clock; resetting it
+        # now would make the stored offset wrong for them, so wait for the next sync
+        counters = adapter.get_counters()
+        snapshot = sync_service.load_snapshot(device)
+        if not counters or counters.get('records') != snapshot.get('records'):
+            result['pending'] = True
+            return result
+
+        if adapter.set_time(host_now(zone)):
+            result['reset'] = True
+            measured = measure_offset(adapter, zone)
+            if measured is not None:
+                result['offset'] = measured
+        return result
+
+    def sync_clocks(self, device_ids=None, set_time=True):
+        """
+        Measure every device's clock offset in parallel and store it on the
+        Device rows. With set_time, terminals drifting more than
+        clock_sync_threshold seconds are reset to the host time, unless they
+        hold punches that have not been ingested yet (reported as pending).
+        Returns {device_id: result dict}.
+        """
+        from datetime import datetime
+        from database.models import Device
+        from database.writer import db_writer
+        from services.sync_service import sync_service
+
+        started_at = datetime.utcnow()
+        session = db_manager.get_read_session()()
+        try:
+            devices = self._load_devices(session, device_ids)
+            zones = {d.id: sync_service.device_zone(session, d) for d in devices}
+            session.expunge_all()
+        finally:
+            session.close()
+
+        results = {device_id: {'success': False, 'offset': None, 'errors': [f"Device {device_id} not found"]}
+                   for device_id in (device_ids or [])}
+        if not devices:
+            return results
+
+        def task(adapter, device):
+            return self._sync_clock(adapter, device, zones[device.id], set_time)
+
+        for device_id, (ok, result) in self.connections.poll(devices, task).items():
+            if not ok:
+                result = {'success': False, 'offset': None,
+                          'errors': (result or {}).get('errors') or [f"Device {device_id} is unreachable"]}
+            results[device_id] = result
+            logger.info(f"Clock check of device {device_id}: {result}")
+
+        def store_clocks(session):
+            now = datetime.utcnow()
+            for device_id, result in results.items():
+                device = session.get(Device, device_id)
+                if device is not None and result.get('offset') is not None:
+                    device.clock_offset_seconds = result['offset']
+                    device.clock_checked_at = now
+            self._log_results('clock', started_at, results, lambda r: (0, 0), session)
+
+        try:
+            db_writer.call(store_clocks)
+        except Exception as e:
+            logger.error(f"Error storing clock offsets: {e}")
+        self.connections.monitor.submit_flush()
+        return results
@@ -0,0 +1,262 @@
+"""
+Durable local spool of downloaded punches.
+
+A device sync appends what it downloaded (the arguments of the
+SyncService._store_sync writer job) to the spool right after the
+download, queues the writer job without waiting for it, and the entry is
+acknowledged once the database committed it. When the database is
+unreachable or slow the entry stays pending on disk and the spool
+replayer thread (SyncService.replay_spool()) stores it later, so punches
+pulled from a device are neither lost nor downloaded again.
+
+The spool is a directory of numbered append-only segment files. Each
+record is a fixed header followed by a zlib compressed JSON payload:
+
+    magic 'PSPL' | kind u8 | pad | entry id u64 | stored_len u32 | crc32 u32
+
+An ack record has no payload and carries the id of the entry it
+acknowledges. Appends return once the entry is fsynced; appends from
+concurrent syncs share one fsync. Acks are not fsynced: a lost ack only
+replays an entry again, which ingest_records deduplicates. A segment is
+deleted once it and every older segment hold no pending entry. A torn
+record at the end of a segment (crash while appending) is ignored.
+"""
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+from datetime import datetime
+
+from config import DEVICE_CONFIGS
+from devices.protocols.zk_records import DeviceUser, Punch
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PSPL'
+HEADER = struct.Struct('<4sB3xQII')
+
+KIND_ENTRY = 1
+KIND_ACK = 2
+
+SEGMENT_SUFFIX = '.spool'
+
+
+def encode_entry(device_id, org_id, dept_id, offset, counters, snapshot, records, users, started_at):
+    """JSON-ready dict of a _store_sync call."""
+    return {
+        'device_id': device_id,
+        'org_id': org_id,
+        'dept_id': dept_id,
+        'offset': offset,
+        'counters': counters,
+        'snapshot': snapshot,
+        'records': [[getattr(rec, 'user_id', ''), rec.timestamp.isoformat() if getattr(rec, 'timestamp', None) else None,
+                     getattr(rec, 'status', 0), getattr(rec, 'punch', 0), getattr(rec, 'uid', None)]
+                    for rec in records],
+        'users': None if users is None else [[getattr(u, field, None) for field in DeviceUser._fields] for u in users],
+        'started_at': started_at.isoformat(),
+    }
+
+
+def decode_entry(entry):
+    """_store_sync arguments (after the session) of an encoded entry."""
+    records = [Punch(user_id, datetime.fromisoformat(timestamp) if timestamp else None, status, punch, uid)
+               for user_id, timestamp, status, punch, uid in entry['records']]
+    users = None if entry['users'] is None else [DeviceUser(*fields) for fields in entry['users']]
+    return (entry['device_id'], entry['org_id'], entry['dept_id'], entry['offset'], entry['counters'],
+            entry['snapshot'], records, users, datetime.fromisoformat(entry['started_at']))
+
+
+def read_records(path):
+    """Yield (kind, entry_id, payload bytes) of a segment, stopping at a torn record."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    pos = 0
+    while pos + HEADER.size <= len(data):
+        magic, kind, entry_id, stored_len, crc = HEADER.unpack_from(data, pos)
+        payload = data[pos + HEADER.size:pos + HEADER.size + stored_len]
+        if magic != MAGIC or len(payload) != stored_len or zlib.crc32(payload) != crc:
+            logger.warning(f"Ignoring torn spool record at {path}:{pos}")
+            return
+        yield kind, entry_id, payload
+        pos += HEADER.size + stored_len
+
+
+class PunchSpool:
+    """Append-only on-disk journal of downloaded punches awaiting the database."""
+
+    def __init__(self, location=None, segment_bytes=None):
+        self.location = location or DEVICE_CONFIGS['spool_location']
+        self.segment_bytes = segment_bytes or DEVICE_CONFIGS['spool_segment_bytes']
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._loaded = False
+        self._pending = {}          # entry id -> segment number
+        self._next_id = 1
+        self._segment = None        # number of the segment being appended to
+        self._file = None
+        self._written = 0           # appends written to the OS
+        self._synced = 0            # appends known to be on disk
+
+    def _segment_path(self, number):
+        return os.path.join(self.location, f"{number:08d}{SEGMENT_SUFFIX}")
+
+    def _segments(self):
+        try:
+            names = os.listdir(self.location)
+        except FileNotFoundError:
+            return []
+        return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in names
+                      if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+
+    def _load(self):
+        """Rebuild the pending entries from the segments on disk (once, under _lock)."""
+        if self._loaded:
+            return
+        segments = self._segments()
+        for number in segments:
+            for kind, entry_id, _ in read_records(self._segment_path(number)):
+                if kind == KIND_ENTRY:
+                    self._pending[entry_id] = number
+                else:
+                    self._pending.pop(entry_id, None)
+                self._next_id = max(self._next_id, entry_id + 1)
+        # Never append after a possibly torn tail: new records go to a new segment
+        self._segment = (segments[-1] if segments else 0) + 1
+        self._loaded = True
+        if self._pending:
+            logger.info(f"Punch spool holds {len(self._pending)} pending entries")
+        self._compact()
+
+    def _open_segment(self):
+        os.makedirs(self.location, exist_ok=True)
+        self._file = open(self._segment_path(self._segment), 'ab')
+        try:
+            # Make the new file's directory entry durable too (not possible on Windows)
+            fd = os.open(self.location, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+
+    def _rotate(self):
+        """Close the full segment (durably) and start the next one. Called under _lock."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        self._synced = self._written
+        self._segment += 1
+        self._compact()
+
+    def _compact(self):
+        """Delete the oldest segments as long as they hold no pending entry. Called under _lock."""
+        busy = set(self._pending.values())
+        for number in self._segments():
+            if number >= self._segment or number in busy:
+                break
+            try:
+                os.remove(self._segment_path(number))
+            except OSError as e:
+                logger.warning(f"Could not remove spool segment {number}: {e}")
+                break
+
+    def _write(self, kind, entry_id, payload=b''):
+        """Write one record (under _lock). Returns its append ticket."""
+        if self._file is None:
+            self._open_segment()
+        self._file.write(HEADER.pack(MAGIC, kind, entry_id, len(payload), zlib.crc32(payload)) + payload)
+        self._file.flush()
+        self._written += 1
+        ticket = self._written
+        if self._file.tell() >= self.segment_bytes:
+            self._rotate()
+        return ticket
+
+    def append(self, *args):
+        """
+        Spool the arguments of a _store_sync call (see encode_entry) and wait
+        until they are on disk. Returns the entry id, or None when the spool
+        could not be written (the sync then goes on unspooled).
+        """
+        payload = zlib.compress(json.dumps(encode_entry(*args), separators=(',', ':')).encode('utf-8'), 1)
+        try:
+            with self._lock:
+                self._load()
+                entry_id = self._next_id
+                self._next_id += 1
+                # Pending before the write: a rotation it triggers must not compact its segment away
+                self._pending[entry_id] = self._segment
+                try:
+                    ticket = self._write(KIND_ENTRY, entry_id, payload)
+                except Exception:
+                    self._pending.pop(entry_id, None)
+                    raise
+            # Group fsync: whoever gets here first syncs every append written so far
+            with self._sync_lock:
+                if self._synced < ticket:
+                    with self._lock:
+                        target = self._written
+                        # A duplicate descriptor stays valid if a rotation closes the file meanwhile
+                        fd = os.dup(self._file.fileno()) if self._file is not None else None
+                    if fd is not None:
+                        try:
+                            os.fsync(fd)
+                        finally:
+                            os.close(fd)
+                    self._synced = max(self._synced, target)
+            return entry_id
+        except (OSError, ValueError) as e:
+            logger.error(f"Error spooling punches: {e}")
+            return None
+
+    def ack(self, entry_ids):
+        """Mark entries as stored in the database."""
+        if isinstance(entry_ids, int):
+            entry_ids = [entry_ids]
+        try:
+            with self._lock:
+                self._load()
+                for entry_id in entry_ids:
+                    if self._pending.pop(entry_id, None) is not None:
+                        self._write(KIND_ACK, entry_id)
+                self._compact()
+        except (OSError, ValueError) as e:
+            logger.error(f"Error acknowledging spooled punches: {e}")
+
+    def pending_count(self):
+        with self._lock:
+            self._load()
+            return len(self._pending)
+
+    def pending(self):
+        """Yield (entry_id, _store_sync arguments) of the pending entries, oldest first."""
+        with self._lock:
+            self._load()
+            wanted = dict(self._pending)
+        for number in sorted(set(wanted.values())):
+            try:
+                with self._lock:
+                    records = list(read_records(self._segment_path(number)))
+            except OSError as e:
+                logger.error(f"Error reading spool segment {number}: {e}")
+                continue
+            for kind, entry_id, payload in records:
+                if kind == KIND_ENTRY and wanted.get(entry_id) == number:
+                    yield entry_id, decode_entry(json.loads(zlib.decompress(payload)))
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+                self._synced = self._written
+
+
+punch_spool = PunchSpool()
@@ -0,0 +1,260 @@
+"""
+Headless device sync daemon.
+
+Polls the active devices every scan_interval seconds through the same
+DeviceService/SyncService path the scheduler uses, without importing Qt,
+so ingestion can run on a small server separately from the desktop app.
+SIGINT/SIGTERM let the current cycle finish and exit (a second signal
+kills); SIGUSR1 logs the runtime stats, which are also written to
+daemon_stats_file after every cycle.
+
+While it runs, the desktop scheduler leaves the devices alone, so the
+daemon also does the daily device maintenance (log rotation, clock
+correction and raw dump pruning) at the device_maintenance job's time.
+
+The daemon also starts, and keeps polling, while the database is
+unreachable: devices come from the device cache (services/device_cache.py),
+downloads wait in the punch spool, and it reconnects every cycle.
+
+Usage: python -m services.sync_daemon [--interval SECONDS] [--device ID ...] [--once] [--recompute]
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from datetime import datetime, timedelta
+
+from config import DATABASE_CONFIGS, DEVICE_CONFIGS, SCHEDULER_CONFIGS
+
+logger = logging.getLogger(__name__)
+
+
+def daemon_running(path=None):
+    """True when a sync daemon has written its stats recently and has not stopped."""
+    path = path or DEVICE_CONFIGS['daemon_stats_file']
+    # A cycle can spend a connection timeout on each of a connect and a download
+    max_age = 3 * DEVICE_CONFIGS['scan_interval'] + 2 * DEVICE_CONFIGS['connection_timeout']
+    try:
+        if time.time() - os.path.getmtime(path) > max_age:
+            return False
+        with open(path) as fileobj:
+            return not json.load(fileobj).get('stopped_at')
+    except (OSError, ValueError):
+        return False
+
+
+class SyncDaemon:
+    """Runs DeviceService.sync_attendance in a loop and keeps runtime stats."""
+
+    def __init__(self, interval=None, device_ids=None, service=None, stats_file=None, database_url=None):
+        from services.device_service import DeviceService
+
+        self.database_url = database_url or DATABASE_CONFIGS['sqlite']
+        self.interval = interval or DEVICE_CONFIGS['scan_interval']
+        self.device_ids = device_ids
+        self.service = service or DeviceService()
+        self.stats_file = stats_file or DEVICE_CONFIGS['daemon_stats_file']
+        job = SCHEDULER_CONFIGS['jobs']['device_maintenance']
+        self.maintenance_at = datetime.strptime(job['at'], '%H:%M').time()
+        self.maintenance_grace = SCHEDULER_CONFIGS['classes'][job['class']]['misfire_grace']
+        self._maintained_on = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._stats = {
+            'pid': os.getpid(),
+            'started_at': None,
+            'stopped_at': None,
+            'cycles': 0,
+            'failed_cycles': 0,
+            'last_cycle_at': None,
+            'last_cycle_seconds': 0.0,
+            'records': 0,
+            'new_records': 0,
+            'failed_syncs': 0,
+            'last_maintenance_at': None,
+            'devices': {},
+        }
+
+    def stop(self):
+        self._stop_event.set()
+
+    def connect(self):
+        """Connect to the database unless already connected. Returns whether it is."""
+        from database.connection import db_manager
+
+        if db_manager.engine is not None:
+            return True
+        if not db_manager.connect(self.database_url):
+            return False
+        db_manager.init_database()
+        from reports import cache  # versions the data cached reports were built from
+        logger.info("Database reachable, storing spooled punches")
+        return True
+
+    def maintenance_due(self, now=None):
+        """True once a day, from maintenance_at until its misfire grace runs out."""
+        now = now or datetime.now()
+        scheduled = datetime.combine(now.date(), self.maintenance_at)
+        return self._maintained_on != now.date() and \
+            scheduled <= now < scheduled + timedelta(seconds=self.maintenance_grace)
+
+    def run_cycle(self, maintenance=False):
+        """
+        Sync every device once and fold the results into the stats. With
+        maintenance, device logs are rotated and clocks corrected as well.
+        Returns the sync_attendance results.
+        """
+        started = time.monotonic()
+        results = self.service.sync_attendance(self.device_ids, rotate=maintenance)
+        if maintenance:
+            from devices.dump_archive import prune_dumps
+
+            clocks = self.service.sync_clocks(self.device_ids)
+            rotated = sum(1 for result in results.values() if result.get('rotation', {}).get('rotated'))
+            reset = sum(1 for result in clocks.values() if result.get('reset'))
+            pruned = prune_dumps()
+            logger.info(f"Device maintenance: {rotated} logs rotated, {reset} clocks reset, "
+                        f"{pruned} raw dump segments pruned")
+        now = datetime.utcnow().isoformat(timespec='seconds')
+        if maintenance:
+            self._stats['last_maintenance_at'] = now
+        with self._lock:
+            stats = self._stats
+            stats['cycles'] += 1
+            stats['last_cycle_at'] = now
+            stats['last_cycle_seconds'] = round(time.monotonic() - started, 3)
+            for device_id, result in results.items():
+                device = stats['devices'].setdefault(str(device_id), {
+                    'last_success_at': None, 'consecutive_failures': 0, 'new_records': 0, 'last_error': None})
+                if result['success']:
+                    stats['records'] += result.get('records', 0)
+                    stats['new_records'] += result.get('new_records', 0)
+                    device['last_success_at'] = now
+                    device['consecutive_failures'] = 0
+                    device['new_records'] += result.get('new_records', 0)
+                else:
+                    stats['failed_syncs'] += 1
+                    device['consecutive_failures'] += 1
+                    device['last_error'] = '; '.join(result.get('errors') or []) or None
+        new_records = sum(result.get('new_records', 0) for result in results.values())
+        if new_records:
+            logger.info(f"Cycle {self._stats['cycles']}: {new_records} new punches from {len(results)} devices")
+        return results
+
+    def stats(self):
+        """Copy of the runtime stats with uptime, peak memory and device connection health."""
+        with self._lock:
+            snapshot = json.loads(json.dumps(self._stats))
+        snapshot['uptime_seconds'] = round(time.monotonic() - self._started)
+        try:
+            import resource
+            # ru_maxrss is kilobytes on Linux
+            snapshot['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        except ImportError:
+            snapshot['max_rss_kb'] = None
+        snapshot['health'] = self.service.connections.monitor.snapshot()
+        return snapshot
+
+    def write_stats(self):
+        try:
+            os.makedirs(os.path.dirname(self.stats_file) or '.', exist_ok=True)
+            temp = self.stats_file + '.tmp'
+            with open(temp, 'w') as fileobj:
+                json.dump(self.stats(), fileobj, indent=2, default=str)
+            os.replace(temp, self.stats_file)
+        except OSError as e:
+            logger.warning(f"Could not write daemon stats to {self.stats_file}: {e}")
+
+    def run(self, once=False):
+        """Poll until stop() is called (or a single cycle with once)."""
+        self._stats['started_at'] = datetime.utcnow().isoformat(timespec='seconds')
+        logger.info(f"Sync daemon started (pid {os.getpid()}, every {self.interval}s)")
+        try:
+            while not self._stop_event.is_set():
+                started = time.monotonic()
+                try:
+                    self.connect()
+                    if self.maintenance_due():
+                        self._maintained_on = datetime.now().date()
+                        self.run_cycle(maintenance=True)
+                    else:
+                        self.run_cycle()
+                except Exception as e:
+                    # Typically the database being unreachable; keep polling
+                    with self._lock:
+                        self._stats['failed_cycles'] += 1
+                    logger.error(f"Sync cycle failed: {e}")
+                self.write_stats()
+                if once:
+                    break
+                self._stop_event.wait(max(0.0, self.interval - (time.monotonic() - started)))
+        finally:
+            self._stats['stopped_at'] = datetime.utcnow().isoformat(timespec='seconds')
+            self.write_stats()
+            logger.info(f"Sync daemon stopped after {self._stats['cycles']} cycles, "
+                        f"{self._stats['new_records']} new punches")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Poll attendance devices without the desktop application.")
+    parser.add_argument('--interval', type=float, default=DEVICE_CONFIGS['scan_interval'],
+                        help="Seconds between polls (default: scan_interval)")
+    parser.add_argument('--device', type=int, action='append', help="Device id to poll; repeatable (default: all active)")
+    parser.add_argument('--once', action='store_true', help="Poll once and exit")
+    parser.add_argument('--recompute', action='store_true',
+                        help="Also refresh daily attendance in the background (when no desktop app does)")
+    parser.add_argument('--log-file', help="Log to this file instead of stderr")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, filename=args.log_file,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    from database import models  # registers the tables init_database() creates
+
+    daemon = SyncDaemon(args.interval, args.device)
+    if not daemon.connect():
+        # Devices are still polled, into the punch spool; run() keeps reconnecting
+        logger.error("Could not connect to the database, syncing from the device cache")
+
+    def shutdown(signum, frame):
+        logger.info(f"Received signal {signum}, stopping after the current cycle")
+        daemon.stop()
+        # A second signal terminates immediately
+        signal.signal(signum, signal.SIG_DFL)
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    def log_stats():
+        logger.info(f"Stats: {json.dumps(daemon.stats(), default=str)}")
+
+    if hasattr(signal, 'SIGUSR1'):
+        # Logged from a thread: the handler may interrupt code holding the stats or monitor locks
+        signal.signal(signal.SIGUSR1, lambda signum, frame: threading.Thread(target=log_stats, daemon=True).start())
+
+    if args.recompute:
+        from core.daily_attendance import RecomputeWorker
+        # The desktop app's edits reach this process only through data_versions
+        worker = RecomputeWorker(watch_versions=True)
+        worker.start()
+    try:
+        daemon.run(once=args.once)
+    finally:
+        if args.recompute:
+            worker.stop()
+            worker.join()
+        from database.writer import db_writer
+        from services.punch_spool import punch_spool
+        from services.sync_service import sync_service
+        sync_service.stop_replayer()
+        # Commit the stores still queued; what does not make it stays spooled
+        db_writer.stop()
+        punch_spool.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
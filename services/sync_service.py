@@ -0,0 +1,740 @@
+import json
+import logging
+import threading
+import zlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, insert, or_
+
+from config import DEVICE_CONFIGS
+from core.clock import measure_offset, normalize_times
+from core.daily_attendance import mark_dirty, punch_keys
+from core.punch_classifier import punch_classifier
+from database.archive import punch_source
+from database.writer import db_writer
+from database.models import AttendanceRecord, Employee, Organization, Department, Device, DeviceSyncLog
+from services.punch_spool import punch_spool
+
+logger = logging.getLogger(__name__)
+
+# Keep IN (...) lists under SQLite's bound parameter limit
+CHUNK_SIZE = 500
+
+# Counters that change when users are enrolled, edited or removed
+USER_COUNTERS = ('users', 'fingers', 'faces', 'cards')
+
+
+def chunked(items, size=CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def punch_checksum(keys):
+    """Order independent checksum of (employee_id, punch_time) keys."""
+    value = 0
+    for emp_id, punch_time in keys:
+        value ^= zlib.crc32(f"{emp_id}|{punch_time.isoformat()}".encode('utf-8'))
+    return value
+
+
+# ZK punch states: 0 Check-In, 1 Check-Out, 2 Break-Out, 3 Break-In, 4 OT-In, 5 OT-Out
+PUNCH_TYPES = {0: 'in', 1: 'out', 2: 'break_start', 3: 'break_end', 4: 'in', 5: 'out'}
+
+
+def punch_type_for(p_val):
+    return PUNCH_TYPES.get(p_val, 'out')
+
+
+class SyncService:
+    """Pulls users and punches from a connected device adapter into the database."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = set()      # spool entries whose writer job is queued or running
+        self._spooled = None        # device_id -> (entry_id, snapshot) of downloads not stored yet
+        self._replayer = None
+
+    def ensure_defaults(self, session):
+        """Ensure we have an organization and department (stub)."""
+        org = session.query(Organization).first()
+        if not org:
+            org = Organization(name="Default Org", code="DEFAULT")
+            session.add(org)
+            session.flush()
+
+        dept = session.query(Department).first()
+        if not dept:
+            dept = Department(organization_id=org.id, name="General", code="GEN")
+            session.add(dept)
+            session.flush()
+        return org, dept
+
+    def get_or_register_device(self, session, org, adapter):
+        """Find the Device row for a connected adapter, registering it on first contact."""
+        device = session.query(Device).filter_by(ip_address=adapter.ip_address, port=adapter.port).first()
+        if device:
+            return device
+
+        info = adapter.get_device_info()
+        serial = info.get('serial') or adapter.ip_address
+        device = session.query(Device).filter_by(serial_number=serial).first()
+        if device:
+            # Same terminal, new address
+            device.ip_address = adapter.ip_address
+            device.port = adapter.port
+        else:
+            device = Device(
+                organization_id=org.id,
+                device_name=info.get('device_name') or f"Device {adapter.ip_address}",
+                serial_number=serial,
+                ip_address=adapter.ip_address,
+                port=adapter.port
+            )
+            session.add(device)
+        session.flush()
+        return device
+
+    def load_snapshot(self, device):
+        try:
+            return json.loads(device.sync_snapshot) if device.sync_snapshot else {}
+        except ValueError:
+            return {}
+
+    def users_changed(self, snapshot, counters):
+        if not counters or not snapshot:
+            return True
+        return any(counters.get(key) != snapshot.get(key) for key in USER_COUNTERS)
+
+    def employee_map(self, session, user_ids):
+        """Return {employee_number: employee_id} for the given device user ids."""
+        result = {}
+        for chunk in chunked(user_ids):
+            rows = session.query(Employee.employee_number, Employee.id).filter(
+                Employee.employee_number.in_(chunk)
+            )
+            result.update({number: emp_id for number, emp_id in rows})
+        return result
+
+    def reconcile_users(self, session, users, org, dept):
+        """
+        Create employees for new device users and update changed names.
+        Existing employees are looked up in chunks instead of one query per user.
+        Returns (new_count, updated_count).
+        """
+        by_number = {}
+        for u in users:
+            by_number[str(u.user_id)] = u
+
+        existing = {}
+        for chunk in chunked(by_number):
+            for emp in session.query(Employee).filter(Employee.employee_number.in_(chunk)):
+                existing[emp.employee_number] = emp
+
+        new_count = 0
+        updated_count = 0
+        for uid_str, u in by_number.items():
+            emp = existing.get(uid_str)
+            if not emp:
+                session.add(Employee(
+                    organization_id=org.id,
+                    department_id=dept.id,
+                    employee_number=uid_str,
+                    first_name=u.name or "User",
+                    last_name=uid_str,
+                    status='active'
+                ))
+                new_count += 1
+            elif u.name and emp.first_name != u.name:
+                emp.first_name = u.name
+                updated_count += 1
+        session.flush()
+        return new_count, updated_count
+
+    def device_zone(self, session, device):
+        """Zone the terminal clock runs in: its own, else its organization's (None: host local time)."""
+        if device.timezone:
+            return device.timezone
+        return session.query(Organization.timezone).filter(Organization.id == device.organization_id).scalar()
+
+    def record_clock(self, session, adapter, device):
+        """Measure the device clock against the host and store the offset on the Device row."""
+        offset = measure_offset(adapter, self.device_zone(session, device))
+        if offset is not None:
+            if offset != (device.clock_offset_seconds or 0):
+                logger.info(f"Device {device.id} clock offset is {offset}s")
+            device.clock_offset_seconds = offset
+            device.clock_checked_at = datetime.utcnow()
+        return offset
+
+    def time_correction(self, session, device_id):
+        """(offset_seconds, device zone, organization zone) used to normalize a device's punches."""
+        row = session.query(Device.clock_offset_seconds, Device.timezone, Organization.timezone).outerjoin(
+            Organization, Organization.id == Device.organization_id
+        ).filter(Device.id == device_id).first()
+        if row is None:
+            return None, None, None
+        offset, device_tz, org_tz = row
+        # A device without its own zone runs on the organization's
+        return offset, device_tz or org_tz, org_tz
+
+    def ingest_records(self, session, records, user_map, device_id):
+        """
+        Insert punches that are not stored yet. Existing punches are fetched once
+        for the batch's employees and time span rather than checked one by one.
+
+        The batch is corrected for the device's clock offset and time zone
+        before it is classified and stored. Duplicates are detected on the raw
+        device timestamp, which does not move when the measured offset does.
+        Returns the number of new records.
+        """
+        rows = []
+        for rec in records:
+            emp_id = user_map.get(str(getattr(rec, 'user_id', '')))
+            device_time = getattr(rec, 'timestamp', None)
+            if emp_id is None or not device_time:
+                continue
+            rows.append((emp_id, device_time, getattr(rec, 'punch', 0)))
+        if not rows:
+            return 0
+
+        start = min(r[1] for r in rows)
+        end = max(r[1] for r in rows)
+        # Re-downloaded punches may already be archived; a day either side covers the clock correction
+        punches = punch_source(session, start - timedelta(days=1), end + timedelta(days=1))
+        # Rows stored before device_time existed only have punch_time
+        raw_time = func.coalesce(punches.c.device_time, punches.c.punch_time)
+        seen = set()
+        for chunk in chunked({r[0] for r in rows}):
+            seen.update(session.query(punches.c.employee_id, raw_time).filter(
+                punches.c.employee_id.in_(chunk),
+                punches.c.device_id == device_id,
+                or_(punches.c.device_time.between(start, end),
+                    and_(punches.c.device_time.is_(None), punches.c.punch_time.between(start, end)))
+            ))
+
+        new_rows = []
+        for emp_id, device_time, p_val in rows:
+            if (emp_id, device_time) in seen:
+                continue
+            seen.add((emp_id, device_time))
+            new_rows.append({
+                'employee_id': emp_id,
+                'device_id': device_id,
+                'device_time': device_time,
+                'punch_type': punch_type_for(p_val),
+                'status': 'valid'
+            })
+
+        offset, source_tz, target_tz = self.time_correction(session, device_id)
+        corrected = normalize_times([r['device_time'] for r in new_rows], offset, source_tz, target_tz)
+        for row, punch_time in zip(new_rows, corrected):
+            row['punch_time'] = punch_time
+
+        statuses = punch_classifier.classify(session, [
+            (r['employee_id'], r['punch_time'], r['punch_type'], r['device_id']) for r in new_rows
+        ])
+        for row, status in zip(new_rows, statuses):
+            row['status'] = status
+        flagged = sum(1 for status in statuses if status != 'valid')
+        if flagged:
+            logger.info(f"Flagged {flagged} of {len(new_rows)} new punches as duplicate or suspicious")
+
+        for chunk in chunked(new_rows):
+            session.execute(insert(AttendanceRecord), chunk)
+        mark_dirty(session, punch_keys((r['employee_id'], r['punch_time']) for r in new_rows))
+        return len(new_rows)
+
+    def log_sync(self, session, device_id, operation, started_at, status, records=0, new_records=0, message=None):
+        """Add a device_sync_logs row to the session. Does not commit."""
+        session.add(DeviceSyncLog(
+            device_id=device_id,
+            operation=operation,
+            status=status,
+            started_at=started_at,
+            finished_at=datetime.utcnow(),
+            records=records or 0,
+            new_records=new_records or 0,
+            message=message
+        ))
+
+    def sync_device(self, session, adapter, device, org, dept):
+        """
+        Pull new punches from a device (see download()) and store them,
+        waiting for the database; the outcome is recorded in device_sync_logs.
+
+        session is only read from here; whatever the caller staged in it
+        (defaults, a newly registered device) is committed first. If the
+        database write fails once the download is spooled, the sync still
+        succeeds, marked 'spooled', and the spool replayer stores it later.
+        """
+        device_id = device.id
+        started_at = datetime.utcnow()
+        try:
+            session.commit()
+            snapshot = self.current_snapshot(device_id, device.sync_snapshot)
+            args = self.download(adapter, device_id, org.id, dept.id, self.device_zone(session, device), snapshot,
+                                 lambda user_ids: set(self.employee_map(session, user_ids)), started_at)
+            future, spooled = self.store(args)
+            try:
+                result = future.result()
+            except Exception as e:
+                if not spooled:
+                    raise
+                logger.warning(f"Spooled {len(args[6])} punches of device {device_id}, database write failed: {e}")
+                result = self.spooled_result(args)
+        except Exception as e:
+            session.rollback()
+            self.log_failure(device_id, started_at, e)
+            raise
+        session.expire_all()
+        logger.info(f"Synced device {device_id}: {result}")
+        return result
+
+    def log_failure(self, device_id, started_at, error, wait=True):
+        """Record a failed sync in device_sync_logs. Failing to (the database is down) is only logged."""
+        def logged(future):
+            if future.exception() is not None:
+                logger.error(f"Error logging the failed sync of device {device_id}: {future.exception()}")
+
+        try:
+            future = db_writer.submit(self.log_sync, device_id, 'sync', started_at, 'failed', message=str(error))
+            future.add_done_callback(logged)
+            if wait:
+                future.result()
+        except Exception:
+            # Already logged by the callback; the caller re-raises the sync's own error
+            pass
+
+    def download(self, adapter, device_id, org_id, dept_id, zone, snapshot, known_users, started_at=None):
+        """
+        Read what changed on a connected device, without touching the database.
+
+        The device counters are compared with snapshot: the user table is only
+        downloaded when the user, fingerprint, face or card counts moved (or
+        punches name users that known_users(user_ids) does not return), and
+        the attendance log is only downloaded when the record count moved.
+        Returns the arguments of the _store_sync writer job (after its session).
+        """
+        started_at = started_at or datetime.utcnow()
+        offset = measure_offset(adapter, zone)
+        counters = adapter.get_counters()
+
+        records = []
+        if not counters or counters.get('records') != snapshot.get('records'):
+            records = adapter.get_attendance()
+
+        users = None
+        user_ids = {str(getattr(rec, 'user_id', '')) for rec in records}
+        # Punches from users we have never seen mean the snapshot was stale
+        if self.users_changed(snapshot, counters) or len(known_users(user_ids)) < len(user_ids):
+            users = adapter.get_users()
+            if not users and counters.get('users'):
+                # The download failed; keep the old snapshot so we retry next time
+                logger.warning(f"Device {device_id} reported {counters['users']} users but none were read")
+                users = None
+        return device_id, org_id, dept_id, offset, counters, snapshot, records, users, started_at
+
+    def store(self, args):
+        """
+        Spool a download (services/punch_spool.py) and queue its writer job
+        without waiting for it. Returns (future of the _store_sync result,
+        spooled). The spool entry is acknowledged once the job committed; if
+        the job fails, the entry stays for the spool replayer.
+        """
+        from services.device_cache import device_cache
+
+        device_id, records, users = args[0], args[6], args[7]
+        entry_id = None
+        if DEVICE_CONFIGS['spool_enabled'] and (records or users):
+            entry_id = punch_spool.append(*args)
+        if entry_id is not None:
+            snapshot = self.next_snapshot(args[5], args[4], records, users)
+            with self._lock:
+                self._load_spooled()
+                self._inflight.add(entry_id)
+                self._spooled[device_id] = (entry_id, snapshot)
+            device_cache.add_users(str(u.user_id) for u in users or ())
+        future = db_writer.submit(self._store_sync, *args)
+        if entry_id is not None:
+            future.add_done_callback(lambda done: self._stored(device_id, entry_id, done))
+        return future, entry_id is not None
+
+    def _stored(self, device_id, entry_id, future):
+        error = future.exception()
+        with self._lock:
+            self._inflight.discard(entry_id)
+            if error is None and self._spooled.get(device_id, (None,))[0] == entry_id:
+                # The Device row holds this snapshot now
+                del self._spooled[device_id]
+        if error is None:
+            punch_spool.ack(entry_id)
+        else:
+            logger.warning(f"Download of device {device_id} stays spooled, database write failed: {error}")
+            self.wake_replayer()
+
+    def spooled_result(self, args):
+        """Result of a sync whose download is spooled but not stored (yet)."""
+        return {'records': len(args[6]), 'new_records': 0, 'users_synced': False, 'new_users': 0,
+                'spooled': True}
+
+    def _load_spooled(self):
+        """Rebuild the snapshots of spooled downloads from the spool (once, under _lock)."""
+        if self._spooled is not None:
+            return
+        self._spooled = {}
+        for entry_id, args in punch_spool.pending():
+            self._spooled[args[0]] = (entry_id, self.next_snapshot(args[5], args[4], args[6], args[7]))
+
+    def current_snapshot(self, device_id, stored):
+        """
+        Sync snapshot to compare a device's counters with: that of its latest
+        download not stored yet, else the Device row's (JSON text in stored).
+        """
+        with self._lock:
+            self._load_spooled()
+            spooled = self._spooled.get(device_id)
+        if spooled is not None:
+            return dict(spooled[1])
+        try:
+            return json.loads(stored) if stored else {}
+        except ValueError:
+            return {}
+
+    def next_snapshot(self, snapshot, counters, records, users):
+        """The sync snapshot once a download is stored."""
+        updated = dict(snapshot)
+        if counters:
+            if users is not None:
+                updated.update({key: counters.get(key) for key in USER_COUNTERS})
+            if records or not counters.get('records'):
+                # An empty download from a non-empty log means it failed; retry next time
+                updated['records'] = counters.get('records')
+        return updated
+
+    def _store_sync(self, session, device_id, org_id, dept_id, offset, counters, snapshot, records, users,
+                    started_at):
+        """Writer job of a download: store the clock, users and new punches and log the sync."""
+        device = session.get(Device, device_id)
+        if offset is not None:
+            if offset != (device.clock_offset_seconds or 0):
+                logger.info(f"Device {device_id} clock offset is {offset}s")
+            device.clock_offset_seconds = offset
+            device.clock_checked_at = datetime.utcnow()
+        result = {'records': len(records), 'new_records': 0, 'users_synced': False, 'new_users': 0}
+
+        if users is not None:
+            result['new_users'], _ = self.reconcile_users(session, users, session.get(Organization, org_id),
+                                                          session.get(Department, dept_id))
+            result['users_synced'] = True
+
+        user_map = self.employee_map(session, {str(getattr(rec, 'user_id', '')) for rec in records})
+        result['new_records'] = self.ingest_records(session, records, user_map, device_id)
+
+        if counters:
+            device.sync_snapshot = json.dumps(self.next_snapshot(snapshot, counters, records, users))
+        device.last_sync_at = datetime.utcnow()
+        self.log_sync(session, device_id, 'sync', started_at, 'success', result['records'], result['new_records'])
+        return result
+
+    def verify_committed(self, session, records, user_map, device_id):
+        """
+        Check that the downloaded punches are exactly what attendance_records holds.
+
+        Punches are grouped per day. For each day, the device-side count and
+        checksum of (employee_id, raw timestamp) are compared with those of
+        the rows stored for this device between the day's first and last
+        downloaded punch, read independently of the download, so a missing,
+        extra or misattributed row fails the check. Returns (verified, ranges)
+        where ranges lists the per-day comparison.
+        """
+        by_day = {}
+        for rec in records:
+            emp_id = user_map.get(str(getattr(rec, 'user_id', '')))
+            punch_time = getattr(rec, 'timestamp', None)
+            if emp_id is None or not punch_time:
+                # A punch we could not attribute was never stored
+                return False, []
+            by_day.setdefault(punch_time.date(), set()).add((emp_id, punch_time))
+
+        ranges = []
+        for day in sorted(by_day):
+            keys = by_day[day]
+            # Punches before the first one downloaded may come from the log cleared last time
+            first = min(k[1] for k in keys)
+            last = max(k[1] for k in keys)
+            punches = punch_source(session, first - timedelta(days=1), last + timedelta(days=1))
+            raw_time = func.coalesce(punches.c.device_time, punches.c.punch_time)
+            stored = set(session.query(punches.c.employee_id, raw_time).filter(
+                punches.c.device_id == device_id,
+                # The clock correction moves punch_time less than a day; lets the time index narrow the scan
+                punches.c.punch_time >= first - timedelta(days=1),
+                punches.c.punch_time <= last + timedelta(days=1),
+                raw_time >= first,
+                raw_time <= last
+            ))
+            ranges.append({
+                'date': day,
+                'device_count': len(keys),
+                'stored_count': len(stored),
+                'device_checksum': punch_checksum(keys),
+                'stored_checksum': punch_checksum(stored),
+            })
+
+        verified = all(r['device_count'] == r['stored_count'] and r['device_checksum'] == r['stored_checksum']
+                       for r in ranges)
+        return verified, ranges
+
+    def rotate_log(self, session_factory, adapter, download, min_records=None):
+        """Archive and clear a device's log (see _rotate_log), recording the outcome in device_sync_logs."""
+        device_id = download[0]
+        started_at = datetime.utcnow()
+        result = self._rotate_log(session_factory, adapter, download, min_records)
+        if result['rotated'] or result['error']:
+            try:
+                db_writer.call(self.log_sync, device_id, 'rotate', started_at,
+                               'failed' if result['error'] else 'success',
+                               result['records'], result['new_records'], result['error'])
+            except Exception as e:
+                logger.error(f"Error logging log rotation of device {device_id}: {e}")
+        return result
+
+    def _rotate_log(self, session_factory, adapter, download, min_records=None):
+        """
+        Archive and clear a device's attendance log.
+
+        download holds the arguments of the stored download (see download())
+        that preceded the rotation. The device is disabled, and if its log
+        still holds exactly the punches downloaded then, they are not read
+        again; otherwise the log is downloaded and stored anew. The punches
+        are then re-read through session_factory (read sessions) to prove
+        they were committed (per-day counts and checksums), and only then
+        cleared. The device stays disabled for the whole sequence so no punch
+        can land between the check and the clear. Logs smaller than
+        min_records are left alone.
+        """
+        device_id, org_id, dept_id = download[0], download[1], download[2]
+        if min_records is None:
+            min_records = DEVICE_CONFIGS.get('log_rotation_min_records', 0)
+        result = {'rotated': False, 'records': 0, 'new_records': 0, 'ranges': [], 'error': None}
+
+        with adapter.disabled():
+            counters = adapter.get_counters()
+            if counters.get('records', 0) < min_records:
+                return result
+
+            records = download[6]
+            reused = bool(records) and len(records) == counters.get('records')
+            if not reused:
+                records = adapter.get_attendance()
+            result['records'] = len(records)
+            if not records:
+                if counters.get('records'):
+                    result['error'] = "Attendance download failed"
+                return result
+
+            user_ids = {str(getattr(rec, 'user_id', '')) for rec in records}
+            if not reused:
+                session = session_factory()
+                try:
+                    users = adapter.get_users() if len(self.employee_map(session, user_ids)) < len(user_ids) \
+                        else None
+                finally:
+                    session.close()
+                try:
+                    result['new_records'] = db_writer.call(self._store_rotation, device_id, org_id, dept_id,
+                                                           records, users)
+                except Exception as e:
+                    result['error'] = f"Archiving failed: {e}"
+                    return result
+
+            # Verify against what a new transaction can see, not the writer's state
+            session = session_factory()
+            try:
+                user_map = self.employee_map(session, user_ids)
+                verified, result['ranges'] = self.verify_committed(session, records, user_map, device_id)
+            finally:
+                session.close()
+            if not verified:
+                result['error'] = "Stored punches do not match the device log"
+                logger.error(f"Not clearing device {device_id}: {result['error']}")
+                return result
+
+            if not adapter.clear_attendance():
+                result['error'] = "Clearing the device log failed"
+                return result
+            try:
+                db_writer.call(self._store_cleared, device_id)
+            except Exception as e:
+                # The next sync finds fewer records than the snapshot and downloads the log again
+                logger.error(f"Error resetting the sync snapshot of device {device_id}: {e}")
+
+        result['rotated'] = True
+        logger.info(f"Rotated log of device {device_id}: {result['records']} punches archived"
+                    f"{' (reused the sync download)' if reused else ''}")
+        return result
+
+    def _store_rotation(self, session, device_id, org_id, dept_id, records, users):
+        """Writer job of a rotation download: store the users and new punches. Returns the new punch count."""
+        if users:
+            self.reconcile_users(session, users, session.get(Organization, org_id), session.get(Department, dept_id))
+        user_map = self.employee_map(session, {str(getattr(rec, 'user_id', '')) for rec in records})
+        return self.ingest_records(session, records, user_map, device_id)
+
+    def _store_cleared(self, session, device_id):
+        """Writer job after a device log was cleared: its snapshot now counts no punches."""
+        device = session.get(Device, device_id)
+        if device is not None:
+            snapshot = self.load_snapshot(device)
+            snapshot['records'] = 0
+            device.sync_snapshot = json.dumps(snapshot)
+            device.last_sync_at = datetime.utcnow()
+
+    def replay_archive(self, session_factory, location=None, device_keys=None, since=None):
+        """
+        Re-ingest archived raw device buffers (see devices/dump_archive.py)
+        without contacting any device. Segments are memory-mapped and decoded
+        in place; each attendance batch goes through ingest_records, so punches
+        already stored are skipped and new ones are corrected with the device's
+        last measured clock offset. Returns counts per device key.
+        """
+        from devices.dump_archive import iter_segments, read_segment, parse_device_key
+
+        stats = {}
+        session = session_factory()
+        try:
+            org, dept = self.ensure_defaults(session)
+            for key, path in iter_segments(location, device_keys, since):
+                ip_address, port = parse_device_key(key)
+                device = session.query(Device).filter_by(ip_address=ip_address, port=port).first()
+                if device is None:
+                    logger.warning(f"Skipping {path}: no registered device at {ip_address}:{port}")
+                    continue
+                counts = stats.setdefault(key, {'segments': 0, 'records': 0, 'new_records': 0, 'new_users': 0})
+                counts['segments'] += 1
+                for kind, batch in read_segment(path):
+                    if kind == 'users':
+                        new_users, _ = self.reconcile_users(session, batch, org, dept)
+                        counts['new_users'] += new_users
+                    else:
+                        user_map = self.employee_map(session, {str(rec.user_id) for rec in batch})
+                        counts['records'] += len(batch)
+                        counts['new_records'] += self.ingest_records(session, batch, user_map, device.id)
+                # One transaction per segment keeps a month of punches to a single commit
+                session.commit()
+                logger.info(f"Replayed {path}: {counts}")
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        return stats
+
+    def replay_spool(self, spool=None, batch_size=None):
+        """
+        Store the spooled downloads the database missed (see services/punch_spool.py),
+        oldest first, leaving out those whose writer job is still queued.
+        Entries are grouped into one writer job, and so one transaction, per
+        batch_size punches and acknowledged once committed; ingest_records
+        skips punches already stored. Stops at the first failing batch, which
+        stays spooled. Returns counts.
+        """
+        spool = spool or punch_spool
+        batch_size = batch_size or DEVICE_CONFIGS['spool_replay_batch']
+        stats = {'entries': 0, 'records': 0, 'new_records': 0, 'pending': spool.pending_count()}
+        if not stats['pending']:
+            return stats
+
+        with self._lock:
+            inflight = set(self._inflight)
+        batch = []
+        punches = 0
+        for entry_id, args in spool.pending():
+            if entry_id in inflight:
+                continue
+            batch.append((entry_id, args))
+            punches += len(args[6])
+            if punches >= batch_size:
+                self._replay_batch(spool, batch, stats)
+                batch, punches = [], 0
+        if batch:
+            self._replay_batch(spool, batch, stats)
+        stats['pending'] = spool.pending_count()
+        if stats['entries']:
+            logger.info(f"Replayed punch spool: {stats}")
+        return stats
+
+    def _replay_batch(self, spool, batch, stats):
+        results = db_writer.call(self._store_spooled, [args for _, args in batch])
+        spool.ack([entry_id for entry_id, _ in batch])
+        with self._lock:
+            for entry_id, args in batch:
+                if self._spooled is not None and self._spooled.get(args[0], (None,))[0] == entry_id:
+                    del self._spooled[args[0]]
+        stats['entries'] += len(batch)
+        for result in results:
+            stats['records'] += result['records']
+            stats['new_records'] += result['new_records']
+
+    def _store_spooled(self, session, entries):
+        """Writer job of replay_spool: _store_sync for each spooled entry, in one transaction."""
+        results = []
+        for args in entries:
+            if session.get(Device, args[0]) is None:
+                logger.warning(f"Dropping {len(args[6])} spooled punches of removed device {args[0]}")
+                results.append({'records': 0, 'new_records': 0})
+                continue
+            results.append(self._store_sync(session, *args))
+        return results
+
+    def wake_replayer(self):
+        """Have the spool replayer (started on first use) look for pending downloads now."""
+        with self._lock:
+            if self._replayer is None or not self._replayer.is_alive():
+                self._replayer = SpoolReplayer(self)
+                self._replayer.start()
+            replayer = self._replayer
+        replayer.wake()
+
+    def stop_replayer(self, timeout=None):
+        with self._lock:
+            replayer = self._replayer
+        if replayer is not None:
+            replayer.stop()
+            replayer.join(timeout)
+
+
+class SpoolReplayer(threading.Thread):
+    """
+    Background thread storing spooled downloads through SyncService.replay_spool(),
+    every spool_retry_seconds while any are pending (the database is unreachable)
+    and whenever woken.
+    """
+
+    def __init__(self, service, interval=None):
+        super().__init__(name='spool-replayer', daemon=True)
+        self.service = service
+        self.interval = interval or DEVICE_CONFIGS['spool_retry_seconds']
+        self._stop_event = threading.Event()
+        self._wake = threading.Event()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop_event.is_set():
+                break
+            try:
+                self.service.replay_spool()
+            except Exception as e:
+                logger.warning(f"Punch spool not replayed yet: {e}")
+
+
+sync_service = SyncService()
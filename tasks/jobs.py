@@ -0,0 +1,87 @@
+"""
+Job functions run by the scheduler (tasks/scheduler.py).
+
+Each job is a plain function without arguments that raises on failure and
+returns a short summary for the job_runs history. They open their own
+sessions, so they can also be called directly from a shell.
+"""
+import logging
+from datetime import date, timedelta
+
+logger = logging.getLogger(__name__)
+
+
+def sync_devices():
+    """Pull new punches from every active device, unless a sync daemon is already polling them."""
+    from services.device_service import DeviceService
+    from services.sync_daemon import daemon_running
+
+    if daemon_running():
+        return "Skipped, the sync daemon is polling the devices"
+    results = DeviceService().sync_attendance()
+    synced = sum(1 for result in results.values() if result['success'])
+    new_records = sum(result.get('new_records', 0) for result in results.values())
+    return f"{synced}/{len(results)} devices synced, {new_records} new punches"
+
+
+def device_maintenance():
+    """
+    Sync and rotate device logs, check and correct device clocks and prune
+    old raw device dumps, unless a sync daemon does it.
+    """
+    from devices.dump_archive import prune_dumps
+    from services.device_service import DeviceService
+    from services.sync_daemon import daemon_running
+
+    if daemon_running():
+        # Disabling terminals for a rotation or clock reset would race the daemon's polls
+        return "Skipped, the sync daemon maintains the devices"
+    service = DeviceService()
+    results = service.sync_attendance(rotate=True)
+    rotated = sum(1 for result in results.values() if result.get('rotation', {}).get('rotated'))
+    clocks = service.sync_clocks()
+    reset = sum(1 for result in clocks.values() if result.get('reset'))
+    pruned = prune_dumps()
+    return f"{len(results)} devices synced, {rotated} logs rotated, {reset} clocks reset, " \
+           f"{pruned} raw dump segments pruned"
+
+
+def roll_attendance_forward():
+    """Give every active employee a daily attendance row for today (and days the job missed)."""
+    from core.daily_attendance import roll_forward
+    from database.writer import db_writer
+
+    marked = db_writer.call(roll_forward)
+    return f"{marked} employee-days added for recomputation"
+
+
+def backup_database():
+    """Take a full or incremental online backup and prune backups past retention_days."""
+    from services.backup_service import backup_service
+
+    result = backup_service.run()
+    if not result['success']:
+        raise RuntimeError(result['error'])
+    pruned = backup_service.prune()
+    return f"{result['backup_type'].capitalize()} backup to {result['path']} ({result['size']} bytes), " \
+           f"{pruned} old backups removed"
+
+
+def archive_attendance():
+    """Move punches of months older than hot_months into their monthly archive partitions."""
+    from database.archive import archive_attendance
+
+    results = archive_attendance()
+    moved = sum(results.values())
+    return f"{moved} punches archived from {sum(1 for count in results.values() if count)} months"
+
+
+def prewarm_reports(day=None):
+    """Render the Reports page reports for yesterday so daytime requests are report cache hits."""
+    from reports.pdf import render_pdf
+    from reports.sources import REPORTS, default_params
+
+    day = day or date.today() - timedelta(days=1)
+    for report_key in REPORTS:
+        render_pdf(report_key, default_params(report_key, day))
+    return f"Rendered {len(REPORTS)} reports for {day}"
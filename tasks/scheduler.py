@@ -0,0 +1,253 @@
+"""
+Scheduled background jobs.
+
+Job definitions come from SCHEDULER_CONFIGS['jobs'] (plus the database
+backup from BACKUP_CONFIGS) and live in an APScheduler job store inside the
+application database, so next run times survive restarts. A run missed
+while the app was closed starts late if it is still within its class's
+misfire grace, otherwise it is recorded as missed; missed runs of the same
+job are coalesced into one. Every job class has its own thread pool sized
+to its concurrency limit.
+
+Off-peak classes are scheduled at night and additionally wait for an idle
+UI: any process using the UI touches an activity marker file, and a run
+that finds it touched within idle_minutes is deferred, then skipped once
+its grace has run out. Every run is recorded in job_runs.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from config import BACKUP_CONFIGS, SCHEDULER_CONFIGS
+
+logger = logging.getLogger(__name__)
+
+RETRY_SUFFIX = ':retry'
+
+
+# --- interactive use -------------------------------------------------------
+
+_last_mark = 0.0
+
+
+def mark_active():
+    """Record UI activity; the marker file is touched at most every 30 seconds."""
+    global _last_mark
+    now = time.time()
+    if now - _last_mark < 30:
+        return
+    _last_mark = now
+    path = SCHEDULER_CONFIGS['activity_marker']
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'a'):
+            os.utime(path)
+    except OSError as e:
+        logger.debug(f"Could not touch activity marker {path}: {e}")
+
+
+def idle_seconds():
+    """Seconds since the UI was last used by any process, or None if it never was."""
+    try:
+        return time.time() - os.path.getmtime(SCHEDULER_CONFIGS['activity_marker'])
+    except OSError:
+        return None
+
+
+# --- run history -----------------------------------------------------------
+
+def _record(job_id, job_class, status, message=None, scheduled_at=None, finished=False):
+    from database.models import JobRun
+    from database.writer import db_writer
+
+    def record(session):
+        now = datetime.utcnow()
+        run = JobRun(job_id=job_id, job_class=job_class, status=status, scheduled_at=scheduled_at,
+                     started_at=now, finished_at=now if finished else None, message=message)
+        session.add(run)
+        session.flush()
+        return run.id
+
+    try:
+        return db_writer.call(record)
+    except Exception as e:
+        logger.error(f"Error recording run of job {job_id}: {e}")
+        return None
+
+
+def _finish(run_id, status, message=None):
+    from sqlalchemy import update
+
+    from database.models import JobRun
+    from database.writer import db_writer
+
+    if run_id is None:
+        return
+    try:
+        db_writer.call(lambda session: session.execute(update(JobRun).where(JobRun.id == run_id).values(
+            status=status, finished_at=datetime.utcnow(), message=message)).rowcount)
+    except Exception as e:
+        logger.error(f"Error recording end of job run {run_id}: {e}")
+
+
+def prune_history(days=None):
+    """Delete job_runs rows older than history_days. Returns the number deleted."""
+    from database.models import JobRun
+    from database.writer import db_writer
+
+    cutoff = datetime.utcnow() - timedelta(days=days or SCHEDULER_CONFIGS['history_days'])
+    try:
+        return db_writer.call(lambda session: session.query(JobRun).filter(
+            JobRun.started_at < cutoff).delete(synchronize_session=False))
+    except Exception as e:
+        logger.error(f"Error pruning job history: {e}")
+        return 0
+
+
+def run_job(job_id, func, job_class, deadline=None):
+    """
+    Entry point of every scheduled job: hold off-peak classes back while the
+    UI is in use, run func (a 'module:function' reference) and record the run.
+    deadline is set on deferred retries: the time after which to give up.
+    """
+    from apscheduler.util import ref_to_obj
+
+    if SCHEDULER_CONFIGS['classes'][job_class]['off_peak']:
+        idle = idle_seconds()
+        if idle is not None and idle < SCHEDULER_CONFIGS['idle_minutes'] * 60:
+            retry_at = datetime.now() + timedelta(minutes=SCHEDULER_CONFIGS['defer_minutes'])
+            if deadline is None:
+                deadline = datetime.now() + timedelta(seconds=SCHEDULER_CONFIGS['classes'][job_class]['misfire_grace'])
+                _record(job_id, job_class, 'deferred', f"UI in use, retrying until {deadline:%H:%M}", finished=True)
+            if retry_at > deadline:
+                _record(job_id, job_class, 'skipped', "UI stayed in use", finished=True)
+                logger.warning(f"Skipped job {job_id}: the UI stayed in use")
+                return
+            job_scheduler.defer(job_id, func, job_class, retry_at, deadline)
+            return
+
+    run_id = _record(job_id, job_class, 'running')
+    try:
+        message = ref_to_obj(func)()
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {e}")
+        _finish(run_id, 'failed', str(e))
+        return
+    _finish(run_id, 'success', message)
+    logger.info(f"Job {job_id}: {message}")
+
+
+# --- scheduler -------------------------------------------------------------
+
+def job_definitions():
+    """{job_id: definition} from SCHEDULER_CONFIGS, plus the backup job when auto_backup is on."""
+    jobs = dict(SCHEDULER_CONFIGS['jobs'])
+    if BACKUP_CONFIGS.get('auto_backup'):
+        jobs['database_backup'] = {'func': 'tasks.jobs:backup_database', 'class': 'maintenance',
+                                   'at': BACKUP_CONFIGS['backup_time'],
+                                   'interval': BACKUP_CONFIGS.get('backup_interval', 'daily')}
+    return jobs
+
+
+def _trigger(definition):
+    from apscheduler.triggers.cron import CronTrigger
+    from apscheduler.triggers.interval import IntervalTrigger
+
+    if definition.get('every_minutes'):
+        return IntervalTrigger(minutes=definition['every_minutes'])
+    hour, minute = definition['at'].split(':')
+    interval = definition.get('interval', 'daily')
+    if interval == 'weekly':
+        return CronTrigger(day_of_week='sun', hour=int(hour), minute=int(minute))
+    if interval == 'monthly':
+        return CronTrigger(day=1, hour=int(hour), minute=int(minute))
+    return CronTrigger(hour=int(hour), minute=int(minute))
+
+
+class JobScheduler:
+    """APScheduler background scheduler with its job store in the application database."""
+
+    def __init__(self):
+        self._scheduler = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._scheduler is not None and self._scheduler.running
+
+    def start(self, engine=None):
+        from apscheduler.events import EVENT_JOB_MISSED
+        from apscheduler.executors.pool import ThreadPoolExecutor
+        from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+        from apscheduler.schedulers.background import BackgroundScheduler
+
+        from database.connection import db_manager
+
+        with self._lock:
+            if self.running:
+                return
+            classes = SCHEDULER_CONFIGS['classes']
+            self._scheduler = BackgroundScheduler(
+                jobstores={'default': SQLAlchemyJobStore(engine=engine or db_manager.engine,
+                                                         tablename='scheduler_jobs')},
+                executors={name: ThreadPoolExecutor(settings['workers']) for name, settings in classes.items()},
+                job_defaults={'coalesce': True, 'max_instances': 1},
+            )
+            self._scheduler.add_listener(self._on_missed, EVENT_JOB_MISSED)
+            # Paused until the definitions are reconciled, so stale stored jobs never fire
+            self._scheduler.start(paused=True)
+            self._sync_definitions()
+            prune_history()
+            self._scheduler.resume()
+        logger.info(f"Job scheduler started: {', '.join(job.id for job in self._scheduler.get_jobs())}")
+
+    def _sync_definitions(self):
+        """Add new and changed job definitions and drop removed ones; unchanged jobs keep their next run time."""
+        wanted = job_definitions()
+        for job in self._scheduler.get_jobs():
+            if job.id.split(RETRY_SUFFIX)[0] not in wanted:
+                job.remove()
+                logger.info(f"Removed scheduled job {job.id}")
+        for job_id, definition in wanted.items():
+            trigger = _trigger(definition)
+            args = (job_id, definition['func'], definition['class'])
+            grace = SCHEDULER_CONFIGS['classes'][definition['class']]['misfire_grace']
+            job = self._scheduler.get_job(job_id)
+            if job is not None and str(job.trigger) == str(trigger) and tuple(job.args) == args \
+                    and job.misfire_grace_time == grace:
+                continue
+            self._scheduler.add_job(run_job, trigger, args=args, id=job_id, name=job_id,
+                                    executor=definition['class'], misfire_grace_time=grace, replace_existing=True)
+            logger.info(f"Scheduled job {job_id}: {trigger}")
+
+    def defer(self, job_id, func, job_class, run_at, deadline):
+        """Schedule a one-off retry of a job that was held back."""
+        self._scheduler.add_job(run_job, 'date', run_date=run_at, args=(job_id, func, job_class, deadline),
+                                id=job_id + RETRY_SUFFIX, name=job_id, executor=job_class,
+                                misfire_grace_time=SCHEDULER_CONFIGS['classes'][job_class]['misfire_grace'],
+                                replace_existing=True)
+
+    def _on_missed(self, event):
+        job = self._scheduler.get_job(event.job_id)
+        job_class = job.args[2] if job is not None else 'unknown'
+        scheduled = event.scheduled_run_time.astimezone(timezone.utc).replace(tzinfo=None)
+        _record(event.job_id, job_class, 'missed', "Not started within its misfire grace time",
+                scheduled_at=scheduled, finished=True)
+        logger.warning(f"Job {event.job_id} missed its run at {event.scheduled_run_time}")
+
+    def jobs(self):
+        """[(job_id, next_run_time)] of the scheduled jobs."""
+        if not self.running:
+            return []
+        return [(job.id, job.next_run_time) for job in self._scheduler.get_jobs()]
+
+    def shutdown(self, wait=False):
+        with self._lock:
+            if self.running:
+                self._scheduler.shutdown(wait=wait)
+                logger.info("Job scheduler stopped")
+
+
+job_scheduler = JobScheduler()
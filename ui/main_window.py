@@ -2,7 +2,7 @@ from PyQt6.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
     QPushButton, QFrame, QStackedWidget, QLabel, QApplication
 )
-from PyQt6.QtCore import Qt, QSize
+from PyQt6.QtCore import Qt, QSize, QObject, QEvent
 from PyQt6.QtGui import QIcon
 import sys
 import os
@@ -12,6 +12,15 @@ from ui.pages import (
     DevicesPage, DatabasesPage, ReportsPage, SettingsPage
 )
 
+class ActivityFilter(QObject):
+    """Application-wide event filter telling the job scheduler the UI is in use."""
+
+    def eventFilter(self, obj, event):
+        if event.type() in (QEvent.Type.KeyPress, QEvent.Type.MouseButtonPress, QEvent.Type.Wheel):
+            from tasks.scheduler import mark_active
+            mark_active()
+        return False
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
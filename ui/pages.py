@@ -2,9 +2,9 @@ from PyQt6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QLabel, 
     QPushButton, QFrame, QGridLayout, QScrollArea,
     QSizePolicy, QLineEdit, QApplication, QDialog, QComboBox, QDateEdit, QMessageBox,
-    QTableWidget, QTableWidgetItem, QHeaderView
+    QTableWidget, QTableWidgetItem, QHeaderView, QProgressBar, QFileDialog
 )
-from PyQt6.QtCore import Qt, QSize, QDate
+from PyQt6.QtCore import Qt, QSize, QDate, QThread, pyqtSignal
 from ui.widgets.attendance_table import AttendanceTable
 
 class DashboardPage(QWidget):
@@ -55,11 +55,17 @@ class DashboardPage(QWidget):
 
     def load_dashboard_data(self):
         from database.connection import db_manager
-        from database.models import AttendanceRecord, Employee, Leave
+        from database.models import AttendanceRecord, Employee
+        from core.leave_index import leave_index
+        from core.shifts import attendance_exceptions
+        from core.work_calendar import work_calendar
+        from database.rows import punch_rows
+        from utils.formatting import punch_table_rows
+        from sqlalchemy import func
         from datetime import datetime
         
         try:
-            session_factory = db_manager.get_session()
+            session_factory = db_manager.get_read_session()
             session = session_factory()
             
             # Update Stat Cards
@@ -73,36 +79,25 @@ class DashboardPage(QWidget):
             ).distinct().count()
             self.present_card.findChild(QLabel, "StatValue").setText(str(present_today))
             
-            # Count late (stub logic: after 09:00:00)
-            late_today = session.query(AttendanceRecord.employee_id).filter(
-                AttendanceRecord.punch_time >= datetime.combine(today, datetime.min.time().replace(hour=9))
-            ).filter(AttendanceRecord.punch_type == 'in').distinct().count()
+            # Count late against each employee's shift (default day when unassigned)
+            day = attendance_exceptions(session, today, today)
+            late_today = int((day['late_minutes'] > 0).sum()) if not day.empty else 0
             self.late_card.findChild(QLabel, "StatValue").setText(str(late_today))
             
             # Count on leave
-            on_leave_today = session.query(Leave).filter(
-                Leave.start_date <= today,
-                Leave.end_date >= today,
-                Leave.status == 'approved'
-            ).count()
+            on_leave_today = len(leave_index.on_leave(today))
             
-            absent_today = max(0, total_emp - present_today - on_leave_today)
+            # Only employees whose organization works today can be absent
+            expected_today = sum(
+                count for org_id, count in session.query(Employee.organization_id, func.count(Employee.id))
+                .group_by(Employee.organization_id)
+                if work_calendar.is_working_day(org_id, today)
+            )
+            absent_today = max(0, expected_today - present_today - on_leave_today)
             self.absent_card.findChild(QLabel, "StatValue").setText(str(absent_today))
             
             # Load recent activity
-            records = session.query(AttendanceRecord).order_by(AttendanceRecord.punch_time.desc()).limit(10).all()
-            formatted_data = []
-            for rec in records:
-                formatted_data.append({
-                    'uid': rec.employee.employee_number,
-                    'name': f"{rec.employee.first_name} {rec.employee.last_name}",
-                    'date': rec.punch_time.strftime('%Y-%m-%d'),
-                    'time': rec.punch_time.strftime('%H:%M:%S'),
-                    'type': 'Check-In' if rec.punch_type == 'in' else 'Check-Out',
-                    'device': f"Device {rec.device_id}",
-                    'status': rec.status
-                })
-            self.table.load_data(formatted_data)
+            self.table.load_data(punch_table_rows(punch_rows(session, limit=10)))
             
         except Exception as e:
             print(f"Error loading dashboard: {e}")
@@ -175,8 +170,8 @@ class AddLeaveDialog(QDialog):
         layout.addLayout(btn_layout)
 
     def save_leave(self):
-        from database.connection import db_manager
         from database.models import Leave
+        from database.writer import db_writer
         
         start = self.start_date.date().toPyDate()
         end = self.end_date.date().toPyDate()
@@ -186,9 +181,6 @@ class AddLeaveDialog(QDialog):
             return
 
         try:
-            session_factory = db_manager.get_session()
-            session = session_factory()
-            
             leave = Leave(
                 employee_id=self.employee_id,
                 start_date=start,
@@ -197,9 +189,7 @@ class AddLeaveDialog(QDialog):
                 status='approved',
                 reason=self.reason_input.text()
             )
-            session.add(leave)
-            session.commit()
-            session.close()
+            db_writer.call(lambda session: session.add(leave))
             
             QMessageBox.information(self, "Success", "Leave granted successfully.")
             self.accept()
@@ -280,10 +270,12 @@ class EmployeeDetailDialog(QDialog):
 
     def load_data(self):
         from database.connection import db_manager
-        from database.models import Employee, AttendanceRecord
+        from database.models import Employee
+        from database.rows import punch_rows
+        from utils.formatting import punch_table_rows
         
         try:
-            session_factory = db_manager.get_session()
+            session_factory = db_manager.get_read_session()
             session = session_factory()
             
             emp = session.query(Employee).filter_by(id=self.employee_id).first()
@@ -299,19 +291,7 @@ class EmployeeDetailDialog(QDialog):
             self.email_lbl.setText(f"Email: {emp.email or 'N/A'}")
 
             # Attendance
-            records = session.query(AttendanceRecord).filter_by(employee_id=emp.id).order_by(AttendanceRecord.punch_time.desc()).all()
-            formatted_data = []
-            for rec in records:
-                formatted_data.append({
-                    'uid': emp.employee_number,
-                    'name': f"{emp.first_name} {emp.last_name}",
-                    'date': rec.punch_time.strftime('%Y-%m-%d'),
-                    'time': rec.punch_time.strftime('%H:%M:%S'),
-                    'type': 'Check-In' if rec.punch_type == 'in' else 'Check-Out',
-                    'device': f"Device {rec.device_id}",
-                    'status': rec.status
-                })
-            self.table.load_data(formatted_data)
+            self.table.load_data(punch_table_rows(punch_rows(session, employee_id=emp.id)))
             
         except Exception as e:
             print(f"Error loading detail dialog: {e}")
@@ -362,7 +342,7 @@ class EmployeesPage(QWidget):
         layout.addWidget(self.table)
         layout.addStretch()
         
-        self.employee_cache = [] # Store full objects for lookup
+        self.employee_cache = [] # EmployeeRow list for lookup
         self.load_employees()
 
     def on_row_clicked(self, row, column):
@@ -376,47 +356,21 @@ class EmployeesPage(QWidget):
 
     def load_employees(self):
         from database.connection import db_manager
-        from database.models import Employee, Department
+        from database.rows import employee_rows
+        from utils.formatting import employee_table_rows
         
         try:
-            session_factory = db_manager.get_session()
+            session_factory = db_manager.get_read_session()
             session = session_factory()
             
             search_text = self.search_input.text().strip().lower()
             filter_type = self.filter_combo.currentText()
             
-            query = session.query(Employee).join(Department)
-            
-            if search_text:
-                query = query.filter(
-                    (Employee.first_name.ilike(f"%{search_text}%")) |
-                    (Employee.last_name.ilike(f"%{search_text}%")) |
-                    (Employee.employee_number.ilike(f"%{search_text}%")) |
-                    (Department.name.ilike(f"%{search_text}%"))
-                )
-            
-            if filter_type != "All Employees":
-                if filter_type == "Short Contract":
-                    query = query.filter(Employee.contract_type == 'short_contract')
-                elif filter_type == "Permanent":
-                    query = query.filter(Employee.contract_type == 'permanent')
-                elif filter_type == "Intern":
-                    query = query.filter(Employee.contract_type == 'intern')
-
-            employees = query.all()
+            contract_types = {"Short Contract": 'short_contract', "Permanent": 'permanent', "Intern": 'intern'}
+            employees = employee_rows(session, search_text, contract_types.get(filter_type))
             self.employee_cache = employees # Update cache for detail lookup
             
-            formatted_data = []
-            for emp in employees:
-                formatted_data.append({
-                    'uid': emp.employee_number,
-                    'name': f"{emp.first_name} {emp.last_name}",
-                    'date': emp.department.name if emp.department else "N/A",
-                    'time': emp.contract_type.capitalize() if emp.contract_type else "N/A",  # Reuse 'time' col for Job Title/Contract
-                    'type': emp.status,
-                    'device': emp.hire_date.strftime('%Y-%m-%d') if emp.hire_date else "N/A",
-                    'status': 'Edit'
-                })
+            formatted_data = employee_table_rows(employees)
             
             self.table.load_data(formatted_data)
         except Exception as e:
@@ -427,8 +381,8 @@ class EmployeesPage(QWidget):
 
     def sync_users(self):
         from devices.identix_k20 import IdentiXK20Adapter
-        from database.connection import db_manager
-        from database.models import Employee, Organization, Department
+        from database.writer import db_writer
+        from services.sync_service import sync_service
         from PyQt6.QtWidgets import QMessageBox
 
         default_ip = "192.168.1.1" 
@@ -447,47 +401,11 @@ class EmployeesPage(QWidget):
                     QMessageBox.information(self, "Sync", "No users found on the device.")
                     return
 
-                session_factory = db_manager.get_session()
-                session = session_factory()
+                def store(session):
+                    org, dept = sync_service.ensure_defaults(session)
+                    return sync_service.reconcile_users(session, users, org, dept)
 
-                # Ensure we have an organization and department (stub)
-                org = session.query(Organization).first()
-                if not org:
-                    org = Organization(name="Default Org", code="DEFAULT")
-                    session.add(org)
-                    session.flush()
-                
-                dept = session.query(Department).first()
-                if not dept:
-                    dept = Department(organization_id=org.id, name="General", code="GEN")
-                    session.add(dept)
-                    session.flush()
-
-                new_count = 0
-                updated_count = 0
-                for u in users:
-                    # User user_id as employee_number
-                    uid_str = str(u.user_id)
-                    emp = session.query(Employee).filter_by(employee_number=uid_str).first()
-                    
-                    if not emp:
-                        emp = Employee(
-                            organization_id=org.id,
-                            department_id=dept.id,
-                            employee_number=uid_str,
-                            first_name=u.name or "User",
-                            last_name=uid_str,
-                            status='active'
-                        )
-                        session.add(emp)
-                        new_count += 1
-                    else:
-                        if emp.first_name != u.name and u.name:
-                            emp.first_name = u.name
-                            updated_count += 1
-                
-                session.commit()
-                session.close()
+                new_count, updated_count = db_writer.call(store)
                 
                 self.load_employees()
                 QMessageBox.information(self, "Success", f"Synced {len(users)} users. {new_count} new, {updated_count} updated.")
@@ -517,12 +435,34 @@ class AttendancePage(QWidget):
         self.refresh_btn.setObjectName("ActionButton")
         
         self.refresh_btn.clicked.connect(self.refresh_attendance)
+        self.export_btn = QPushButton("Export to Excel")
+        self.export_btn.clicked.connect(self.export_excel)
         
         filters.addWidget(self.date_filter)
         filters.addWidget(self.refresh_btn)
+        filters.addWidget(self.export_btn)
         filters.addStretch()
         layout.addLayout(filters)
 
+        # Export range; the export streams straight from the database, not from the table
+        export_row = QHBoxLayout()
+        export_row.addWidget(QLabel("Export from:"))
+        self.export_start = QDateEdit()
+        self.export_start.setCalendarPopup(True)
+        self.export_start.setDate(QDate.currentDate().addYears(-1))
+        export_row.addWidget(self.export_start)
+        export_row.addWidget(QLabel("to:"))
+        self.export_end = QDateEdit()
+        self.export_end.setCalendarPopup(True)
+        self.export_end.setDate(QDate.currentDate())
+        export_row.addWidget(self.export_end)
+        self.export_progress = QProgressBar()
+        self.export_progress.setVisible(False)
+        export_row.addWidget(self.export_progress)
+        export_row.addStretch()
+        layout.addLayout(export_row)
+        self.export_worker = None
+
         self.table = AttendanceTable()
         layout.addWidget(self.table)
         
@@ -533,34 +473,28 @@ class AttendancePage(QWidget):
 
     def load_from_db(self):
         from database.connection import db_manager
-        from database.models import AttendanceRecord, Employee
+        from database.rows import punch_rows
+        from utils.formatting import punch_table_rows
+        from datetime import datetime
         
         try:
-            session_factory = db_manager.get_session()
+            session_factory = db_manager.get_read_session()
             session = session_factory()
             
             filter_date = self.date_filter.text().strip()
             
-            query = session.query(AttendanceRecord).join(Employee)
-            # Add filtering if needed, but for now just load all
-            records = query.order_by(AttendanceRecord.punch_time.desc()).all()
+            if filter_date:
+                try:
+                    day = datetime.strptime(filter_date, '%Y-%m-%d').date()
+                except ValueError:
+                    # Nothing can match a date that is not YYYY-MM-DD
+                    self.table.load_data([])
+                    return
+                records = punch_rows(session, day=day)
+            else:
+                records = punch_rows(session)
             
-            formatted_data = []
-            for rec in records:
-                date_str = rec.punch_time.strftime('%Y-%m-%d')
-                
-                if filter_date and filter_date != date_str:
-                    continue
-                    
-                formatted_data.append({
-                    'uid': rec.employee.employee_number,
-                    'name': f"{rec.employee.first_name} {rec.employee.last_name}",
-                    'date': date_str,
-                    'time': rec.punch_time.strftime('%H:%M:%S'),
-                    'type': 'Check-In' if rec.punch_type == 'in' else 'Check-Out',
-                    'device': f"Device {rec.device_id}",
-                    'status': rec.status
-                })
+            formatted_data = punch_table_rows(records)
             
             self.table.load_data(formatted_data)
         except Exception as e:
@@ -569,12 +503,55 @@ class AttendancePage(QWidget):
             if 'session' in locals():
                 session.close()
 
+    def export_excel(self):
+        from reports.excel import export_attendance
+
+        if self.export_worker is not None and self.export_worker.isRunning():
+            self.export_worker.cancel()
+            return
+        start = self.export_start.date().toPyDate()
+        end = self.export_end.date().toPyDate()
+        path, selected = QFileDialog.getSaveFileName(
+            self, "Export Attendance", f"attendance_{start}_{end}.xlsx",
+            "Excel Workbook (*.xlsx);;Compressed Excel Workbook (*.xlsx.gz)")
+        if not path:
+            return
+        compress = selected.startswith("Compressed")
+        if compress and path.endswith('.gz'):
+            path = path[:-3]
+
+        self.export_worker = ReportWorker(
+            lambda progress: export_attendance(path, start, end, compress=compress, progress=progress), self)
+        self.export_worker.progress.connect(self.on_export_progress)
+        self.export_worker.finished_report.connect(self.on_export_finished)
+        self.export_worker.cancelled.connect(self.reset_export_ui)
+        self.export_worker.failed.connect(self.on_export_failed)
+        self.export_btn.setText("Cancel Export")
+        self.export_progress.setRange(0, 0)
+        self.export_progress.setVisible(True)
+        self.export_worker.start()
+
+    def on_export_progress(self, done, total):
+        self.export_progress.setRange(0, total)
+        self.export_progress.setValue(done)
+
+    def on_export_finished(self, path):
+        self.reset_export_ui()
+        QMessageBox.information(self, "Export", f"Attendance exported to:\n{path}")
+
+    def on_export_failed(self, message):
+        self.reset_export_ui()
+        QMessageBox.critical(self, "Export Error", f"Could not export attendance: {message}")
+
+    def reset_export_ui(self):
+        self.export_btn.setText("Export to Excel")
+        self.export_progress.setVisible(False)
+
     def refresh_attendance(self):
         from devices.identix_k20 import IdentiXK20Adapter
         from PyQt6.QtWidgets import QMessageBox
         from database.connection import db_manager
-        from database.models import AttendanceRecord, Employee, Organization, Department
-        from datetime import datetime
+        from services.sync_service import sync_service
 
         default_ip = "192.168.1.1" 
         
@@ -585,89 +562,24 @@ class AttendancePage(QWidget):
         try:
             device = IdentiXK20Adapter(default_ip, timeout=5)
             if device.connect():
-                records = device.get_attendance()
-                users = device.get_users()
-                device.disconnect()
-
-                if not records:
-                    QMessageBox.information(self, "Attendance", "No new records found on the device.")
-                    self.refresh_btn.setEnabled(True)
-                    self.refresh_btn.setText("Refresh Records")
-                    return
-
                 session_factory = db_manager.get_session()
                 session = session_factory()
-
-                # Ensure we have an organization and department (stub)
-                org = session.query(Organization).first()
-                if not org:
-                    org = Organization(name="Default Org", code="DEFAULT")
-                    session.add(org)
-                    session.flush()
-                
-                dept = session.query(Department).first()
-                if not dept:
-                    dept = Department(organization_id=org.id, name="General", code="GEN")
-                    session.add(dept)
-                    session.flush()
-
-                # Sync users to Employees
-                user_map = {} # uid -> employee_id
-                for u in users:
-                    emp = session.query(Employee).filter_by(employee_number=str(u.user_id)).first()
-                    if not emp:
-                        emp = Employee(
-                            organization_id=org.id,
-                            department_id=dept.id,
-                            employee_number=str(u.user_id),
-                            first_name=u.name or "User",
-                            last_name=str(u.user_id),
-                            status='active'
-                        )
-                        session.add(emp)
-                        session.flush()
-                    user_map[str(u.user_id)] = emp.id
-
-                # Save attendance records
-                new_count = 0
-                for rec in records:
-                    uid = str(getattr(rec, 'user_id', ''))
-                    if uid not in user_map:
-                        continue # Skip if user not found (shouldn't happen)
-                    
-                    punch_time = getattr(rec, 'timestamp', None)
-                    if not punch_time: continue
-
-                    # Check for duplicate
-                    existing = session.query(AttendanceRecord).filter_by(
-                        employee_id=user_map[uid],
-                        punch_time=punch_time
-                    ).first()
-                    
-                    if not existing:
-                        # Map punch type
-                        # 0: Check-In, 1: Check-Out, 4: Check-In, 5: Check-Out (sometimes)
-                        # We'll use 0 as 'in' and anything else as 'out' for now, 
-                        # but let's be more inclusive if possible.
-                        p_val = getattr(rec, 'punch', 0)
-                        p_type = 'in' if p_val in [0, 4] else 'out'
-                        
-                        new_rec = AttendanceRecord(
-                            employee_id=user_map[uid],
-                            device_id=1, # Stub device id
-                            punch_time=punch_time,
-                            punch_type=p_type,
-                            status='valid'
-                        )
-                        session.add(new_rec)
-                        new_count += 1
-                
-                session.commit()
-                session.close()
+                try:
+                    org, dept = sync_service.ensure_defaults(session)
+                    device_row = sync_service.get_or_register_device(session, org, device)
+                    # Users are only downloaded when the device counters changed
+                    result = sync_service.sync_device(session, device, device_row, org, dept)
+                finally:
+                    session.close()
+                    device.disconnect()
+
+                if not result['records']:
+                    QMessageBox.information(self, "Attendance", "No new records found on the device.")
+                    return
                 
                 # Reload UI from DB
                 self.load_from_db()
-                QMessageBox.information(self, "Success", f"Synced {len(records)} records. {new_count} new records added.")
+                QMessageBox.information(self, "Success", f"Synced {result['records']} records. {result['new_records']} new records added.")
             else:
                 QMessageBox.warning(self, "Connection Error", f"Failed to connect to device at {default_ip}")
         except Exception as e:
@@ -781,6 +693,39 @@ class DevicesPage(QWidget):
         except Exception as e:
             self.console_output.setText(f"❌ Error fetching attendance: {str(e)}")
 
+class ReportWorker(QThread):
+    """
+    Runs a report or export off the GUI thread. `render` is called with a
+    progress(done, total) callback and returns the written path, or None if
+    the callback asked it to stop.
+    """
+    progress = pyqtSignal(int, int)
+    finished_report = pyqtSignal(str)
+    cancelled = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    def __init__(self, render, parent=None):
+        super().__init__(parent)
+        self.render = render
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def run(self):
+        def on_progress(done, total):
+            self.progress.emit(done, total)
+            return not self._cancelled
+
+        try:
+            path = self.render(on_progress)
+            if path:
+                self.finished_report.emit(path)
+            else:
+                self.cancelled.emit()
+        except Exception as e:
+            self.failed.emit(str(e))
+
 class ReportsPage(QWidget):
     def __init__(self):
         super().__init__()
@@ -791,18 +736,29 @@ class ReportsPage(QWidget):
         header.setObjectName("HeaderTitle")
         layout.addWidget(header)
 
+        # Reference day: the daily report's date, the month for monthly reports
+        date_row = QHBoxLayout()
+        date_row.addWidget(QLabel("Report date:"))
+        self.report_date = QDateEdit()
+        self.report_date.setCalendarPopup(True)
+        self.report_date.setDate(QDate.currentDate())
+        date_row.addWidget(self.report_date)
+        date_row.addStretch()
+        layout.addLayout(date_row)
+
         # Report Types
         report_grid = QGridLayout()
         report_grid.setSpacing(20)
 
         reports = [
-            ("Daily Attendance Report", "Summary of late/absent employees for today"),
-            ("Monthly Leave Summary", "Overview of leave balances and types"),
-            ("Employee Working Hours", "Detailed breakdown of payroll hours"),
-            ("Device Sync Logs", "History of device communication and errors")
+            ("daily_attendance", "Daily Attendance Report", "Summary of late/absent employees for today"),
+            ("leave_summary", "Monthly Leave Summary", "Overview of leave balances and types"),
+            ("working_hours", "Employee Working Hours", "Detailed breakdown of payroll hours"),
+            ("sync_logs", "Device Sync Logs", "History of device communication and errors")
         ]
 
-        for i, (title, desc) in enumerate(reports):
+        self.report_buttons = []
+        for i, (key, title, desc) in enumerate(reports):
             card = QFrame()
             card.setObjectName("Card")
             card_layout = QVBoxLayout(card)
@@ -814,6 +770,8 @@ class ReportsPage(QWidget):
             
             gen_btn = QPushButton("Generate PDF")
             gen_btn.setObjectName("ActionButton")
+            gen_btn.clicked.connect(lambda checked=False, k=key: self.generate_report(k))
+            self.report_buttons.append(gen_btn)
             
             card_layout.addWidget(t_lbl)
             card_layout.addWidget(d_lbl)
@@ -823,8 +781,78 @@ class ReportsPage(QWidget):
             report_grid.addWidget(card, i // 2, i % 2)
 
         layout.addLayout(report_grid)
+
+        # Progress of the report being generated
+        progress_row = QHBoxLayout()
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setVisible(False)
+        self.cancel_btn = QPushButton("Cancel")
+        self.cancel_btn.setVisible(False)
+        self.cancel_btn.clicked.connect(self.cancel_report)
+        progress_row.addWidget(self.progress_bar)
+        progress_row.addWidget(self.cancel_btn)
+        layout.addLayout(progress_row)
+        self.status_lbl = QLabel("")
+        self.status_lbl.setStyleSheet("color: #666666;")
+        layout.addWidget(self.status_lbl)
         layout.addStretch()
 
+        self.worker = None
+
+    def generate_report(self, report_key):
+        from reports.pdf import render_pdf, report_path
+        from reports.sources import default_params
+
+        if self.worker is not None and self.worker.isRunning():
+            return
+        params = default_params(report_key, self.report_date.date().toPyDate())
+        path, _ = QFileDialog.getSaveFileName(self, "Save Report", report_path(report_key, params), "PDF Files (*.pdf)")
+        if not path:
+            return
+
+        self.worker = ReportWorker(lambda progress: render_pdf(report_key, params, path, progress=progress), self)
+        self.worker.progress.connect(self.on_report_progress)
+        self.worker.finished_report.connect(self.on_report_finished)
+        self.worker.cancelled.connect(self.on_report_cancelled)
+        self.worker.failed.connect(self.on_report_failed)
+        for btn in self.report_buttons:
+            btn.setEnabled(False)
+        self.progress_bar.setRange(0, 0) # busy until the first block is rendered
+        self.progress_bar.setVisible(True)
+        self.cancel_btn.setVisible(True)
+        self.status_lbl.setText("Generating report...")
+        self.worker.start()
+
+    def cancel_report(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.status_lbl.setText("Cancelling...")
+
+    def on_report_progress(self, done, total):
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(done)
+        self.status_lbl.setText(f"Rendered {done} of {total} rows...")
+
+    def on_report_finished(self, path):
+        self.reset_report_ui()
+        self.status_lbl.setText(f"Report saved to {path}")
+        QMessageBox.information(self, "Report", f"Report saved to:\n{path}")
+
+    def on_report_cancelled(self):
+        self.reset_report_ui()
+        self.status_lbl.setText("Report cancelled.")
+
+    def on_report_failed(self, message):
+        self.reset_report_ui()
+        self.status_lbl.setText(message)
+        QMessageBox.critical(self, "Report Error", f"Could not generate the report: {message}")
+
+    def reset_report_ui(self):
+        for btn in self.report_buttons:
+            btn.setEnabled(True)
+        self.progress_bar.setVisible(False)
+        self.cancel_btn.setVisible(False)
+
 class DatabasesPage(QWidget):
     def __init__(self):
         super().__init__()
@@ -1108,7 +1136,7 @@ class SettingsPage(QWidget):
         from database.models import AdminUser
         
         try:
-            session_factory = db_manager.get_session()
+            session_factory = db_manager.get_read_session()
             session = session_factory()
             admins = session.query(AdminUser).all()
             
@@ -1137,8 +1165,8 @@ class SettingsPage(QWidget):
             print(f"Error loading admins: {e}")
 
     def add_admin(self):
-        from database.connection import db_manager
         from database.models import AdminUser
+        from database.writer import db_writer
         
         user = self.new_admin_user.text().strip()
         pwd = self.new_admin_pass.text().strip()
@@ -1148,20 +1176,17 @@ class SettingsPage(QWidget):
             QMessageBox.warning(self, "Validation", "Username and Password are required.")
             return
             
-        try:
-            session_factory = db_manager.get_session()
-            session = session_factory()
-            
-            # Check exist
+        def store(session):
+            # Checked by the writer, so two adds of one name cannot both pass
             if session.query(AdminUser).filter_by(username=user).first():
+                return False
+            session.add(AdminUser(username=user, password_hash=pwd, role=role))
+            return True
+
+        try:
+            if not db_writer.call(store):
                 QMessageBox.warning(self, "Error", "Username already exists.")
-                session.close()
                 return
-                
-            new_admin = AdminUser(username=user, password_hash=pwd, role=role)
-            session.add(new_admin)
-            session.commit()
-            session.close()
             
             self.new_admin_user.clear()
             self.new_admin_pass.clear()
@@ -1172,23 +1197,20 @@ class SettingsPage(QWidget):
             QMessageBox.critical(self, "Error", f"Could not add admin: {str(e)}")
 
     def delete_admin(self, admin_id):
-        from database.connection import db_manager
         from database.models import AdminUser
+        from database.writer import db_writer
         
         confirm = QMessageBox.question(self, "Confirm Delete", "Are you sure you want to delete this admin?",
                                      QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
         
         if confirm == QMessageBox.StandardButton.Yes:
-            try:
-                session_factory = db_manager.get_session()
-                session = session_factory()
-                
+            def delete(session):
                 admin = session.query(AdminUser).get(admin_id)
                 if admin:
                     session.delete(admin)
-                    session.commit()
-                
-                session.close()
+
+            try:
+                db_writer.call(delete)
                 self.load_admins()
                 
             except Exception as e: